@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Measure event-loop lag while synchronous model streams are consumed, inline versus through the stream bridge.
+
+Each simulated stream blocks for ``token_delay`` per event, like a sync agno
+stream waiting on the model. Run from the backend directory:
+    python bench_loop_lag.py [streams] [events] [token_delay]
+"""
+import asyncio
+import sys
+import time
+
+from service.loop_monitor import LoopLagMonitor
+from service.metrics import MetricsFactory
+from task.stream_bridge import StreamBridge
+
+metrics = MetricsFactory.get_instance()
+
+
+def fake_stream(events: int, token_delay: float):
+    for i in range(events):
+        time.sleep(token_delay)
+        yield i
+
+
+async def consume(bridge: StreamBridge, events: int, token_delay: float):
+    async for _ in bridge.iterate(fake_stream(events, token_delay)):
+        pass
+
+
+async def run_case(mode: str, streams: int, events: int, token_delay: float) -> dict:
+    bridge = StreamBridge(max_workers=streams, mode=mode)
+    monitor = LoopLagMonitor(interval=0.01)
+    metrics.timings.pop("event_loop.lag", None)
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(consume(bridge, events, token_delay) for _ in range(streams)))
+    elapsed = time.perf_counter() - started
+    # Let the probe see the loop idle once more
+    await asyncio.sleep(0.02)
+    monitor.stop()
+    bridge.executor.shutdown()
+    lag = metrics.timings["event_loop.lag"].to_dict()
+    return {"elapsed": elapsed, **lag}
+
+
+async def main(streams: int, events: int, token_delay: float):
+    print(f"{streams} streams x {events} events, {token_delay * 1000:.0f} ms per event")
+    print(f"{'mode':<10}{'elapsed':>10}{'lag p50':>12}{'lag p99':>12}{'lag max':>12}")
+    for mode in ("inline", "thread"):
+        result = await run_case(mode, streams, events, token_delay)
+        print(f"{mode:<10}{result['elapsed']:>9.2f}s{result['p50'] * 1000:>10.1f}ms"
+              f"{result['p99'] * 1000:>10.1f}ms{result['max'] * 1000:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(main(
+        int(args[0]) if len(args) > 0 else 8,
+        int(args[1]) if len(args) > 1 else 50,
+        float(args[2]) if len(args) > 2 else 0.01,
+    ))
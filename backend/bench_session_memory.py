@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Measure the memory cost of idle sessions, before and after compacting SessionTask.
+
+Run from the backend directory:
+    python bench_session_memory.py [sessions]
+"""
+import asyncio
+import gc
+import sys
+import tracemalloc
+
+from models.types import SessionTask, UserInputRequest
+
+
+class EagerUserInputRequest:
+    """UserInputRequest as it was: a per-instance __dict__ and an eager Event."""
+    def __init__(self, fields):
+        self.fields = fields
+        self.event = asyncio.Event()
+        self.values = None
+
+
+class EagerSessionTask:
+    """SessionTask as it was: a per-instance __dict__ and four eager Events."""
+    def __init__(self, user_query: str):
+        self.cancel_event = asyncio.Event()
+        self.confirm_event = asyncio.Event()
+        self.confirmed = None
+        self.input_request = None
+        self.websocket_ready = asyncio.Event()
+        self.task_started = asyncio.Event()
+        self.connection_count = 0
+        self.user_query = user_query
+
+
+def measure(make, count: int) -> float:
+    """Bytes allocated per object made by ``make(i)``, averaged over ``count``."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [make(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # The list holding them is not part of the cost
+    per_object = (after - before - sys.getsizeof(objects)) / count
+    del objects
+    return per_object
+
+
+def idle(task_class):
+    # The query string is shared, so only the session itself is measured
+    return lambda i: task_class("query")
+
+
+def paused_for_input(task_class, input_class):
+    def make(i):
+        task = task_class("query")
+        task.input_request = input_class([])
+        return task
+    return make
+
+
+async def main(count: int):
+    cases = [
+        ("idle session", idle(EagerSessionTask), idle(SessionTask)),
+        ("paused for input", paused_for_input(EagerSessionTask, EagerUserInputRequest),
+         paused_for_input(SessionTask, UserInputRequest)),
+    ]
+    print(f"{count} sessions per case")
+    print(f"{'case':<20}{'before':>12}{'after':>12}{'saved':>10}")
+    for name, make_before, make_after in cases:
+        before = measure(make_before, count)
+        after = measure(make_after, count)
+        print(f"{name:<20}{before:>10.0f} B{after:>10.0f} B{1 - after / before:>10.0%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
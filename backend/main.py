@@ -6,6 +6,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from routers.websocket import ws_router
 from routers.chat import chat_router
 from routers.secret import secret_router
+from routers.metrics import metrics_router
+from service.loop_monitor import LoopLagMonitorFactory
+from task.process_executor import ProcessExecutorFactory
 
 
 # ws_manager = WebSocketManagerFactory.get_instance()
@@ -25,6 +28,16 @@ app.add_middleware(
 app.include_router(ws_router)
 app.include_router(chat_router)
 app.include_router(secret_router)
+app.include_router(metrics_router)
+
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    # Reported as event_loop.lag in /api/metrics
+    LoopLagMonitorFactory.get_instance().start()
+
+@app.on_event("shutdown")
+async def stop_worker_processes():
+    ProcessExecutorFactory.get_instance().shutdown()
 
 # async def long_running_task(session_id: str):
 #     task = session_manager.get_task(session_id)
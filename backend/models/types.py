@@ -1,28 +1,98 @@
 import asyncio
+import time
 from pydantic import BaseModel
 from typing import Optional
 
+class FlagEvent:
+    """
+    An ``asyncio.Event``-like view of one bit of its owner's ``flags``.
+
+    The real ``asyncio.Event`` (and its waiter deque) is only created when
+    something waits for a flag that is not set yet, so an object that is never
+    waited on pays one int for all its flags instead of one Event each.
+    """
+    __slots__ = ("owner", "bit")
+
+    def __init__(self, owner, bit: int):
+        self.owner = owner
+        self.bit = bit
+
+    def is_set(self) -> bool:
+        return bool(self.owner.flags & self.bit)
+
+    def set(self):
+        self.owner.flags |= self.bit
+        waiters = self.owner.waiters
+        if waiters:
+            event = waiters.pop(self.bit, None)
+            if event:
+                event.set()
+
+    def clear(self):
+        self.owner.flags &= ~self.bit
+
+    async def wait(self) -> bool:
+        if self.owner.flags & self.bit:
+            return True
+        waiters = self.owner.waiters
+        if waiters is None:
+            waiters = self.owner.waiters = {}
+        event = waiters.get(self.bit)
+        if event is None:
+            event = waiters[self.bit] = asyncio.Event()
+        await event.wait()
+        return True
+
+class EventFlag:
+    """Class attribute that exposes one bit of ``flags`` as a ``FlagEvent``."""
+    def __init__(self, bit: int):
+        self.bit = bit
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return FlagEvent(obj, self.bit)
+
 class UserInputRequest:
+    __slots__ = ("fields", "values", "flags", "waiters")
+
+    event = EventFlag(1)  # Set once the user sent the values
+
     def __init__(self, fields):
         self.fields = fields  # List of dicts: {name, description, type, value}
-        self.event = asyncio.Event()
         self.values = None
+        self.flags = 0
+        self.waiters = None  # bit -> asyncio.Event, only while something waits
 
 class SessionTask:
     """
     Represents a session task with user query and state management.
     This class is used to manage the state of a task, including user confirmation,
     dynamic input requests, and WebSocket connection readiness.
+
+    Slotted and compact, since a worker may hold tens of thousands of idle
+    sessions: the events are bits of ``flags`` and only get a real
+    ``asyncio.Event`` while something waits on them.
     """
+    __slots__ = ("flags", "waiters", "confirmed", "input_request", "connection_count", "user_query", "owner", "created_at", "disconnect_timer")
+
+    cancel_event = EventFlag(1)
+    confirm_event = EventFlag(2)
+    websocket_ready = EventFlag(4)  # Ensure WebSocket is connected before starting
+    task_started = EventFlag(8)  # Track if background task has started
+    client_acknowledged = EventFlag(16)  # Client has replayed state and is ready for the run
+
     def __init__(self, user_query: str):
-        self.cancel_event = asyncio.Event()
-        self.confirm_event = asyncio.Event()
+        self.flags = 0
+        self.waiters = None  # bit -> asyncio.Event, only while something waits
         self.confirmed = None
         self.input_request = None  # For dynamic user input
-        self.websocket_ready = asyncio.Event()  # Ensure WebSocket is connected before starting
-        self.task_started = asyncio.Event()  # Track if background task has started
         self.connection_count = 0  # Track reconnections
         self.user_query = user_query  # Store the user's query
+        self.owner = None  # Worker running the task, if it is not this one
+        self.created_at = time.perf_counter()  # When the task was requested, for start latency
+        self.disconnect_timer = None  # Tears the session down unless a client reconnects first
 
 class StartTaskRequest(BaseModel):
-    query: str
\ No newline at end of file
+    query: str
+    speculative: Optional[bool] = None  # Start before the WebSocket connects; None uses SPECULATIVE_START
\ No newline at end of file
@@ -1,14 +1,14 @@
 import asyncio
-from typing import AsyncIterator
-from fastapi import APIRouter, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, BackgroundTasks, Request
+from fastapi.responses import JSONResponse, Response
 from models.types import StartTaskRequest
 from service.session_manager import SessionManagerFactory
 from service.websocket_manager import WebSocketManagerFactory
+from service.serialization import encode_with_raw_list
+from service.timer_wheel import TimerWheelFactory
 
 from agno.agent import Agent
 from agno.team import Team
-from agno.agent import RunResponseEvent
 from agno.tools.duckduckgo import DuckDuckGoTools
 from agno.tools.googlesearch import GoogleSearchTools
 from agno.tools.reasoning import ReasoningTools
@@ -16,12 +16,21 @@ from agno.tools.mcp import MCPTools, MultiMCPTools
 from tool import get_user_input
 
 from config import create_azure_openai_model
-from task.task_manager import start_background_task, request_confirmation
+from task.task_manager import start_background_task, route_client_message
+from task.admission import AdmissionControllerFactory
+from task.scheduler import tenant_of
+from task.pipeline import StreamingPipeline, RunnerSource, default_stages
+from task.process_executor import ProcessExecutorFactory
+from task.run_registry import RunRegistryFactory
 
 chat_router = APIRouter(prefix="/api/chat", tags=["chat"])
 
 session_manager = SessionManagerFactory.get_instance()
 ws_manager = WebSocketManagerFactory.get_instance()
+timer_wheel = TimerWheelFactory.get_instance()
+admission = AdmissionControllerFactory.get_instance()
+process_executor = ProcessExecutorFactory.get_instance()
+run_registry = RunRegistryFactory.get_instance()
 
 async def agent_handler(session_id: str, user_query: str): 
     print(f"FROM ARGS: Starting simulated chat completion for session {session_id} with query: {user_query}")
@@ -33,7 +42,8 @@ async def agent_handler(session_id: str, user_query: str):
     # Wait for WebSocket to be ready if not called from wait_for_connection_and_start_task
     if not task.task_started.is_set():
         try:
-            await asyncio.wait_for(task.websocket_ready.wait(), timeout=10.0) 
+            async with timer_wheel.timeout(10.0):
+                await task.websocket_ready.wait()
         except asyncio.TimeoutError:
             print(f"Timeout waiting for WebSocket for session {session_id}")
             return
@@ -82,70 +92,10 @@ async def agent_handler(session_id: str, user_query: str):
             reasoning=True
         ) 
 
-        # Initial async run with user's query
-        for run_response in agent.run(user_query, stream=True, stream_intermediate_steps=True):
-            # Check for cancellation at the start of each iteration
-            if task.cancel_event.is_set(): 
-                print(f"Task {session_id} cancelled during agent run")
-                await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                return  # Clean return instead of raising exception
-
-            # Handle paused states (confirmations, user input, etc.)
-            if run_response.is_paused:
-                print(f"Task {session_id} is paused. Waiting for user input or confirmation...")
-
-                for tool in agent.run_response.tools_requiring_confirmation:
-                    # Check for cancellation before requesting confirmation
-                    if task.cancel_event.is_set():
-                        print(f"Task {session_id} cancelled during confirmation request")
-                        await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                        return  # Clean return instead of raising exception
-
-                    print(f"Tool name [bold blue]{tool.tool_name}({tool.tool_args})[/] requires confirmation.")
-                    confirmation_message = (
-                        f"Agent is trying to access {tool.tool_name} with query {tool.tool_args}. Do you want to proceed?"
-                    )
-                    await request_confirmation(session_id, confirmation_message)
-
-                    # Check for cancellation after confirmation request
-                    if task.cancel_event.is_set():
-                        print(f"Task {session_id} cancelled during confirmation wait")
-                        await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                        return  # Clean return instead of raising exception
-
-                    if not task.confirmed:
-                        tool.confirmed = False
-                    else:
-                        tool.confirmed = True
-
-                # continue the run after confirmation
-                run_response = agent.continue_run(stream=True)
-
-            # check if run_response is RunResponseEvent event type
-            if isinstance(run_response, RunResponseEvent): 
-                if run_response.content is not None:
-                    # Check for cancellation before sending
-                    if task.cancel_event.is_set():
-                        print(f"Task {session_id} was cancelled during streaming")
-                        await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                        return  # Clean return instead of raising exception
-
-                    chunk_dist = run_response.to_dict()
-                    await ws_manager.send_json(session_id, {"type": "task_progress", "data": chunk_dist}, save_state=True)
-
-            else: 
-                # Stream the response
-                for chunk in run_response:
-                    # Check for cancellation before each chunk
-                    if task.cancel_event.is_set():
-                        print(f"Task {session_id} was cancelled during chunk streaming")
-                        await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                        return  # Clean return instead of raising exception
-
-                    if chunk.content is not None:
-                        chunk_dist = chunk.to_dict()
-                        await ws_manager.send_json(session_id, {"type": "task_progress", "data": chunk_dist}, save_state=True)
-                
+        # Stream the run to the client; returns False once it was cancelled
+        if not await StreamingPipeline(RunnerSource(agent, user_query)).run(session_id, task):
+            return
+
         # Final check before completion
         if task.cancel_event.is_set():
             await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
@@ -174,8 +124,9 @@ async def agent_handler(session_id: str, user_query: str):
             print(f"Task {session_id} cleanup after cancellation")
         else:
             print(f"Task {session_id} cleanup after completion")
-        # Only cleanup if task still exists (might have been cleaned up by cancel endpoint)
-        if session_manager.get_task(session_id):
+        # Only cleanup if task still exists (might have been cleaned up by cancel endpoint);
+        # a speculative run nobody has connected to yet is cleaned up once its client has
+        if session_manager.get_task(session_id) and task.websocket_ready.is_set():
             session_manager.cleanup_session(session_id)
 
 async def agent_with_mcp_handler(session_id: str, user_query: str):
@@ -188,7 +139,8 @@ async def agent_with_mcp_handler(session_id: str, user_query: str):
     # Wait for WebSocket to be ready if not called from wait_for_connection_and_start_task
     if not task.task_started.is_set():
         try:
-            await asyncio.wait_for(task.websocket_ready.wait(), timeout=10.0) 
+            async with timer_wheel.timeout(10.0):
+                await task.websocket_ready.wait()
         except asyncio.TimeoutError:
             print(f"Timeout waiting for WebSocket for session {session_id}")
             return
@@ -237,73 +189,12 @@ async def agent_with_mcp_handler(session_id: str, user_query: str):
                 add_datetime_to_instructions=True,
             )
 
-            response_stream: AsyncIterator[RunResponseEvent] = await agent.arun(
-                user_query,
-                stream=True,
-                stream_intermediate_steps=True
+            pipeline = StreamingPipeline(
+                RunnerSource(agent, user_query, use_async=True, continue_kwargs={"stream": True, "stream_intermediate_steps": True}),
+                stages=default_stages(notify_pause=True),
             )
-            
-            async for run_response in response_stream:
-                # Check for cancellation at the start of each iteration
-                if task.cancel_event.is_set(): 
-                    print(f"Task {session_id} cancelled during agent run")
-                    await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                    return
-                # Handle paused states (confirmations, user input, etc.)
-                if run_response.is_paused:
-                    print(f"Task {session_id} is paused")
-                    await ws_manager.send_json(session_id, {"type": "task_paused", "content": "Task is paused, waiting for user input."}, save_state=True)
-                    
-                    for tool in agent.run_response.tools_requiring_confirmation:
-                        # Check for cancellation before requesting confirmation
-                        if task.cancel_event.is_set():
-                            print(f"Task {session_id} cancelled during confirmation request")
-                            await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                            return
-                        
-                        print(f"Tool name [bold blue]{tool.tool_name}({tool.tool_args})[/] requires confirmation.")
-                        confirmation_message = (
-                            f"Agent is trying to access {tool.tool_name} with query {tool.tool_args}. Do you want to proceed?"
-                        )
-                        await request_confirmation(session_id, confirmation_message)
-
-                        # Check for cancellation after confirmation request
-                        if task.cancel_event.is_set():
-                            print(f"Task {session_id} cancelled during confirmation wait")
-                            await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                            return
-
-                        if not task.confirmed:
-                            print(f"User did not confirm tool {tool.tool_name}, setting confirmed to False")
-                            tool.confirmed = False
-                        else:
-                            print(f"User confirmed tool {tool.tool_name}, setting confirmed to True")
-                            tool.confirmed = True
-
-                    # continue the run after confirmation
-                    run_response = agent.continue_run(stream=True, stream_intermediate_steps=True)
-                
-                # check if run_response is RunResponseEvent event type
-                if isinstance(run_response, RunResponseEvent): 
-                    if run_response.content is not None:
-                        # Check for cancellation before sending
-                        if task.cancel_event.is_set():
-                            print(f"Task {session_id} was cancelled during streaming")
-                            await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                            return
-                        chunk_dist = run_response.to_dict()
-                        await ws_manager.send_json(session_id, {"type": "task_progress", "data": chunk_dist}, save_state=True)
-                else:
-                    # Stream the response
-                    for chunk in run_response:
-                        # Check for cancellation before each chunk
-                        if task.cancel_event.is_set():
-                            print(f"Task {session_id} was cancelled during chunk streaming")
-                            await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                            return
-                        if chunk.content is not None:
-                            chunk_dist = chunk.to_dict()
-                            await ws_manager.send_json(session_id, {"type": "task_progress", "data": chunk_dist}, save_state=True)
+            if not await pipeline.run(session_id, task):
+                return
             # Final check before completion
             if task.cancel_event.is_set():
                 await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
@@ -339,7 +230,8 @@ async def team_handler(session_id: str, user_query: str):
     # Wait for WebSocket to be ready if not called from wait_for_connection_and_start_task
     if not task.task_started.is_set():
         try:
-            await asyncio.wait_for(task.websocket_ready.wait(), timeout=10.0) 
+            async with timer_wheel.timeout(10.0):
+                await task.websocket_ready.wait()
         except asyncio.TimeoutError:
             print(f"Timeout waiting for WebSocket for session {session_id}")
             return
@@ -388,71 +280,10 @@ async def team_handler(session_id: str, user_query: str):
             reasoning=True
         ) 
 
-        # Initial async run with user's query
-        team_stream = team.run(user_query, stream=True, stream_intermediate_steps=True)
-        for run_response in team_stream:
-            # Check for cancellation at the start of each iteration
-            if task.cancel_event.is_set(): 
-                print(f"Task {session_id} cancelled during team run")
-                await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                return  # Clean return instead of raising exception
-
-            # Handle paused states (confirmations, user input, etc.)
-            if run_response.is_paused:
-                print(f"Task {session_id} is paused. Waiting for user input or confirmation...")
-
-                for tool in team.run_response.tools_requiring_confirmation:
-                    # Check for cancellation before requesting confirmation
-                    if task.cancel_event.is_set():
-                        print(f"Task {session_id} cancelled during confirmation request")
-                        await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                        return  # Clean return instead of raising exception
-
-                    print(f"Tool name [bold blue]{tool.tool_name}({tool.tool_args})[/] requires confirmation.")
-                    confirmation_message = (
-                        f"Agent is trying to access {tool.tool_name} with query {tool.tool_args}. Do you want to proceed?"
-                    )
-                    await request_confirmation(session_id, confirmation_message)
-
-                    # Check for cancellation after confirmation request
-                    if task.cancel_event.is_set():
-                        print(f"Task {session_id} cancelled during confirmation wait")
-                        await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                        return  # Clean return instead of raising exception
-
-                    if not task.confirmed:
-                        tool.confirmed = False
-                    else:
-                        tool.confirmed = True
-
-                # continue the run after confirmation
-                run_response = team.continue_run(stream=True)
-
-            # check if run_response is RunResponseEvent event type
-            if isinstance(run_response, RunResponseEvent): 
-                if run_response.content is not None:
-                    # Check for cancellation before sending
-                    if task.cancel_event.is_set():
-                        print(f"Task {session_id} was cancelled during streaming")
-                        await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                        return  # Clean return instead of raising exception
-
-                    chunk_dist = run_response.to_dict()
-                    await ws_manager.send_json(session_id, {"type": "task_progress", "data": chunk_dist}, save_state=True)
-
-            else: 
-                # Stream the response
-                for chunk in run_response:
-                    # Check for cancellation before each chunk
-                    if task.cancel_event.is_set():
-                        print(f"Task {session_id} was cancelled during chunk streaming")
-                        await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
-                        return  # Clean return instead of raising exception
-
-                    if chunk.content is not None:
-                        chunk_dist = chunk.to_dict()
-                        await ws_manager.send_json(session_id, {"type": "task_progress", "data": chunk_dist}, save_state=True)
-                
+        # Stream the run to the client; returns False once it was cancelled
+        if not await StreamingPipeline(RunnerSource(team, user_query)).run(session_id, task):
+            return
+
         # Final check before completion
         if task.cancel_event.is_set():
             await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
@@ -481,8 +312,9 @@ async def team_handler(session_id: str, user_query: str):
             print(f"Task {session_id} cleanup after cancellation")
         else:
             print(f"Task {session_id} cleanup after completion")
-        # Only cleanup if task still exists (might have been cleaned up by cancel endpoint)
-        if session_manager.get_task(session_id):
+        # Only cleanup if task still exists (might have been cleaned up by cancel endpoint);
+        # a speculative run nobody has connected to yet is cleaned up once its client has
+        if session_manager.get_task(session_id) and task.websocket_ready.is_set():
             session_manager.cleanup_session(session_id)
 
 async def workflow_handler(session_id: str, user_query: str):
@@ -490,8 +322,17 @@ async def workflow_handler(session_id: str, user_query: str):
     pass
 
 
+# Handlers by the name used in /completion/{handler_name}; worker processes look them up here too
+HANDLER_MAP = {
+    "agent": agent_handler,
+    "team": team_handler,
+    "workflow": workflow_handler,
+    "agent_with_mcp": agent_with_mcp_handler,
+}
+
+
 @chat_router.post("/completion/{handler_name}")
-async def start_task(request: StartTaskRequest, background_tasks: BackgroundTasks, handler_name: str):
+async def start_task(request: StartTaskRequest, background_tasks: BackgroundTasks, handler_name: str, http_request: Request):
     # Validate and sanitize the user query
     user_query = request.query.strip()
     if not user_query:
@@ -500,26 +341,42 @@ async def start_task(request: StartTaskRequest, background_tasks: BackgroundTask
     if len(user_query) > 500:
         return JSONResponse(status_code=400, content={"error": "Query too long (max 500 characters)"})
     
+    callback_handler = HANDLER_MAP.get(handler_name)
+    if not callback_handler:
+        return JSONResponse(status_code=400, content={"error": f"Invalid handler name: {handler_name}"})
+
+    # Take a place in the handler's queue, scheduled fairly between callers;
+    # shed the request if the queue or the caller's share of it is full
+    tenant = tenant_of(http_request.headers, http_request.client.host if http_request.client else None)
+    queue = admission.queue(handler_name)
+    ticket = queue.reserve(tenant=tenant)
+    if ticket is None:
+        retry_after = queue.retry_after()
+        print(f"Rejecting {handler_name} request from {tenant}: queue full")
+        return JSONResponse(
+            status_code=429,
+            content={"error": "Too many requests, try again later", "retry_after": retry_after},
+            headers={"Retry-After": str(retry_after)},
+        )
+
     session_id, task = session_manager.create_session(user_query)
+    ticket.session_id = session_id
     print(f"Starting task for session {session_id} with query: {user_query}")
 
-    # define handler mapping
-    handler_map = {
-        "agent": agent_handler,
-        "team": team_handler,
-        "workflow": workflow_handler,
-        "agent_with_mcp": agent_with_mcp_handler,
-    }
-    callback_handler = handler_map.get(handler_name)
-    if not callback_handler:
-        return JSONResponse(status_code=400, content={"error": f"Invalid handler name: {handler_name}"})
-    
+    if process_executor.enabled:
+        # Run the handler in a worker process; its messages come back through this one
+        callback_fn, callback_args = process_executor.run, (handler_name, session_id, user_query)
+    else:
+        callback_fn, callback_args = callback_handler, (session_id, user_query)
+
     # Don't start the background task immediately
     # Instead, wait for WebSocket connection to be established
-    start_background_task(background_tasks, {
+    await start_background_task(background_tasks, {
         "session_id": session_id,
-        "callback_fn": callback_handler,
-        "callback_args": (session_id, user_query)
+        "callback_fn": callback_fn,
+        "callback_args": callback_args,
+        "ticket": ticket,
+        "speculative": request.speculative,
     })
     
     return {"session_id": session_id, "query": user_query}
@@ -527,10 +384,19 @@ async def start_task(request: StartTaskRequest, background_tasks: BackgroundTask
 
 @chat_router.post("/cancel/{session_id}")
 async def cancel_task(session_id: str):
-    task = session_manager.get_task(session_id)
+    task = await session_manager.hydrate(session_id)
+    if task and task.owner:
+        # Another worker runs the task; it cancels it like a client cancel
+        print(f"Forwarding cancel for session {session_id} to {task.owner}")
+        await route_client_message(session_id, {"type": "cancel"})
+        if not ws_manager.is_connected(session_id):
+            session_manager.cleanup_session(session_id, local_only=True)
+        return {"status": "cancelled", "session_id": session_id}
     if task:
         print(f"Cancelling task for session {session_id}")
         task.cancel_event.set()
+        # Interrupt the run instead of waiting for it to notice
+        run_registry.cancel(session_id)
         
         # Send cancellation message through WebSocket if connected
         if ws_manager.is_connected(session_id):
@@ -551,13 +417,16 @@ async def get_session_info(session_id: str):
     if not task:
         return JSONResponse(status_code=404, content={"error": "Session not found"})
     
-    state_count = ws_manager.get_session_state_count(session_id)
-    is_connected = session_id in ws_manager.active_connections
+    state_usage = ws_manager.get_session_state_usage(session_id)
+    is_connected = ws_manager.is_connected(session_id)
     
-    return {
+    # Saved messages are already encoded; splice them in instead of re-encoding
+    body = encode_with_raw_list({
         "session_id": session_id,
         "is_connected": is_connected,
-        "saved_state_messages": state_count,
+        "connection_count": ws_manager.connection_count(session_id),
+        "saved_state_messages": state_usage["messages"],
+        "saved_state_bytes": state_usage["estimated_bytes"],
         "task_exists": True,
-        "state_messages": ws_manager.get_session_state(session_id),
-    } 
+    }, "state_messages", ws_manager.get_session_state_payloads(session_id))
+    return Response(content=body, media_type="application/json")
@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+from service.metrics import MetricsFactory
+
+metrics_router = APIRouter(prefix="/api/metrics", tags=["metrics"])
+
+metrics = MetricsFactory.get_instance()
+
+@metrics_router.get("")
+async def get_metrics():
+    """Get process-wide counters, gauges and timings."""
+    return metrics.snapshot()
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from service.session_manager import SessionManagerFactory
 from service.websocket_manager import WebSocketManagerFactory
+from task.task_manager import route_client_message
 
 ws_router = APIRouter(prefix="/api/ws", tags=["websocket"])
 
@@ -9,44 +10,41 @@ ws_manager = WebSocketManagerFactory.get_instance()
 
 @ws_router.websocket("/session/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    task = session_manager.get_task(session_id)
+    # The session may have been created on another worker
+    task = await session_manager.hydrate(session_id)
     if not task:
         await websocket.close()
         return
+    await ws_manager.hydrate(session_id)
         
+    # Resume after the last message the client already has, if it tells us
+    last_seq = websocket.query_params.get("last_seq")
+    last_seq = int(last_seq) if last_seq and last_seq.isdigit() else None
+
     # Connect to WebSocket
-    await ws_manager.connect(session_id, websocket)
+    connection = await ws_manager.connect(session_id, websocket, last_seq)
     
-    # Signal that WebSocket is ready
-    task.connection_count += 1
-    task.websocket_ready.set()
-    print(f"WebSocket connected for session {session_id}, signaling ready")
+    # Signal that WebSocket is ready, to whichever worker runs the task
+    await route_client_message(session_id, {"type": "connection_opened"}, task)
+    session_manager.touch(session_id)
     
     try:
         while True:
             data = await websocket.receive_json()
-            if data.get("type") == "confirm":
-                task.confirmed = data.get("value")
-                task.confirm_event.set()
-            elif data.get("type") == "cancel":
-                print(f"Received cancel message for session {session_id}")
-                task.cancel_event.set()
-                # Send immediate cancellation acknowledgment directly through WebSocket
-                try:
-                    await websocket.send_json({"type": "task_cancelled", "content": "Task cancelled by user."})
-                    print(f"Sent cancellation acknowledgment to session {session_id}")
-                except Exception as e:
-                    print(f"Error sending cancellation acknowledgment: {e}")
-                # Also save to state for replay
-                await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
+            # Any inbound message proves the connection is alive, and the session in use
+            connection.mark_alive()
+            session_manager.touch(session_id)
+            if data.get("type") == "pong":
+                continue
+            if data.get("type") == "cancel":
+                # Acknowledge right away, through the connection's writer like every other message
+                await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=False)
+                print(f"Sent cancellation acknowledgment to session {session_id}")
+                await route_client_message(session_id, data, task)
+                # Deliver the acknowledgment before the socket is let go
+                await connection.drain()
                 break  # Exit the loop after handling cancellation
-            elif data.get("type") == "user_input":
-                if task.input_request:
-                    task.input_request.values = data.get("values")
-                    task.input_request.event.set()
-            elif data.get("type") == "connection_acknowledged":
-                # Client has acknowledged the connection is ready
-                print(f"Client acknowledged connection for session {session_id}")
+            await route_client_message(session_id, data, task)
                 
     except WebSocketDisconnect:
         print(f"WebSocket disconnected for session {session_id}")
@@ -54,22 +52,11 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
         print(f"WebSocket error for session {session_id}: {e}")
     finally:
         # Cleanup WebSocket connection
-        ws_manager.disconnect(session_id)
-        task.connection_count -= 1
-        
-        # Only cancel task and cleanup if no other connections and task hasn't been cancelled by API
-        if task.connection_count <= 0:
-            print(f"No more connections for session {session_id}, checking cleanup")
-            # Only set cancel event if not already cancelled
-            if not task.cancel_event.is_set():
-                task.cancel_event.set()
-                print(f"Setting cancel event for session {session_id}")
-            
-            # Clean up state and session
-            ws_manager.clear_session_state(session_id)
-            session_manager.cleanup_session(session_id)
-        else:
-            print(f"Still have {task.connection_count} connections for session {session_id}")
-            # Reset websocket_ready for next connection
-            task.websocket_ready.clear()
+        ws_manager.disconnect(session_id, websocket)
+        # The worker running the task cancels and cleans up after the last connection
+        await route_client_message(session_id, {"type": "connection_closed"}, task)
 
+        if task.owner and not ws_manager.is_connected(session_id):
+            # Drop this worker's copy of a session another worker runs
+            ws_manager.clear_session_state(session_id, local_only=True)
+            session_manager.cleanup_session(session_id, local_only=True)
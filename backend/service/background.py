@@ -0,0 +1,32 @@
+import asyncio
+
+# Fire-and-forget tasks in flight. The event loop only keeps weak references
+# to tasks, so one nobody holds can be garbage-collected before it finishes.
+background_tasks = set()
+
+
+def spawn(coro, name: str = None) -> asyncio.Task:
+    """
+    Run a coroutine in the background without awaiting it.
+
+    The task is held until it finishes, and an exception it ends with is
+    printed instead of going unobserved.
+
+    Args:
+        coro: The coroutine to run
+        name: What to call it in the error message; defaults to the coroutine's name
+
+    Returns:
+        asyncio.Task: The running task
+    """
+    task = asyncio.create_task(coro)
+    label = name or getattr(coro, "__qualname__", repr(coro))
+    background_tasks.add(task)
+
+    def _done(task: asyncio.Task):
+        background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error in background task {label}: {task.exception()}")
+
+    task.add_done_callback(_done)
+    return task
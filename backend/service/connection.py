@@ -0,0 +1,169 @@
+import asyncio
+import os
+from fastapi import WebSocket
+
+# What to do when a client's outbound queue is full
+BACKPRESSURE_BLOCK = "block"  # producer waits for space (up to its send timeout)
+BACKPRESSURE_DROP = "drop"  # drop queue_position updates, block for everything else
+# close the slow consumer; it can reconnect within SESSION_DISCONNECT_GRACE and resume from its last_seq
+BACKPRESSURE_DISCONNECT = "disconnect"
+BACKPRESSURE_POLICIES = {BACKPRESSURE_BLOCK, BACKPRESSURE_DROP, BACKPRESSURE_DISCONNECT}
+
+WS_OUTBOUND_QUEUE_SIZE = int(os.getenv("WS_OUTBOUND_QUEUE_SIZE", "256"))
+WS_BACKPRESSURE_POLICY = os.getenv("WS_BACKPRESSURE_POLICY", BACKPRESSURE_BLOCK).lower()
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5.0"))
+
+# Messages a slow client may miss because the next one supersedes them. This
+# is all the drop policy sheds. Run events are never dropped: streamed content
+# is not repeated later, and clients do not detect and refill seq gaps, so a
+# dropped task_progress would leave a hole in the answer.
+DROPPABLE_MESSAGE_TYPES = {"queue_position"}
+
+
+def is_droppable(data) -> bool:
+    """Check whether a message may be dropped for a slow client (only queue_position updates)."""
+    return data.get("type") in DROPPABLE_MESSAGE_TYPES
+
+
+class SessionConnection:
+    """
+    A single WebSocket client with a bounded outbound queue.
+
+    Producers only enqueue encoded frames; one writer task per connection drains
+    the queue onto the socket, so a slow browser never holds up the agent that
+    produces its messages.
+
+    When the queue is full, ``policy`` decides what happens: ``block`` waits
+    for space up to the send timeout, ``drop`` sheds ``queue_position``
+    updates and blocks for every other message, and ``disconnect`` closes
+    the socket so the client reconnects and resumes from its ``last_seq``.
+    """
+    def __init__(self, session_id: str, websocket: WebSocket,
+                 queue_size: int = WS_OUTBOUND_QUEUE_SIZE,
+                 policy: str = WS_BACKPRESSURE_POLICY,
+                 send_timeout: float = WS_SEND_TIMEOUT):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.session_id = session_id
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.writer_task = None
+        # The endpoint task reading from this socket, cancelled if a dead socket won't close
+        self.receiver_task = asyncio.current_task()
+        self.closed = False
+        self.dropped_count = 0
+        # Liveness, in event loop time; updated by any inbound message
+        self.last_seen = asyncio.get_running_loop().time()
+        self.last_ping = self.last_seen
+
+    def mark_alive(self):
+        """Record that the client sent something (a pong or any other message)."""
+        self.last_seen = asyncio.get_running_loop().time()
+
+    def start(self, replay=None):
+        """
+        Start the writer task draining the outbound queue.
+
+        Args:
+            replay: Optional iterable of encoded frames sent before anything
+                queued. It is consumed lazily, one frame at a time.
+        """
+        if self.writer_task is None:
+            self.writer_task = asyncio.create_task(self._writer(replay))
+
+    def try_enqueue(self, frame: bytes) -> bool:
+        """Queue a frame if there is room, without waiting."""
+        if self.closed:
+            return True  # Nothing to wait for on a closed connection
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def enqueue(self, frame: bytes, droppable: bool = False, timeout: float = WS_SEND_TIMEOUT) -> bool:
+        """
+        Queue an encoded frame for delivery, applying the backpressure policy if full.
+
+        Args:
+            frame: Encoded message or batch
+            droppable: Whether the frame may be dropped (see ``is_droppable``)
+            timeout: How long a blocked producer may wait for queue space
+
+        Returns:
+            bool: True if the frame was queued
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.policy == BACKPRESSURE_DROP and droppable:
+            self.dropped_count += 1
+            return False
+        if self.policy == BACKPRESSURE_DISCONNECT:
+            print(f"Outbound queue full for {self.session_id}, disconnecting slow client")
+            await self.close()
+            return False
+
+        try:
+            await asyncio.wait_for(self.queue.put(frame), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            print(f"Outbound queue for {self.session_id} stayed full for {timeout}s, disconnecting slow client")
+            await self.close()
+            return False
+
+    async def _writer(self, replay=None):
+        try:
+            # Live messages pile up in the queue meanwhile and follow in order
+            for frame in replay or ():
+                await self._send(frame)
+            while True:
+                frame = await self.queue.get()
+                await self._send(frame)
+                self.queue.task_done()
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            print(f"Timeout sending WebSocket message to {self.session_id}, disconnecting slow client")
+        except Exception as e:
+            print(f"Error sending WebSocket message to {self.session_id}: {e}")
+        # Undelivered frames stay in session state and are replayed on reconnect
+        await self.close(cancel_writer=False)
+
+    async def _send(self, frame: bytes):
+        # Frames are UTF-8 JSON; browsers expect them as text frames
+        await asyncio.wait_for(self.websocket.send_text(frame.decode("utf-8")), timeout=self.send_timeout)
+
+    async def drain(self, timeout: float = WS_SEND_TIMEOUT):
+        """Wait until everything queued so far has been sent, e.g. before closing."""
+        if self.closed or self.writer_task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Timeout draining outbound queue for {self.session_id}")
+
+    def stop(self):
+        """Stop the writer without touching the socket (the socket is already gone)."""
+        self.closed = True
+        if self.writer_task and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+
+    async def close(self, cancel_writer: bool = True):
+        """Stop the writer and close the socket so the receive loop runs its cleanup."""
+        if self.closed:
+            return
+        self.closed = True
+        if cancel_writer and self.writer_task and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+        try:
+            await self.websocket.close()
+        except Exception as e:
+            print(f"Error closing WebSocket for {self.session_id}: {e}")
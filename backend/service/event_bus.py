@@ -0,0 +1,194 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from service.background import spawn
+from service.metrics import MetricsFactory
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Only needed for EVENT_BUS=redis
+    aioredis = None
+
+EVENT_BUS = os.getenv("EVENT_BUS", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "ucp:")
+
+metrics = MetricsFactory.get_instance()
+
+
+def pack_envelope(origin: str, seq: int, payload: bytes) -> bytes:
+    """Wrap an encoded message with its origin worker and seq (0 if not saved)."""
+    return b"%s\n%d\n" % (origin.encode(), seq or 0) + payload
+
+
+def unpack_envelope(envelope: bytes):
+    """
+    Returns:
+        tuple: The origin worker, the seq and the encoded message
+    """
+    origin, seq, payload = envelope.split(b"\n", 2)
+    return origin.decode(), int(seq), payload
+
+
+def outbound_channel(session_id: str) -> str:
+    """Messages for a session's clients, from the worker running its task."""
+    return f"{REDIS_KEY_PREFIX}session:{session_id}:out"
+
+
+def inbound_channel(session_id: str) -> str:
+    """Client messages (confirm, input, cancel, ...) for the worker running the task."""
+    return f"{REDIS_KEY_PREFIX}session:{session_id}:in"
+
+
+class EventBus:
+    """
+    Routes session events between workers.
+
+    ``publish`` only queues the payload; one background task sends everything
+    in publish order, so producers never wait on the broker. Handlers of a
+    channel are called in message order, and a handler that returns a
+    coroutine is awaited before the next message is handled.
+
+    This in-process implementation delivers to handlers in the same process.
+    With a single worker nothing needs routing and the managers skip the bus
+    altogether (``shared`` is False).
+    """
+    shared = False
+
+    def __init__(self):
+        self.handlers = {}  # channel -> list of handlers
+        self.pending = deque()
+        self.wakeup = None
+        self.publisher_task = None
+
+    async def subscribe(self, channel: str, handler):
+        """Call ``handler(payload)`` for every message on ``channel`` from now on."""
+        self.handlers.setdefault(channel, []).append(handler)
+
+    def unsubscribe(self, channel: str, handler):
+        handlers = self.handlers.get(channel)
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+            if not handlers:
+                del self.handlers[channel]
+
+    def publish(self, channel: str, payload: bytes):
+        """Queue a payload for everyone subscribed to ``channel``."""
+        self.pending.append((channel, payload))
+        if self.publisher_task is None or self.publisher_task.done():
+            self.wakeup = asyncio.Event()
+            self.publisher_task = asyncio.create_task(self._drain())
+        self.wakeup.set()
+
+    async def _drain(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                channel, payload = self.pending.popleft()
+                try:
+                    await self._send(channel, payload)
+                    metrics.increment("event_bus.published")
+                except Exception as e:
+                    metrics.increment("event_bus.errors")
+                    print(f"Error publishing to {channel}: {e}")
+
+    async def _send(self, channel: str, payload: bytes):
+        await self._deliver(channel, payload)
+
+    async def _deliver(self, channel: str, payload: bytes):
+        for handler in list(self.handlers.get(channel, ())):
+            try:
+                result = handler(payload)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                print(f"Error handling message on {channel}: {e}")
+
+
+class InProcessEventBus(EventBus):
+    """Event bus for a single worker; see ``EventBus``."""
+
+
+class RedisEventBus(EventBus):
+    """
+    Event bus over Redis pub/sub, for several workers behind a load balancer.
+
+    One pub/sub connection per process carries every subscribed channel, and a
+    reader task hands its messages to the handlers. The client is injectable
+    so tests can pass any Redis-protocol client, e.g. one connected to a local
+    stand-in server.
+    """
+    shared = True
+
+    def __init__(self, client=None, url: str = REDIS_URL):
+        super().__init__()
+        if client is None:
+            if aioredis is None:
+                raise RuntimeError("EVENT_BUS=redis needs the redis package (pip install redis)")
+            client = aioredis.from_url(url)
+        self.client = client
+        self.pubsub = client.pubsub()
+        self.reader_task = None
+
+    async def subscribe(self, channel: str, handler):
+        first = channel not in self.handlers
+        await super().subscribe(channel, handler)
+        if first:
+            await self.pubsub.subscribe(channel)
+        if self.reader_task is None or self.reader_task.done():
+            self.reader_task = asyncio.create_task(self._read())
+
+    def unsubscribe(self, channel: str, handler):
+        super().unsubscribe(channel, handler)
+        if channel not in self.handlers:
+            spawn(self._unsubscribe(channel))
+
+    async def _unsubscribe(self, channel: str):
+        try:
+            # Resubscribed meanwhile
+            if channel not in self.handlers:
+                await self.pubsub.unsubscribe(channel)
+        except Exception as e:
+            print(f"Error unsubscribing from {channel}: {e}")
+
+    async def _send(self, channel: str, payload: bytes):
+        await self.client.publish(channel, payload)
+
+    async def _read(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error reading from event bus: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None:
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            metrics.increment("event_bus.received")
+            await self._deliver(channel, message["data"])
+
+
+class EventBusFactory:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                # Double-checked locking pattern
+                if cls._instance is None:
+                    if EVENT_BUS == "redis":
+                        cls._instance = RedisEventBus()
+                    elif EVENT_BUS == "memory":
+                        cls._instance = InProcessEventBus()
+                    else:
+                        raise ValueError(f"Unknown EVENT_BUS: {EVENT_BUS}")
+        return cls._instance
@@ -0,0 +1,369 @@
+import asyncio
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from service.metrics import MetricsFactory
+from service.replay_store import PINNED_MESSAGE_TYPES
+from service.state_backend import StateBackend
+
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", os.path.join("data", "event_log"))
+EVENT_LOG_SEGMENT_BYTES = int(os.getenv("EVENT_LOG_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+# Writes are fsynced together at most this often; a crash loses at most this much
+EVENT_LOG_FSYNC_INTERVAL = float(os.getenv("EVENT_LOG_FSYNC_INTERVAL", "0.05"))
+# Messages kept per session; these are uncompacted, so more than the replay buffer
+EVENT_LOG_MAX_MESSAGES = int(os.getenv("EVENT_LOG_MAX_MESSAGES", "1000"))
+# Sessions not written to for this long are dropped when the log is reopened
+EVENT_LOG_RETENTION = float(os.getenv("EVENT_LOG_RETENTION", str(24 * 3600)))
+
+# Record kinds
+SESSION_SAVED = 1
+MESSAGE_APPENDED = 2
+SESSION_DELETED = 3
+MESSAGES_DELETED = 4
+
+# Log record: crc32 of the rest, payload length, kind, unix time, seq,
+# session ID length, message type length; then the session ID, type and payload
+RECORD_HEADER = struct.Struct("<IIBdQHH")
+# Index entry, the same without the payload: kind, time, seq, session ID length,
+# type length, payload offset and length; then the session ID and type
+INDEX_ENTRY = struct.Struct("<BdQHHQI")
+# Index trailer: magic, crc32 and length of the entries, and the length of the
+# segment they index. An index that does not match it is rebuilt from its segment.
+INDEX_TRAILER = struct.Struct("<4sIQQ")
+INDEX_MAGIC = b"EIX1"
+
+metrics = MetricsFactory.get_instance()
+
+
+class SessionLog:
+    """Where one session's records are in the log; the payloads stay on disk."""
+    __slots__ = ("meta", "messages", "pinned", "last_write")
+
+    def __init__(self):
+        self.meta = None  # (segment, offset, length) of the latest metadata
+        self.messages = deque()  # (seq, segment, offset, length), oldest first
+        self.pinned = {}  # msg_type -> (seq, segment, offset, length) of the newest one
+        self.last_write = 0.0
+
+
+class EventLogStateBackend(StateBackend):
+    """
+    Session metadata and replay messages in an append-only log on local disk.
+
+    Records are appended to the active segment through a buffered file and
+    fsynced in batches, at most every ``EVENT_LOG_FSYNC_INTERVAL`` seconds.
+    Once a segment reaches ``EVENT_LOG_SEGMENT_BYTES`` it is sealed, with an
+    index file of its records next to it, and a new one is started.
+
+    Only the index is kept on the heap; payloads are read back when a session
+    is hydrated, from memory-mapped sealed segments. When the log is reopened
+    after a restart the index is rebuilt from the index files, scanning only
+    the last segment, whose torn tail (if any) is cut off, and any segment
+    whose index file is missing or fails its checksum. Replay buffers are then
+    rebuilt lazily, when a client reconnects to a session.
+
+    Segments are removed oldest first once nothing in them is still indexed,
+    so a deletion record never outlives the records it deletes.
+    """
+    shared = True  # State outlives the process
+
+    def __init__(self, directory: str = EVENT_LOG_DIR, segment_bytes: int = EVENT_LOG_SEGMENT_BYTES,
+                 fsync_interval: float = EVENT_LOG_FSYNC_INTERVAL, max_messages: int = EVENT_LOG_MAX_MESSAGES,
+                 retention: float = EVENT_LOG_RETENTION):
+        super().__init__()
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.max_messages = max_messages
+        self.retention = retention
+        self.sessions = {}  # session_id -> SessionLog
+        self.segment_refs = {}  # segment -> number of index entries pointing into it
+        self.maps = {}  # segment -> mmap of a sealed segment
+        self.sealing = set()  # Segments whose index is being written
+        self.sync_task = None
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.log")
+
+    def _index_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.idx")
+
+    def _open(self):
+        segments = sorted(
+            int(name[8:14]) for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".log")
+        )
+        for segment in segments:
+            self.segment_refs[segment] = 0
+            if segment == segments[-1]:
+                entries = self._scan_segment(segment, truncate=True)
+            else:
+                entries = self._read_index(segment)
+                if entries is None:
+                    print(f"Event log index of segment {segment} is missing or corrupt, rebuilding it")
+                    metrics.increment("event_log.indexes_rebuilt")
+                    entries = self._scan_segment(segment, truncate=False)
+                    self._write_index(segment, entries)
+            for entry in entries:
+                self._apply(*entry)
+
+        # Sessions nobody came back to are forgotten; their segments get reclaimed
+        cutoff = time.time() - self.retention
+        for session_id in [sid for sid, log in self.sessions.items() if log.last_write < cutoff]:
+            self._drop_session(session_id)
+
+        self.segment = segments[-1] if segments else 1
+        self.segment_refs.setdefault(self.segment, 0)
+        self.file = open(self._segment_path(self.segment), "a+b")
+        self.offset = self.file.tell()
+        self._reclaim()
+        if self.sessions:
+            print(f"Opened event log with {len(self.sessions)} sessions in {len(self.segment_refs)} segments")
+
+    def _scan_segment(self, segment: int, truncate: bool) -> list:
+        """Read a segment's records, stopping at the first torn or corrupt one."""
+        entries = []
+        path = self._segment_path(segment)
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            crc, length, kind, at, seq, sid_len, type_len = RECORD_HEADER.unpack_from(data, offset)
+            end = offset + RECORD_HEADER.size + sid_len + type_len + length
+            if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+                break
+            start = offset + RECORD_HEADER.size
+            session_id = data[start:start + sid_len].decode()
+            msg_type = data[start + sid_len:start + sid_len + type_len].decode()
+            entries.append((kind, at, seq, session_id, msg_type, segment, start + sid_len + type_len, length))
+            offset = end
+        if offset < len(data):
+            print(f"Event log segment {segment} ends with {len(data) - offset} bytes of a torn record")
+            if truncate:
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+        return entries
+
+    def _read_index(self, segment: int):
+        """
+        Read a sealed segment's index file.
+
+        Returns:
+            list: The segment's records, or None if the index is missing or
+            does not match its trailer or the segment
+        """
+        try:
+            with open(self._index_path(segment), "rb") as f:
+                data = f.read()
+            segment_length = os.path.getsize(self._segment_path(segment))
+        except FileNotFoundError:
+            return None
+        if len(data) < INDEX_TRAILER.size:
+            return None
+        magic, crc, length, indexed_length = INDEX_TRAILER.unpack_from(data, len(data) - INDEX_TRAILER.size)
+        data = data[:-INDEX_TRAILER.size]
+        if magic != INDEX_MAGIC or length != len(data) or zlib.crc32(data) != crc or indexed_length != segment_length:
+            return None
+
+        entries = []
+        offset = 0
+        while offset + INDEX_ENTRY.size <= len(data):
+            kind, at, seq, sid_len, type_len, payload_offset, length = INDEX_ENTRY.unpack_from(data, offset)
+            offset += INDEX_ENTRY.size
+            session_id = data[offset:offset + sid_len].decode()
+            msg_type = data[offset + sid_len:offset + sid_len + type_len].decode()
+            offset += sid_len + type_len
+            entries.append((kind, at, seq, session_id, msg_type, segment, payload_offset, length))
+        if offset != len(data):
+            return None
+        return entries
+
+    def _apply(self, kind: int, at: float, seq: int, session_id: str, msg_type: str,
+               segment: int, offset: int, length: int):
+        """Update the index for one record."""
+        log = self.sessions.get(session_id)
+        if kind in (SESSION_DELETED, MESSAGES_DELETED):
+            if log is None:
+                return
+            if kind == SESSION_DELETED:
+                self._release(log.meta)
+                log.meta = None
+            else:
+                for ref in log.messages:
+                    self._release(ref[1:])
+                for ref in log.pinned.values():
+                    self._release(ref[1:])
+                log.messages.clear()
+                log.pinned.clear()
+            if log.meta is None and not log.messages:
+                del self.sessions[session_id]
+            return
+
+        if log is None:
+            log = self.sessions[session_id] = SessionLog()
+        log.last_write = at
+        self.segment_refs[segment] = self.segment_refs.get(segment, 0) + 1
+        if kind == SESSION_SAVED:
+            self._release(log.meta)
+            log.meta = (segment, offset, length)
+        elif kind == MESSAGE_APPENDED:
+            log.messages.append((seq, segment, offset, length))
+            if msg_type in PINNED_MESSAGE_TYPES:
+                self.segment_refs[segment] += 1
+                stale = log.pinned.get(msg_type)
+                if stale:
+                    self._release(stale[1:])
+                log.pinned[msg_type] = (seq, segment, offset, length)
+            while len(log.messages) > self.max_messages:
+                self._release(log.messages.popleft()[1:])
+
+    def _release(self, ref):
+        if ref is not None:
+            self.segment_refs[ref[0]] -= 1
+
+    def _drop_session(self, session_id: str):
+        log = self.sessions.pop(session_id)
+        self._release(log.meta)
+        for ref in list(log.messages) + list(log.pinned.values()):
+            self._release(ref[1:])
+
+    def _reclaim(self):
+        """Remove the oldest sealed segments that nothing is indexed in anymore."""
+        for segment in sorted(self.segment_refs):
+            if segment == self.segment or segment in self.sealing or self.segment_refs[segment] > 0:
+                return
+            del self.segment_refs[segment]
+            mapped = self.maps.pop(segment, None)
+            if mapped:
+                mapped.close()
+            for path in (self._segment_path(segment), self._index_path(segment)):
+                if os.path.exists(path):
+                    os.remove(path)
+            metrics.increment("event_log.segments_reclaimed")
+
+    async def _append(self, kind: int, session_id: str, seq: int = 0, msg_type: str = "", payload: bytes = b""):
+        if self.offset >= self.segment_bytes:
+            await self._rotate()
+        sid = session_id.encode()
+        type_bytes = msg_type.encode()
+        at = time.time()
+        body = RECORD_HEADER.pack(0, len(payload), kind, at, seq, len(sid), len(type_bytes))[4:] + sid + type_bytes + payload
+        record = struct.pack("<I", zlib.crc32(body)) + body
+        self.file.write(record)
+        payload_offset = self.offset + RECORD_HEADER.size + len(sid) + len(type_bytes)
+        self.offset += len(record)
+        self._apply(kind, at, seq, session_id, msg_type, self.segment, payload_offset, len(payload))
+        metrics.increment("event_log.records")
+        if self.sync_task is None:
+            self.sync_task = asyncio.create_task(self._sync_later())
+
+    async def _rotate(self):
+        """Start the next segment, then seal the full one off the event loop."""
+        sealed, sealed_file = self.segment, self.file
+        sealed_file.flush()
+        # Switch before yielding, so records written meanwhile go to the new segment
+        self.segment += 1
+        self.segment_refs.setdefault(self.segment, 0)
+        self.file = open(self._segment_path(self.segment), "a+b")
+        self.offset = 0
+        self.sealing.add(sealed)
+        try:
+            await asyncio.to_thread(self._seal, sealed, sealed_file)
+        finally:
+            self.sealing.discard(sealed)
+        self._reclaim()
+
+    def _seal(self, segment: int, file):
+        """Make a full segment durable and index it. Runs in a worker thread."""
+        os.fsync(file.fileno())
+        file.close()
+        self._write_index(segment, self._scan_segment(segment, truncate=False))
+
+    def _write_index(self, segment: int, entries: list):
+        """Write a segment's index file atomically: to a temporary file, fsynced, then renamed into place."""
+        parts = []
+        for kind, at, seq, session_id, msg_type, _, offset, length in entries:
+            sid = session_id.encode()
+            type_bytes = msg_type.encode()
+            parts.append(INDEX_ENTRY.pack(kind, at, seq, len(sid), len(type_bytes), offset, length) + sid + type_bytes)
+        data = b"".join(parts)
+        trailer = INDEX_TRAILER.pack(INDEX_MAGIC, zlib.crc32(data), len(data), os.path.getsize(self._segment_path(segment)))
+        path = self._index_path(segment)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data + trailer)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        # Make the rename itself durable
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    async def _sync_later(self):
+        """Group commit: fsync everything written during the interval at once."""
+        try:
+            await asyncio.sleep(self.fsync_interval)
+            await self.sync()
+        finally:
+            self.sync_task = None
+
+    async def sync(self):
+        """Flush buffered records and fsync them."""
+        self.file.flush()
+        started = time.perf_counter()
+        await asyncio.to_thread(os.fsync, self.file.fileno())
+        metrics.observe("event_log.fsync", time.perf_counter() - started)
+
+    def _read(self, segment: int, offset: int, length: int) -> bytes:
+        if segment == self.segment:
+            self.file.flush()
+            return os.pread(self.file.fileno(), length, offset)
+        mapped = self.maps.get(segment)
+        if mapped is None:
+            with open(self._segment_path(segment), "rb") as f:
+                mapped = self.maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped[offset:offset + length]
+
+    async def save_session(self, session_id: str, meta: dict):
+        await self._append(SESSION_SAVED, session_id, payload=json.dumps(meta, default=str).encode())
+
+    async def load_session(self, session_id: str):
+        log = self.sessions.get(session_id)
+        if log is None or log.meta is None:
+            return None
+        return json.loads(self._read(*log.meta))
+
+    async def delete_session(self, session_id: str):
+        if session_id in self.sessions:
+            await self._append(SESSION_DELETED, session_id)
+            self._reclaim()
+
+    async def append_message(self, session_id: str, seq: int, msg_type: str, payload: bytes):
+        await self._append(MESSAGE_APPENDED, session_id, seq, msg_type or "", payload)
+
+    async def load_messages(self, session_id: str, after_seq: int = 0) -> list:
+        """Get the saved messages after ``after_seq`` as (seq, payload) pairs, oldest first."""
+        log = self.sessions.get(session_id)
+        if log is None:
+            return []
+        refs = [ref for ref in log.messages if ref[0] > after_seq]
+        # Pinned messages trimmed from the log go in front of the rest
+        first_seq = refs[0][0] if refs else None
+        pinned = sorted(
+            ref for ref in log.pinned.values()
+            if ref[0] > after_seq and (first_seq is None or ref[0] < first_seq)
+        )
+        return [(ref[0], self._read(*ref[1:])) for ref in pinned + refs]
+
+    async def delete_messages(self, session_id: str):
+        if session_id in self.sessions:
+            await self._append(MESSAGES_DELETED, session_id)
+            self._reclaim()
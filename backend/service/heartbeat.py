@@ -0,0 +1,74 @@
+import asyncio
+import os
+from service.background import spawn
+from service.metrics import MetricsFactory
+from service.serialization import encode_message
+
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "15"))
+# A connection that has sent nothing (not even a pong) for this long is dead
+WS_HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "45"))
+# How long a reaped socket gets to close before its receive loop is cancelled
+WS_REAP_CLOSE_TIMEOUT = float(os.getenv("WS_REAP_CLOSE_TIMEOUT", "1.0"))
+
+metrics = MetricsFactory.get_instance()
+
+
+class HeartbeatReaper:
+    """
+    Pings every WebSocket connection and reaps the ones that stopped answering.
+
+    A single background task serves all connections: every ``interval`` it
+    queues a ``ping`` to connections that are due one and closes connections
+    that have been silent for longer than ``timeout``. Closing the socket ends
+    the endpoint's receive loop, which runs the usual session cleanup; if the
+    socket does not close in time, the receive loop is cancelled instead.
+    """
+    def __init__(self, get_connections, interval: float = WS_HEARTBEAT_INTERVAL,
+                 timeout: float = WS_HEARTBEAT_TIMEOUT):
+        self.get_connections = get_connections  # Returns all live SessionConnections
+        self.interval = interval
+        self.timeout = timeout
+        self.task = None
+
+    def start(self):
+        """Start the reaper task if it is not running yet."""
+        if self.interval > 0 and (self.task is None or self.task.done()):
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error in WebSocket heartbeat sweep: {e}")
+
+    def sweep(self):
+        """Ping connections that are due one and reap the dead ones."""
+        now = asyncio.get_running_loop().time()
+        ping = encode_message({"type": "ping", "ts": now})
+        for connection in self.get_connections():
+            if connection.closed:
+                continue
+            if now - connection.last_seen > self.timeout:
+                print(f"No heartbeat from {connection.session_id} for {now - connection.last_seen:.1f}s, reaping connection")
+                metrics.increment("websocket.reaped")
+                spawn(self._reap(connection))
+            elif now - connection.last_ping >= self.interval:
+                # Never wait on a full queue here; a stuck client is reaped by its silence
+                connection.try_enqueue(ping)
+                connection.last_ping = now
+
+    async def _reap(self, connection):
+        try:
+            await asyncio.wait_for(connection.close(), timeout=WS_REAP_CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Timeout closing dead WebSocket for {connection.session_id}")
+        receiver = connection.receiver_task
+        if receiver and not receiver.done():
+            receiver.cancel()
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import threading
+from service.metrics import MetricsFactory
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))  # Seconds between probes
+
+metrics = MetricsFactory.get_instance()
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop runs a callback it was asked to run on time.
+
+    A probe sleeps ``interval`` and records how much longer than that it took
+    to wake up as ``event_loop.lag``. Anything that blocks the loop, like a
+    synchronous model stream, shows up there directly, and it delays every
+    session's WebSocket traffic by the same amount.
+    """
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            metrics.observe("event_loop.lag", max(0.0, loop.time() - started - self.interval))
+
+
+class LoopLagMonitorFactory:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                # Double-checked locking pattern
+                if cls._instance is None:
+                    cls._instance = LoopLagMonitor()
+        return cls._instance
@@ -0,0 +1,91 @@
+import threading
+from collections import deque
+
+
+class TimingStats:
+    """Count, total and max of a duration, plus a window of recent samples for percentiles."""
+    __slots__ = ("count", "total", "max", "recent")
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.recent.append(seconds)
+
+    def percentile(self, fraction: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(0.50),
+            "p99": self.percentile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters, gauges and timings.
+
+    Gauges can be registered as callables so they are only computed when the
+    metrics are read, not on every change.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.timings = {}
+
+    def increment(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value):
+        self.gauges[name] = value
+
+    def register_gauge(self, name: str, read_fn):
+        """Register a callable that returns the gauge's current value."""
+        self.gauges[name] = read_fn
+
+    def observe(self, name: str, seconds: float):
+        stats = self.timings.get(name)
+        if stats is None:
+            stats = self.timings[name] = TimingStats()
+        stats.observe(seconds)
+
+    def snapshot(self) -> dict:
+        gauges = {}
+        for name, value in self.gauges.items():
+            try:
+                gauges[name] = value() if callable(value) else value
+            except Exception as e:
+                print(f"Error reading gauge {name}: {e}")
+        return {
+            "counters": dict(self.counters),
+            "gauges": gauges,
+            "timings": {name: stats.to_dict() for name, stats in self.timings.items()},
+        }
+
+
+class MetricsFactory:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                # Double-checked locking pattern
+                if cls._instance is None:
+                    cls._instance = MetricsRegistry()
+        return cls._instance
@@ -0,0 +1,54 @@
+_MISSING = object()
+
+# Always present in a delta record, even when unchanged
+DELTA_FIELDS = ("event", "content")
+# Change with every event, so they are never part of the header
+VOLATILE_FIELDS = {"event", "content", "created_at"}
+
+
+class ProgressSerializer:
+    """
+    Turns agno run events into compact task_progress messages for one session.
+
+    The first event of a run produces a ``task_progress_header`` holding the
+    fields that rarely change (run id, agent, model, ...). Every event then
+    produces a ``task_progress`` delta with the event type, the content and
+    only those fields that differ from the header. Header fields the event
+    lacks are sent as ``null``. The sequence number is stamped on both by
+    ``WebSocketManager`` when the messages are saved.
+
+    A client rebuilds the full event by merging the delta into the header.
+    Deltas never depend on each other, so replay stays correct when older
+    deltas have been evicted and only the header is pinned.
+    """
+    def __init__(self):
+        self.run_id = None
+        self.header = None  # Fields of the current run's header
+
+    def serialize(self, event: dict) -> list:
+        """
+        Build the messages for one run event.
+
+        Args:
+            event: The event as returned by ``RunResponseEvent.to_dict()``
+
+        Returns:
+            list: A header (only at the start of a run) followed by the delta
+        """
+        messages = []
+        run_id = event.get("run_id")
+        if self.header is None or run_id != self.run_id:
+            self.header = {key: value for key, value in event.items() if key not in VOLATILE_FIELDS}
+            messages.append({"type": "task_progress_header", "data": self.header})
+            self.run_id = run_id
+
+        delta = {field: event.get(field) for field in DELTA_FIELDS}
+        for key, value in event.items():
+            if key not in delta and self.header.get(key, _MISSING) != value:
+                delta[key] = value
+        for key in self.header:
+            if key not in event:
+                delta[key] = None
+
+        messages.append({"type": "task_progress", "data": delta})
+        return messages
@@ -0,0 +1,286 @@
+import os
+import sys
+from collections import OrderedDict, deque
+from service.serialization import encode_message
+
+REPLAY_MAX_MESSAGES = int(os.getenv("REPLAY_MAX_MESSAGES", "100"))
+REPLAY_MAX_BYTES = int(os.getenv("REPLAY_MAX_BYTES", str(1024 * 1024)))
+REPLAY_GLOBAL_MAX_BYTES = int(os.getenv("REPLAY_GLOBAL_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Evicted messages of these types are kept aside while later messages still
+# depend on them; a task_progress delta is meaningless without its header.
+PINNED_MESSAGE_TYPES = {"task_progress_header"}
+
+# Streamed answer text; consecutive chunks are merged into one replay entry
+CONTENT_EVENT = "RunResponseContent"
+# A chunk can be merged into the previous one only if it changes nothing else
+CONTENT_CHUNK_FIELDS = {"event", "content", "created_at"}
+
+
+class ReplayEntry:
+    """One saved message, already JSON-encoded."""
+    __slots__ = ("seq", "type", "payload")
+
+    def __init__(self, seq: int, msg_type: str, payload: bytes):
+        self.seq = seq
+        self.type = msg_type
+        self.payload = payload
+
+    @property
+    def first_seq(self) -> int:
+        return self.seq
+
+    @property
+    def size(self) -> int:
+        return len(self.payload)
+
+    def payload_range(self, after_seq: int = 0, upto_seq: int = None) -> bytes:
+        return self.payload
+
+
+class ContentRunEntry:
+    """
+    Consecutive streamed content chunks of one run, compacted into a single message.
+
+    The chunks are kept as separate pieces with their sequence numbers so a
+    client that already has some of them can be sent only the rest. The merged
+    message is encoded on demand, which only happens on replay.
+    """
+    __slots__ = ("seq", "type", "fields", "pieces", "piece_seqs", "size")
+
+    def __init__(self, seq: int, data: dict, payload: bytes):
+        self.seq = seq
+        self.type = "task_progress"
+        self.fields = {key: value for key, value in data["data"].items() if key != "content"}
+        self.pieces = [data["data"]["content"]]
+        self.piece_seqs = [seq]
+        self.size = len(payload)
+
+    @staticmethod
+    def accepts(data: dict) -> bool:
+        """Check whether a message is a plain content chunk."""
+        if data.get("type") != "task_progress":
+            return False
+        delta = data.get("data") or {}
+        return (
+            delta.get("event") == CONTENT_EVENT
+            and isinstance(delta.get("content"), str)
+            and delta.keys() <= CONTENT_CHUNK_FIELDS
+        )
+
+    def merge(self, seq: int, data: dict):
+        delta = data["data"]
+        self.fields.update((key, value) for key, value in delta.items() if key != "content")
+        self.pieces.append(delta["content"])
+        self.piece_seqs.append(seq)
+        self.seq = seq
+        # Approximate: the chunk text is what the merged message grows by
+        self.size += len(delta["content"])
+
+    @property
+    def first_seq(self) -> int:
+        return self.piece_seqs[0]
+
+    @property
+    def payload(self) -> bytes:
+        return self.payload_range()
+
+    def payload_range(self, after_seq: int = 0, upto_seq: int = None) -> bytes:
+        """Encode the merged message from the chunks in (``after_seq``, ``upto_seq``]."""
+        start = 0
+        while start < len(self.piece_seqs) and self.piece_seqs[start] <= after_seq:
+            start += 1
+        end = len(self.piece_seqs)
+        if upto_seq is not None:
+            while end > start and self.piece_seqs[end - 1] > upto_seq:
+                end -= 1
+        content = "".join(self.pieces[start:end])
+        seq = self.piece_seqs[end - 1] if end > start else self.seq
+        return encode_message({"type": self.type, "data": {**self.fields, "content": content}, "seq": seq})
+
+
+# Rough per-entry bookkeeping cost on top of the payload itself
+ENTRY_OVERHEAD = sys.getsizeof(ReplayEntry(0, "", b"")) + sys.getsizeof(b"") + 8
+
+
+class ReplayBuffer:
+    """
+    Ring buffer of saved messages for one session.
+
+    Appending and evicting are O(1). The oldest messages are evicted once the
+    buffer holds more than ``max_messages`` messages or more than ``max_bytes``
+    of encoded payload, whichever comes first. The newest message is always
+    kept, even if it alone is over the byte budget.
+
+    Consecutive streamed content chunks are compacted into one entry, so a
+    long answer takes one slot instead of pushing the task_started and
+    confirmation messages before it out of the window.
+    """
+    def __init__(self, max_messages: int = REPLAY_MAX_MESSAGES, max_bytes: int = REPLAY_MAX_BYTES):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.entries = deque()
+        self.pinned = {}  # msg_type -> last evicted entry of a pinned type
+        self.nbytes = 0  # Payload bytes held, including pinned entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def append(self, seq: int, msg_type: str, payload: bytes, data: dict = None):
+        """
+        Save an encoded message, evicting the oldest ones if over budget.
+
+        Args:
+            seq: The message's sequence number
+            msg_type: The message type
+            payload: The encoded message
+            data: The message itself, needed to compact content chunks
+        """
+        # A newer message of a pinned type supersedes the one kept aside
+        stale = self.pinned.pop(msg_type, None)
+        if stale is not None:
+            self.nbytes -= stale.size
+
+        if data is not None and ContentRunEntry.accepts(data):
+            tail = self.entries[-1] if self.entries else None
+            if isinstance(tail, ContentRunEntry):
+                size_before = tail.size
+                tail.merge(seq, data)
+                self.nbytes += tail.size - size_before
+            else:
+                entry = ContentRunEntry(seq, data, payload)
+                self.entries.append(entry)
+                self.nbytes += entry.size
+        else:
+            self.entries.append(ReplayEntry(seq, msg_type, payload))
+            self.nbytes += len(payload)
+
+        while len(self.entries) > 1 and (
+            len(self.entries) > self.max_messages or self.nbytes > self.max_bytes
+        ):
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        entry = self.entries.popleft()
+        if entry.type in PINNED_MESSAGE_TYPES:
+            self.pinned[entry.type] = entry
+        else:
+            self.nbytes -= entry.size
+
+    @property
+    def oldest_seq(self):
+        return self.entries[0].first_seq if self.entries else None
+
+    def can_resume(self, last_seq: int) -> bool:
+        """Check that nothing after ``last_seq`` has been evicted yet."""
+        oldest_seq = self.oldest_seq
+        return oldest_seq is None or oldest_seq <= last_seq + 1
+
+    def page(self, after_seq: int, upto_seq: int, max_bytes: int):
+        """
+        Get the next page of encoded messages in (``after_seq``, ``upto_seq``].
+
+        Pinned entries come first, as in ``snapshot``. A compacted entry that
+        straddles either bound is cut down to the chunks inside it. A page holds
+        at least one message, even if that message alone is over ``max_bytes``.
+
+        Returns:
+            tuple: The payloads and the seq to continue the next page after
+        """
+        payloads = []
+        size = 0
+        pinned = sorted(self.pinned.values(), key=lambda entry: entry.seq)
+        for entry in pinned + list(self.entries):
+            if entry.seq <= after_seq:
+                continue
+            if entry.first_seq > upto_seq:
+                break
+            payload = entry.payload_range(after_seq, upto_seq)
+            if payloads and size + len(payload) > max_bytes:
+                break
+            payloads.append(payload)
+            size += len(payload)
+            after_seq = min(entry.seq, upto_seq)
+        return payloads, after_seq
+
+    def snapshot(self) -> list:
+        """Get every saved message encoded, pinned ones first."""
+        pinned = sorted(self.pinned.values(), key=lambda entry: entry.seq)
+        return [entry.payload for entry in pinned] + [entry.payload for entry in self.entries]
+
+    def memory_usage(self) -> dict:
+        """Report how much this session's replay state holds."""
+        count = len(self.entries) + len(self.pinned)
+        return {
+            "messages": count,
+            "payload_bytes": self.nbytes,
+            "estimated_bytes": self.nbytes + count * ENTRY_OVERHEAD,
+        }
+
+
+class ReplayStore:
+    """
+    Replay buffers of all sessions under one process-wide memory budget.
+
+    Buffers are kept in least-recently-touched order. When the total goes over
+    ``max_bytes``, whole sessions are evicted starting with the least recently
+    touched one, skipping sessions ``is_evictable`` rejects (e.g. connected
+    ones). This bounds replay memory even for sessions whose cleanup never ran.
+    """
+    def __init__(self, max_bytes: int = REPLAY_GLOBAL_MAX_BYTES, is_evictable=None, on_evict=None):
+        self.max_bytes = max_bytes
+        self.is_evictable = is_evictable or (lambda session_id: True)
+        self.on_evict = on_evict  # Called with the session ID after an eviction
+        self.buffers = OrderedDict()  # session_id -> ReplayBuffer, least recently touched first
+        self.total_bytes = 0
+        self.eviction_count = 0
+
+    def __len__(self) -> int:
+        return len(self.buffers)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.buffers
+
+    def get(self, session_id: str):
+        return self.buffers.get(session_id)
+
+    def touch(self, session_id: str):
+        """Mark a session as recently used."""
+        if session_id in self.buffers:
+            self.buffers.move_to_end(session_id)
+
+    def append(self, session_id: str, seq: int, msg_type: str, payload: bytes, data: dict = None):
+        """Save a message to a session's buffer and enforce the global budget."""
+        buffer = self.buffers.get(session_id)
+        if buffer is None:
+            buffer = self.buffers[session_id] = ReplayBuffer()
+        else:
+            self.buffers.move_to_end(session_id)
+
+        size_before = buffer.nbytes
+        buffer.append(seq, msg_type, payload, data)
+        self.total_bytes += buffer.nbytes - size_before
+
+        if self.total_bytes > self.max_bytes:
+            self._enforce_budget(keep=session_id)
+
+    def remove(self, session_id: str) -> bool:
+        buffer = self.buffers.pop(session_id, None)
+        if buffer is None:
+            return False
+        self.total_bytes -= buffer.nbytes
+        return True
+
+    def _enforce_budget(self, keep: str):
+        for session_id in list(self.buffers):
+            if self.total_bytes <= self.max_bytes:
+                return
+            if session_id == keep or not self.is_evictable(session_id):
+                continue
+            self.remove(session_id)
+            self.eviction_count += 1
+            print(f"Evicted replay state for {session_id} to stay within the memory budget")
+            if self.on_evict:
+                self.on_evict(session_id)
+        if self.total_bytes > self.max_bytes:
+            print(f"Replay state is {self.total_bytes} bytes, over budget with nothing left to evict")
@@ -0,0 +1,64 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library encoder
+    orjson = None
+
+
+# Dict keys JSON encoders accept as they are; anything else is encoded as str(key)
+JSON_KEY_TYPES = (str, int, float, bool, type(None))
+
+
+def _json_keys(data):
+    """Copy ``data`` with dict keys of other types turned into strings, e.g. tuples."""
+    if isinstance(data, dict):
+        return {key if isinstance(key, JSON_KEY_TYPES) else str(key): _json_keys(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_json_keys(item) for item in data]
+    return data
+
+
+def encode_message(data) -> bytes:
+    """
+    Encode a message to compact UTF-8 JSON, using orjson when it is installed.
+
+    Non-string dict keys are encoded as strings, e.g. int-keyed tool metadata,
+    the same way with either encoder.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return orjson.dumps(_json_keys(data), default=str, option=orjson.OPT_NON_STR_KEYS)
+    try:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    except TypeError:
+        return json.dumps(_json_keys(data), ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def decode_message(payload: bytes):
+    """Decode a message encoded by ``encode_message``."""
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def encode_with_raw_list(data: dict, key: str, items: list) -> bytes:
+    """
+    Encode ``data`` with ``key`` set to a JSON array of already-encoded items.
+
+    The items are spliced in as-is, so saved messages are never decoded and
+    encoded again just to be wrapped in another message.
+
+    Args:
+        data: The fields of the outer message (without ``key``)
+        key: Name of the array field
+        items: Encoded JSON values
+
+    Returns:
+        bytes: The encoded outer message
+    """
+    head = encode_message(data)
+    separator = b"," if len(head) > 2 else b""
+    return head[:-1] + separator + encode_message(key) + b":[" + b",".join(items) + b"]}"
@@ -1,31 +1,136 @@
+import os
+import time
 import uuid
 import threading
 from models.types import SessionTask
+from service.metrics import MetricsFactory
+from service.state_backend import StateBackendFactory, WORKER_ID
+from service.timer_wheel import TimerWheelFactory
+
+# A session with no connection and no activity for this long is cleaned up
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "900"))
+
+metrics = MetricsFactory.get_instance()
 
 class SessionManager:
-    def __init__(self):
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL, state_backend=None):
         self.sessions = {}
+        # Mirrors session metadata for other workers, if shared
+        self.state_backend = state_backend or StateBackendFactory.get_instance()
+        self.idle_ttl = idle_ttl
+        self.idle_timers = {}  # session_id -> Timer for the idle TTL
+        self.expiry_listeners = []  # Called with (session_id, local_only=) when an idle session expires, before cleanup
+        self.cleanup_listeners = []  # Called with the session ID after any session is cleaned up
+        self.timer_wheel = TimerWheelFactory.get_instance()
 
     def create_session(self, user_query: str = "Who is the current president of the United States?"):
         session_id = str(uuid.uuid4())
         task = SessionTask(user_query)
         self.sessions[session_id] = task
+        self.touch(session_id)
+        self.state_backend.write("save_session", session_id, {
+            "user_query": user_query,
+            "owner": WORKER_ID,
+            "created_at": time.time(),
+        })
         return session_id, task
 
+    async def hydrate(self, session_id: str):
+        """
+        Get a session, loading it from the shared state backend if this worker
+        does not have it.
+
+        Returns:
+            SessionTask: The session, or None if no worker knows it
+        """
+        task = self.sessions.get(session_id)
+        if task or not self.state_backend.shared:
+            return task
+        meta = await self.state_backend.load_session(session_id)
+        if meta is None:
+            return None
+        task = self.sessions.get(session_id)
+        if task is None:
+            task = self.sessions[session_id] = SessionTask(meta.get("user_query", ""))
+            task.owner = meta.get("owner")
+            self.touch(session_id)
+            print(f"Hydrated session {session_id} owned by {meta.get('owner')}")
+        return task
+
     def get_task(self, session_id):
         return self.sessions.get(session_id)
 
+    def touch(self, session_id: str):
+        """Record activity on a session, restarting its idle TTL."""
+        if session_id not in self.sessions or self.idle_ttl <= 0:
+            return
+        timer = self.idle_timers.get(session_id)
+        if timer:
+            timer.cancel()
+        self.idle_timers[session_id] = self.timer_wheel.call_later(self.idle_ttl, self._expire_idle, session_id)
+
+    def add_expiry_listener(self, listener):
+        self.expiry_listeners.append(listener)
+
+    def add_cleanup_listener(self, listener):
+        self.cleanup_listeners.append(listener)
+
+    def _expire_idle(self, session_id: str):
+        self.idle_timers.pop(session_id, None)
+        task = self.sessions.get(session_id)
+        if task is None:
+            return
+        if task.connection_count > 0:
+            # Still connected, so not abandoned
+            self.touch(session_id)
+            return
+        # A session hydrated from another worker is live there; its clients'
+        # connections are counted there too, so only drop the copy kept here
+        local_only = task.owner is not None
+        print(f"Session {session_id} idle for {self.idle_ttl:.0f}s, expiring{' local copy' if local_only else ''}")
+        metrics.increment("sessions.expired")
+        # Listeners go first, so a run still going is stopped before its session disappears
+        for listener in self.expiry_listeners:
+            try:
+                listener(session_id, local_only=local_only)
+            except Exception as e:
+                print(f"Error in session expiry listener for {session_id}: {e}")
+        self.cleanup_session(session_id, local_only=local_only)
+
+    def _cancel_idle_timer(self, session_id: str):
+        timer = self.idle_timers.pop(session_id, None)
+        if timer:
+            timer.cancel()
+
     def remove_session(self, session_id):
+        self._cancel_idle_timer(session_id)
         if session_id in self.sessions:
             del self.sessions[session_id]
+            self.state_backend.write("delete_session", session_id)
+
+    def cleanup_session(self, session_id: str, local_only: bool = False): 
+        """
+        Cancel a session and forget it.
 
-    def cleanup_session(self, session_id: str): 
+        Args:
+            session_id: The session to clean up
+            local_only: Only drop this worker's copy of a session another worker
+                runs, leaving the shared state alone
+        """
+        self._cancel_idle_timer(session_id)
         if session_id in self.sessions:
             task = self.sessions[session_id]
             # Cancel any pending operations
             task.cancel_event.set()
             # Remove from active sessions
             del self.sessions[session_id]
+            if not local_only:
+                self.state_backend.write("delete_session", session_id)
+            for listener in self.cleanup_listeners:
+                try:
+                    listener(session_id)
+                except Exception as e:
+                    print(f"Error in session cleanup listener for {session_id}: {e}")
             print(f"Session {session_id} cleaned up")
         else:
             print(f"Session {session_id} not found for cleanup")
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import socket
+import threading
+from collections import deque
+from service.metrics import MetricsFactory
+from service.replay_store import PINNED_MESSAGE_TYPES
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Only needed for STATE_BACKEND=redis
+    aioredis = None
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "ucp:")
+# Shared state outlives an idle session by the same TTL the session manager uses
+REDIS_STATE_TTL = int(float(os.getenv("REDIS_STATE_TTL", os.getenv("SESSION_IDLE_TTL", "900"))))
+# Messages kept per session; these are uncompacted, so more than the local buffer
+REDIS_REPLAY_MAX_MESSAGES = int(os.getenv("REDIS_REPLAY_MAX_MESSAGES", "1000"))
+
+# Identifies this process in shared session metadata
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+metrics = MetricsFactory.get_instance()
+
+
+class StateBackend:
+    """
+    Where session metadata and replay messages are shared between workers.
+
+    The managers keep their hot state in process either way (asyncio events
+    cannot leave it); a shared backend additionally mirrors what another worker,
+    or this one after a restart, needs to pick a session up: the session's
+    metadata and its replay log.
+
+    Writes go through ``write``, which queues them for one background task so
+    producers never wait on the network, and keeps them in order.
+    """
+    shared = False
+
+    def __init__(self):
+        self.pending = deque()
+        self.wakeup = None
+        self.writer_task = None
+        self.writing = False  # A popped write is still being applied
+
+    def write(self, method: str, *args):
+        """Queue a call to one of the async write methods, write-behind."""
+        if not self.shared:
+            return
+        self.pending.append((method, args))
+        if self.writer_task is None or self.writer_task.done():
+            self.wakeup = asyncio.Event()
+            self.writer_task = asyncio.create_task(self._drain())
+        self.wakeup.set()
+
+    async def _drain(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                method, args = self.pending.popleft()
+                self.writing = True
+                try:
+                    await getattr(self, method)(*args)
+                    metrics.increment("state_backend.writes")
+                except Exception as e:
+                    metrics.increment("state_backend.errors")
+                    print(f"Error writing {method} to state backend: {e}")
+                finally:
+                    self.writing = False
+
+    async def flush(self):
+        """Wait until every queued write has been applied."""
+        while (self.pending or self.writing) and self.writer_task and not self.writer_task.done():
+            await asyncio.sleep(0.01)
+
+    async def save_session(self, session_id: str, meta: dict):
+        pass
+
+    async def load_session(self, session_id: str):
+        return None
+
+    async def delete_session(self, session_id: str):
+        pass
+
+    async def append_message(self, session_id: str, seq: int, msg_type: str, payload: bytes):
+        pass
+
+    async def load_messages(self, session_id: str, after_seq: int = 0) -> list:
+        return []
+
+    async def delete_messages(self, session_id: str):
+        pass
+
+
+class InMemoryStateBackend(StateBackend):
+    """
+    State lives only in this process's managers; nothing is shared.
+
+    This is the single-worker setup: a session can only be reached on the
+    worker that created it.
+    """
+
+
+class RedisStateBackend(StateBackend):
+    """
+    Session metadata and replay logs in Redis, shared by every worker.
+
+    Layout, under ``REDIS_KEY_PREFIX``:
+        ``session:{id}`` hash of the session metadata
+        ``replay:{id}`` sorted set of encoded messages scored by their seq
+        ``pinned:{id}`` hash of the newest message of each pinned type, kept
+            when the replay set is trimmed, as in ``ReplayBuffer``
+
+    All keys expire ``REDIS_STATE_TTL`` seconds after the last write. The
+    client is injectable so tests can pass any Redis-protocol client, e.g. one
+    connected to a local stand-in server.
+    """
+    shared = True
+
+    def __init__(self, client=None, url: str = REDIS_URL, prefix: str = REDIS_KEY_PREFIX,
+                 ttl: int = REDIS_STATE_TTL, max_messages: int = REDIS_REPLAY_MAX_MESSAGES):
+        super().__init__()
+        if client is None:
+            if aioredis is None:
+                raise RuntimeError("STATE_BACKEND=redis needs the redis package (pip install redis)")
+            client = aioredis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_messages = max_messages
+
+    def _session_key(self, session_id: str) -> str:
+        return f"{self.prefix}session:{session_id}"
+
+    def _replay_key(self, session_id: str) -> str:
+        return f"{self.prefix}replay:{session_id}"
+
+    def _pinned_key(self, session_id: str) -> str:
+        return f"{self.prefix}pinned:{session_id}"
+
+    async def save_session(self, session_id: str, meta: dict):
+        key = self._session_key(session_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(key, mapping={name: str(value) for name, value in meta.items()})
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def load_session(self, session_id: str):
+        meta = await self.client.hgetall(self._session_key(session_id))
+        if not meta:
+            return None
+        return {
+            (name.decode() if isinstance(name, bytes) else name): (value.decode() if isinstance(value, bytes) else value)
+            for name, value in meta.items()
+        }
+
+    async def delete_session(self, session_id: str):
+        await self.client.delete(self._session_key(session_id))
+
+    async def append_message(self, session_id: str, seq: int, msg_type: str, payload: bytes):
+        key = self._replay_key(session_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zadd(key, {payload: seq})
+        # Keep only the newest max_messages
+        pipe.zremrangebyrank(key, 0, -self.max_messages - 1)
+        pipe.expire(key, self.ttl)
+        if msg_type in PINNED_MESSAGE_TYPES:
+            pinned_key = self._pinned_key(session_id)
+            pipe.hset(pinned_key, msg_type, b"%d:" % seq + payload)
+            pipe.expire(pinned_key, self.ttl)
+        pipe.expire(self._session_key(session_id), self.ttl)
+        await pipe.execute()
+
+    async def load_messages(self, session_id: str, after_seq: int = 0) -> list:
+        """Get the saved messages after ``after_seq`` as (seq, payload) pairs, oldest first."""
+        items = await self.client.zrangebyscore(self._replay_key(session_id), f"({after_seq}", "+inf", withscores=True)
+        messages = [(int(score), payload) for payload, score in items]
+
+        # Pinned messages trimmed from the replay set go in front of the rest
+        first_seq = messages[0][0] if messages else None
+        pinned = []
+        for value in (await self.client.hgetall(self._pinned_key(session_id))).values():
+            seq, payload = value.split(b":", 1)
+            seq = int(seq)
+            if seq > after_seq and (first_seq is None or seq < first_seq):
+                pinned.append((seq, payload))
+        return sorted(pinned) + messages
+
+    async def delete_messages(self, session_id: str):
+        await self.client.delete(self._replay_key(session_id), self._pinned_key(session_id))
+
+
+class StateBackendFactory:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                # Double-checked locking pattern
+                if cls._instance is None:
+                    if STATE_BACKEND == "redis":
+                        cls._instance = RedisStateBackend()
+                    elif STATE_BACKEND == "log":
+                        from service.event_log import EventLogStateBackend
+                        cls._instance = EventLogStateBackend()
+                    elif STATE_BACKEND == "memory":
+                        cls._instance = InMemoryStateBackend()
+                    else:
+                        raise ValueError(f"Unknown STATE_BACKEND: {STATE_BACKEND}")
+        return cls._instance
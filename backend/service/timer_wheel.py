@@ -0,0 +1,202 @@
+import asyncio
+import contextlib
+import math
+import os
+import threading
+from service.background import spawn
+from service.metrics import MetricsFactory
+
+TIMER_WHEEL_TICK = float(os.getenv("TIMER_WHEEL_TICK", "0.1"))  # Seconds per tick
+TIMER_WHEEL_SLOTS = 64  # Slots per level
+TIMER_WHEEL_LEVELS = 4  # 64**4 ticks of 0.1s is about 19 days
+
+metrics = MetricsFactory.get_instance()
+
+
+class Timer:
+    """A scheduled callback. Cancelling it is O(1) and safe after it fired."""
+    __slots__ = ("wheel", "deadline", "callback", "args", "slot", "cancelled")
+
+    def __init__(self, wheel, deadline: int, callback, args: tuple):
+        self.wheel = wheel
+        self.deadline = deadline  # In wheel ticks
+        self.callback = callback
+        self.args = args
+        self.slot = None  # The set this timer currently sits in
+        self.cancelled = False
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self.slot is not None:
+            self.slot.discard(self)
+            self.slot = None
+            self.wheel.pending -= 1
+
+
+def _uncancel(task: asyncio.Task) -> bool:
+    """
+    Take back the wheel's cancel request on ``task``.
+
+    Returns:
+        bool: True if other cancel requests are still pending. Before Python
+        3.11 tasks do not count them, so this is always False there.
+    """
+    uncancel = getattr(task, "uncancel", None)
+    return uncancel is not None and uncancel() > 0
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel shared by every session deadline.
+
+    Scheduling and cancelling a timer are O(1) no matter how many are pending,
+    and a single background task drives all of them, instead of one
+    ``asyncio.wait_for`` timer handle per wait. Level 0 has one slot per tick;
+    each higher level has slots ``TIMER_WHEEL_SLOTS`` times as wide, and its
+    timers are cascaded down a level when their slot comes up.
+
+    Timers fire within about one tick of their deadline, which is fine for
+    deadlines counted in seconds. The driver task only runs while timers are pending.
+    """
+    def __init__(self, tick: float = TIMER_WHEEL_TICK, slots: int = TIMER_WHEEL_SLOTS,
+                 levels: int = TIMER_WHEEL_LEVELS):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.origin = None  # Event loop time of tick 0
+        self.current_tick = 0
+        self.pending = 0
+        self.task = None
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def _now_tick(self) -> int:
+        return int((asyncio.get_running_loop().time() - self.origin) / self.tick)
+
+    def call_later(self, delay: float, callback, *args) -> Timer:
+        """
+        Run ``callback(*args)`` after ``delay`` seconds.
+
+        A callback that returns a coroutine has it run as a task.
+
+        Returns:
+            Timer: Handle to cancel the timer with
+        """
+        if self.origin is None:
+            self.origin = asyncio.get_running_loop().time()
+        if self.task is None:
+            # Nothing pending, so there are no ticks to catch up on
+            self.current_tick = self._now_tick()
+        timer = Timer(self, self.current_tick + max(1, math.ceil(delay / self.tick)), callback, args)
+        self._insert(timer)
+        self.pending += 1
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return timer
+
+    @contextlib.asynccontextmanager
+    async def timeout(self, delay: float):
+        """
+        Cancel the enclosed block after ``delay`` seconds, like ``asyncio.timeout``.
+
+        Raises:
+            asyncio.TimeoutError: If the deadline passed before the block finished
+            asyncio.CancelledError: If the task was also cancelled from outside,
+                even in the same tick as the deadline
+        """
+        task = asyncio.current_task()
+        expired = False
+
+        def expire():
+            nonlocal expired
+            expired = True
+            task.cancel()
+
+        timer = self.call_later(delay, expire)
+        try:
+            yield timer
+        except asyncio.CancelledError:
+            if expired and not _uncancel(task):
+                raise asyncio.TimeoutError() from None
+            raise
+        finally:
+            timer.cancel()
+
+    def _insert(self, timer: Timer):
+        delta = timer.deadline - self.current_tick
+        level = 0
+        span = self.slots
+        while delta >= span and level < self.levels - 1:
+            level += 1
+            span *= self.slots
+        # Timers beyond the top level wait in its farthest slot and are re-placed from there
+        position = min(timer.deadline, self.current_tick + span - 1)
+        slot = self.wheels[level][(position // self.slots ** level) % self.slots]
+        slot.add(timer)
+        timer.slot = slot
+
+    def _take(self, level: int, index: int) -> set:
+        timers = self.wheels[level][index]
+        self.wheels[level][index] = set()
+        for timer in timers:
+            timer.slot = None
+        return timers
+
+    def _advance(self):
+        """Move one tick forward: cascade higher levels, then fire what is due."""
+        self.current_tick += 1
+        for level in range(self.levels - 1, 0, -1):
+            width = self.slots ** level
+            if self.current_tick % width == 0:
+                for timer in self._take(level, (self.current_tick // width) % self.slots):
+                    self._insert(timer)
+
+        for timer in self._take(0, self.current_tick % self.slots):
+            if timer.cancelled:
+                # Cancelled by a callback that fired earlier in this tick
+                self.pending -= 1
+                continue
+            if timer.deadline > self.current_tick:
+                self._insert(timer)
+                continue
+            timer.cancelled = True
+            self.pending -= 1
+            metrics.increment("timers.fired")
+            try:
+                result = timer.callback(*timer.args)
+                if asyncio.iscoroutine(result):
+                    spawn(result)
+            except Exception as e:
+                print(f"Error in timer callback {getattr(timer.callback, '__name__', timer.callback)}: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                next_at = self.origin + (self.current_tick + 1) * self.tick
+                await asyncio.sleep(max(0.0, next_at - loop.time()))
+                now_tick = self._now_tick()
+                while self.current_tick < now_tick:
+                    self._advance()
+                if not self.pending:
+                    return
+        finally:
+            self.task = None
+
+
+class TimerWheelFactory:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                # Double-checked locking pattern
+                if cls._instance is None:
+                    cls._instance = TimerWheel()
+        return cls._instance
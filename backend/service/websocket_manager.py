@@ -1,143 +1,553 @@
 import asyncio
+import functools
+import os
 import threading
+from collections import deque
 from fastapi import WebSocket
+from service.connection import (
+    SessionConnection,
+    WS_BACKPRESSURE_POLICY,
+    WS_OUTBOUND_QUEUE_SIZE,
+    WS_SEND_TIMEOUT,
+    is_droppable,
+)
+from service.event_bus import EventBusFactory, outbound_channel, pack_envelope, unpack_envelope
+from service.progress_serializer import ProgressSerializer
+from service.heartbeat import HeartbeatReaper
+from service.metrics import MetricsFactory
+from service.replay_store import ReplayStore
+from service.serialization import decode_message, encode_message, encode_with_raw_list
+from service.state_backend import StateBackendFactory, WORKER_ID
 
-class WebSocketManager:
+# Streamed message types that may be coalesced into a single batched frame.
+# Everything else (confirmations, cancellation, completion, ...) is a control
+# message and is delivered immediately, after any pending batch.
+COALESCED_MESSAGE_TYPES = {"task_progress", "task_progress_header"}
+
+WS_COALESCE_ENABLED = os.getenv("WS_COALESCE_ENABLED", "true").lower() == "true"
+WS_COALESCE_WINDOW_MS = float(os.getenv("WS_COALESCE_WINDOW_MS", "30"))
+WS_COALESCE_MAX_BYTES = int(os.getenv("WS_COALESCE_MAX_BYTES", "4096"))
+WS_REPLAY_PAGE_BYTES = int(os.getenv("WS_REPLAY_PAGE_BYTES", str(64 * 1024)))
+# How long messages missing from another worker's stream are waited for in the
+# state backend before they are skipped
+WS_REMOTE_GAP_TIMEOUT = float(os.getenv("WS_REMOTE_GAP_TIMEOUT", "5"))
+
+metrics = MetricsFactory.get_instance()
+
+
+class PendingBatch:
+    """Encoded task_progress messages waiting to be sent as one frame."""
     def __init__(self):
-        self.active_connections = {}
-        self.session_states = {}  # Store all state messages per session
-        self.connection_locks = {}  # Per-session locks for connection management
-
-    async def connect(self, session_id: str, websocket: WebSocket):
-        # Create connection lock if it doesn't exist
-        if session_id not in self.connection_locks:
-            self.connection_locks[session_id] = asyncio.Lock()
-            
-        async with self.connection_locks[session_id]:
-            # Prepare state data before accepting connection
-            state_data = None
-            if session_id in self.session_states:
-                state_data = {
-                    "type": "initial_state",
-                    "message": f"Restoring session with {len(self.session_states[session_id])} saved messages",
-                    "state_messages": [entry["data"] for entry in self.session_states[session_id]],
-                    "state_count": len(self.session_states[session_id])
-                }
-                print(f"Preparing initial state for {session_id} with {len(self.session_states[session_id])} messages")
-            else:
-                state_data = {
-                    "type": "initial_state", 
-                    "message": "New session - no saved state",
-                    "state_messages": [],
-                    "state_count": 0
-                }
-                print(f"No saved state found for session {session_id}")
-            
-            await websocket.accept()
-            self.active_connections[session_id] = websocket
-            
-            # Send initial state immediately after connection
-            try:
-                await websocket.send_json(state_data)
-                print(f"Sent initial state to {session_id}")
-                
-                # Send connection ready signal
-                await websocket.send_json({
-                    "type": "connection_ready",
-                    "session_id": session_id
-                })
-                print(f"Sent connection_ready to {session_id}")
-                
-            except Exception as e:
-                print(f"Error sending initial state to {session_id}: {e}")
-                self.disconnect(session_id)
-
-    def disconnect(self, session_id: str):
-        if session_id in self.active_connections:
+        self.messages = []  # Encoded messages, in send order
+        self.size = 0
+        self.flush_task = None
+
+
+class WebSocketManager:
+    def __init__(self, coalesce: bool = WS_COALESCE_ENABLED,
+                 coalesce_window: float = WS_COALESCE_WINDOW_MS / 1000.0,
+                 coalesce_max_bytes: int = WS_COALESCE_MAX_BYTES,
+                 queue_size: int = WS_OUTBOUND_QUEUE_SIZE,
+                 backpressure_policy: str = WS_BACKPRESSURE_POLICY,
+                 state_backend=None,
+                 event_bus=None):
+        self.active_connections = {}  # session_id -> {websocket: SessionConnection}
+        # Saved messages of all sessions; connected sessions are never evicted
+        self.replay_store = ReplayStore(
+            is_evictable=lambda session_id: session_id not in self.active_connections,
+            on_evict=self._on_replay_evicted,
+        )
+        self.pending_batches = {}  # Per-session task_progress messages awaiting flush
+        self.progress_serializers = {}  # Per-session delta encoders for run events
+        self.session_seqs = {}  # Last sequence number assigned per session
+        # Mirrors the replay log for other workers, if shared
+        self.state_backend = state_backend or StateBackendFactory.get_instance()
+        # Carries messages to sockets held by other workers, if shared
+        self.event_bus = event_bus or EventBusFactory.get_instance()
+        self.remote_handlers = {}  # session_id -> outbound channel handler, while subscribed
+        self.remote_inboxes = {}  # session_id -> relayed envelopes not yet delivered
+        self.remote_relays = {}  # session_id -> task delivering them
+        self.remote_gaps = {}  # session_id -> {seq: payload} received while earlier ones are missing
+        self.gap_fillers = {}  # session_id -> task fetching the missing ones
+        self.worker_id = WORKER_ID
+        self.first_progress_listeners = []  # Called with the session ID on its first run event
+        self.coalesce = coalesce
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_bytes = coalesce_max_bytes
+        self.queue_size = queue_size
+        self.backpressure_policy = backpressure_policy
+        # One task pings and reaps all connections; started with the first one
+        self.heartbeat = HeartbeatReaper(self._all_connections)
+
+        metrics.register_gauge("replay.sessions", lambda: len(self.replay_store))
+        metrics.register_gauge("replay.bytes", lambda: self.replay_store.total_bytes)
+        metrics.register_gauge("websocket.connections", lambda: sum(len(c) for c in self.active_connections.values()))
+
+    def add_first_progress_listener(self, listener):
+        self.first_progress_listeners.append(listener)
+
+    async def connect(self, session_id: str, websocket: WebSocket, last_seq: int = None) -> SessionConnection:
+        """
+        Accept a WebSocket and replay the session's saved state ahead of live messages.
+
+        Replay is streamed by the connection's writer as ``state_page`` frames of
+        at most ``WS_REPLAY_PAGE_BYTES`` each, built lazily from the replay store,
+        then a ``state_end`` marker. Messages sent meanwhile are queued and
+        delivered right after, in order.
+
+        A session can have any number of subscribers; each one gets every
+        message through its own queue and writer.
+
+        Args:
+            session_id: The session ID to connect to
+            websocket: The client socket
+            last_seq: Sequence number of the last message the client already has.
+                Only newer messages are replayed; if some of them were already
+                evicted the client gets a full snapshot instead.
+
+        Returns:
+            SessionConnection: The new subscriber
+        """
+        await websocket.accept()
+
+        # The session's task may run on another worker; take its messages from
+        # the bus before fixing the replay range so none fall in between
+        if self.event_bus.shared and session_id not in self.remote_handlers:
+            handler = self.remote_handlers[session_id] = functools.partial(self._on_remote_message, session_id)
+            await self.event_bus.subscribe(outbound_channel(session_id), handler)
+
+        # Messages batched so far belong to the existing subscribers; the new one
+        # gets them from replay
+        while session_id in self.pending_batches:
+            await self.flush(session_id)
+
+        # Fix the replay range and register the connection without yielding, so
+        # every message sent from here on is queued after the replayed ones
+        current_seq = self.session_seqs.get(session_id, 0)
+        buffer = self.replay_store.get(session_id)
+        self.replay_store.touch(session_id)
+        if last_seq is not None and last_seq <= current_seq and (buffer is None or buffer.can_resume(last_seq)):
+            mode, after_seq = "resume", last_seq
+        else:
+            if last_seq is not None:
+                print(f"Messages after {last_seq} were evicted for {session_id}, sending full snapshot")
+            mode, after_seq = "snapshot", 0
+        print(f"Replaying {session_id} in {mode} mode, messages {after_seq + 1} to {current_seq}")
+
+        connection = SessionConnection(session_id, websocket, self.queue_size, self.backpressure_policy)
+        connection.queue.put_nowait(encode_message({
+            "type": "connection_ready",
+            "session_id": session_id
+        }))
+        self.active_connections.setdefault(session_id, {})[websocket] = connection
+        connection.start(replay=self._replay_frames(session_id, mode, after_seq, current_seq))
+        self.heartbeat.start()
+        print(f"Connected {session_id} ({len(self.active_connections[session_id])} subscribers)")
+        return connection
+
+    def _replay_frames(self, session_id: str, mode: str, after_seq: int, upto_seq: int):
+        """
+        Lazily build the replay frames for one connection.
+
+        Each page is read from the replay store only when the writer is ready to
+        send it, so a large replay never sits in memory as a whole.
+        """
+        page_number = 0
+        count = 0
+        while after_seq < upto_seq:
+            buffer = self.replay_store.get(session_id)
+            if buffer is None:
+                break
+            payloads, after_seq = buffer.page(after_seq, upto_seq, WS_REPLAY_PAGE_BYTES)
+            if not payloads:
+                break
+            page_number += 1
+            count += len(payloads)
+            yield encode_with_raw_list({
+                "type": "state_page",
+                "mode": mode,
+                "page": page_number,
+            }, "state_messages", payloads)
+
+        yield encode_message({
+            "type": "state_end",
+            "mode": mode,
+            "message": f"Restored {count} saved messages" if count else "New session - no saved state",
+            "pages": page_number,
+            "state_count": count,
+            "last_seq": upto_seq
+        })
+
+    def disconnect(self, session_id: str, websocket: WebSocket = None):
+        """
+        Remove one subscriber, or all of them if no socket is given.
+
+        The other subscribers keep their queues, so nothing in flight to them is lost.
+        """
+        connections = self.active_connections.get(session_id)
+        if not connections:
+            return
+        removed = list(connections) if websocket is None else [websocket]
+        for socket in removed:
+            connection = connections.pop(socket, None)
+            if connection:
+                connection.stop()
+        if not connections:
             del self.active_connections[session_id]
+            # Nothing left to deliver a pending batch to; it is already in session state
+            self._discard_batch(session_id)
+            handler = self.remote_handlers.pop(session_id, None)
+            if handler:
+                self.event_bus.unsubscribe(outbound_channel(session_id), handler)
+
+    def _all_connections(self):
+        for connections in list(self.active_connections.values()):
+            yield from list(connections.values())
+
+    async def _dispatch(self, session_id: str, frame: bytes, droppable: bool, timeout: float) -> bool:
+        """
+        Queue an encoded frame for every subscriber of a session.
+
+        Subscribers with room are served immediately; only the ones with a full
+        queue go through their backpressure policy, concurrently, so one slow
+        tab does not delay the others.
+        """
+        connections = self.active_connections.get(session_id)
+        if not connections:
+            return False
+        blocked = [connection for connection in list(connections.values()) if not connection.try_enqueue(frame)]
+        if blocked:
+            await asyncio.gather(*(connection.enqueue(frame, droppable, timeout) for connection in blocked))
+        return True
 
     async def send_json(self, session_id: str, data, save_state: bool = True, timeout: float = 5.0):
         """
-        Send JSON message to WebSocket client with timeout and retry logic.
+        Queue a JSON message for every WebSocket client of the session.
+
+        Saved messages are stamped with a per-session ``seq`` that clients pass
+        back as ``last_seq`` when they reconnect.
+
+        The message is encoded once and only enqueued; each connection's writer
+        task delivers it.
+        ``task_progress`` messages are coalesced per session and flushed when the
+        coalesce window elapses or the batch grows past ``coalesce_max_bytes``.
+        Any other message flushes the pending batch first and is queued right away.
         
         Args:
             session_id: The session ID to send to
             data: The message data
             save_state: Whether to save this message in session state for replay
-            timeout: Timeout for sending message
-        """
-        # Use connection lock to ensure thread safety
-        if session_id not in self.connection_locks:
-            self.connection_locks[session_id] = asyncio.Lock()
-            
-        async with self.connection_locks[session_id]:
-            ws = self.active_connections.get(session_id)
-            if ws:
-                try:
-                    # print(f"Sending WebSocket message to {session_id}: {data}")
-                    await asyncio.wait_for(ws.send_json(data), timeout=timeout)
-                    
-                    # Save state if requested
-                    if save_state:
-                        self._save_state(session_id, data)
-                        
-                except asyncio.TimeoutError:
-                    print(f"Timeout sending WebSocket message to {session_id}")
-                    # Don't disconnect on timeout, client might be processing
-                    if save_state:
-                        self._save_state(session_id, data)
-                except Exception as e:
-                    print(f"Error sending WebSocket message to {session_id}: {e}")
-                    # Save state even if send failed for replay
-                    if save_state:
-                        self._save_state(session_id, data)
-            else:
-                print(f"No active WebSocket connection for {session_id}, saving to state")
-                # Save state even if no connection for replay when client reconnects
-                if save_state:
-                    self._save_state(session_id, data)
+            timeout: How long to wait for queue space under the block policy
+        """
+        # Save first: if the client is missing or too slow, replay delivers it later.
+        # The message is encoded exactly once; the same bytes are sent and replayed.
+        seq = None
+        if save_state:
+            seq, payload = self._save_state(session_id, data)
+        else:
+            payload = encode_message(data)
+
+        if self.event_bus.shared:
+            # Sockets on other workers get it through the bus
+            self.event_bus.publish(outbound_channel(session_id), pack_envelope(self.worker_id, seq, payload))
+
+        await self._deliver(session_id, data, payload, timeout)
+
+    async def _deliver(self, session_id: str, data, payload: bytes, timeout: float):
+        """Queue an encoded message for this worker's subscribers, coalescing if streamed."""
+        if self.coalesce and data.get("type") in COALESCED_MESSAGE_TYPES:
+            await self._add_to_batch(session_id, data, payload, timeout)
+            return
+
+        # Control message: deliver whatever is batched first to keep ordering
+        await self.flush(session_id, timeout)
+
+        if not await self._dispatch(session_id, payload, is_droppable(data), timeout):
+            print(f"No active WebSocket connection for {session_id}, saving to state")
+
+    async def send_progress(self, session_id: str, event: dict, save_state: bool = True):
+        """
+        Send a streamed run event as a compact task_progress delta.
+
+        Args:
+            session_id: The session ID to send to
+            event: The event as returned by ``RunResponseEvent.to_dict()``
+            save_state: Whether to save the messages in session state for replay
+        """
+        serializer = self.progress_serializers.get(session_id)
+        if serializer is None:
+            serializer = self.progress_serializers[session_id] = ProgressSerializer()
+            for listener in self.first_progress_listeners:
+                listener(session_id)
+        for message in serializer.serialize(event):
+            await self.send_json(session_id, message, save_state=save_state)
+
+    async def flush(self, session_id: str, timeout: float = 5.0):
+        """
+        Queue any batched task_progress messages for a session as one frame.
+
+        A single pending message is sent as-is; two or more are wrapped in a
+        ``task_progress_batch`` frame whose ``messages`` keep their original order.
+        """
+        batch = self.pending_batches.pop(session_id, None)
+        if batch is None:
+            return
+        if batch.flush_task and batch.flush_task is not asyncio.current_task():
+            batch.flush_task.cancel()
+
+        if len(batch.messages) == 1:
+            frame = batch.messages[0]
+        else:
+            frame = encode_with_raw_list({"type": "task_progress_batch"}, "messages", batch.messages)
+
+        # A client that missed a run event would show an incomplete answer, so a batch is never dropped
+        await self._dispatch(session_id, frame, False, timeout)
+
+    async def _add_to_batch(self, session_id: str, data, payload: bytes, timeout: float):
+        """Collect a streamed message and flush once the size or time window is reached."""
+        if session_id not in self.active_connections:
+            # Saved for replay already; there is nobody to batch for
+            return
+
+        batch = self.pending_batches.get(session_id)
+        if batch is None:
+            batch = self.pending_batches[session_id] = PendingBatch()
+        batch.messages.append(payload)
+        batch.size += len(payload)
+
+        if batch.size >= self.coalesce_max_bytes:
+            await self.flush(session_id, timeout)
+        elif batch.flush_task is None:
+            batch.flush_task = asyncio.create_task(self._flush_after_window(session_id, batch, timeout))
+
+    async def _flush_after_window(self, session_id: str, batch: PendingBatch, timeout: float):
+        await asyncio.sleep(self.coalesce_window)
+        # The batch may already have been flushed by size or by a control message
+        if self.pending_batches.get(session_id) is batch:
+            await self.flush(session_id, timeout)
+
+    def _discard_batch(self, session_id: str):
+        batch = self.pending_batches.pop(session_id, None)
+        if batch and batch.flush_task and batch.flush_task is not asyncio.current_task():
+            batch.flush_task.cancel()
 
     def is_connected(self, session_id: str) -> bool:
         """Check if a session has an active WebSocket connection."""
-        return session_id in self.active_connections
+        return bool(self.active_connections.get(session_id))
 
-    def _save_state(self, session_id: str, data):
-        """Save state message for session replay."""
-        if session_id not in self.session_states:
-            self.session_states[session_id] = []
-        
-        # Add timestamp for debugging
-        state_entry = {
-            "timestamp": asyncio.get_event_loop().time(),
-            "data": data
-        }
-        self.session_states[session_id].append(state_entry)
-        
-        # Keep only last 100 state messages to prevent memory issues
-        if len(self.session_states[session_id]) > 100:
-            self.session_states[session_id] = self.session_states[session_id][-100:]
-
-    def clear_session_state(self, session_id: str):
-        """Clear saved state for a session."""
-        if session_id in self.session_states:
-            del self.session_states[session_id]
+    def connection_count(self, session_id: str) -> int:
+        """Get the number of WebSocket subscribers of a session."""
+        return len(self.active_connections.get(session_id, {}))
+
+    def _save_state(self, session_id: str, data) -> tuple:
+        """
+        Save state message for session replay.
+
+        Returns:
+            tuple: The session's next sequence number and the message stamped with it, encoded
+        """
+        seq = self.session_seqs.get(session_id, 0) + 1
+        self.session_seqs[session_id] = seq
+        payload = encode_message({**data, "seq": seq})
+        self.replay_store.append(session_id, seq, data.get("type"), payload, data)
+        self.state_backend.write("append_message", session_id, seq, data.get("type"), payload)
+        return seq, payload
+
+    def _on_remote_message(self, session_id: str, envelope: bytes):
+        """
+        Hand a message from the bus to the session's relay task.
+
+        The bus reader serves every session on this worker, so it must not wait
+        on any one session's clients; each session's messages are delivered in
+        order by its own task instead.
+        """
+        inbox = self.remote_inboxes.get(session_id)
+        if inbox is None:
+            inbox = self.remote_inboxes[session_id] = deque()
+        inbox.append(envelope)
+        if session_id not in self.remote_relays:
+            self.remote_relays[session_id] = asyncio.create_task(self._relay(session_id, inbox))
+
+    async def _relay(self, session_id: str, inbox: deque):
+        """Deliver a session's relayed messages in arrival order until none are left."""
+        try:
+            while inbox and self.remote_inboxes.get(session_id) is inbox:
+                try:
+                    await self._relay_message(session_id, inbox.popleft())
+                except Exception as e:
+                    print(f"Error relaying message for {session_id}: {e}")
+        finally:
+            if self.remote_relays.get(session_id) is asyncio.current_task():
+                del self.remote_relays[session_id]
+            if self.remote_inboxes.get(session_id) is inbox and not inbox:
+                del self.remote_inboxes[session_id]
+
+    async def _relay_message(self, session_id: str, envelope: bytes):
+        """
+        Deliver a message published by the worker running the session's task.
+
+        Saved messages are added to this worker's replay state under the seq the
+        owner gave them, in seq order. A gap means messages were published
+        before this worker subscribed; the messages after it are held back
+        while the missing ones are fetched from the state backend.
+        """
+        origin, seq, payload = unpack_envelope(envelope)
+        if origin == self.worker_id:
+            return  # Already delivered locally
+        if not seq:
+            await self._deliver(session_id, decode_message(payload), payload, WS_SEND_TIMEOUT)
+            return
+        current_seq = self.session_seqs.get(session_id, 0)
+        if seq <= current_seq:
+            return  # Already have it, from hydration
+        waiting = self.remote_gaps.get(session_id)
+        if waiting is None and seq == current_seq + 1:
+            await self._apply_remote(session_id, seq, payload)
+            return
+        if waiting is None:
+            waiting = self.remote_gaps[session_id] = {}
+        waiting[seq] = payload
+        if session_id not in self.gap_fillers:
+            self.gap_fillers[session_id] = asyncio.create_task(self._fill_gap(session_id, waiting))
+
+    async def _fill_gap(self, session_id: str, waiting: dict):
+        """
+        Fetch the messages missing before those in ``waiting``, then deliver them all in order.
+
+        The owner saves messages to the state backend write-behind, so the
+        missing ones may not be readable yet; the backend is polled until they
+        are. Only messages still missing after ``WS_REMOTE_GAP_TIMEOUT`` are
+        skipped.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WS_REMOTE_GAP_TIMEOUT
+        delay = 0.05
+        try:
+            while waiting and self.remote_gaps.get(session_id) is waiting:
+                current_seq = self.session_seqs.get(session_id, 0)
+                for stale in [held for held in waiting if held <= current_seq]:
+                    del waiting[stale]
+                if waiting and current_seq + 1 not in waiting:
+                    try:
+                        for missed_seq, missed_payload in await self.state_backend.load_messages(session_id, current_seq):
+                            waiting.setdefault(missed_seq, missed_payload)
+                    except Exception as e:
+                        print(f"Error loading missed messages for {session_id}: {e}")
+                    if self.remote_gaps.get(session_id) is not waiting:
+                        return  # Cleared meanwhile
+                    current_seq = self.session_seqs.get(session_id, 0)
+                if not waiting:
+                    return
+                if current_seq + 1 not in waiting:
+                    if loop.time() < deadline:
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, 1.0)
+                        continue
+                    first_seq = min(waiting)
+                    print(f"Messages {current_seq + 1} to {first_seq - 1} of {session_id} never reached the state backend, skipping them")
+                    metrics.increment("event_bus.skipped", first_seq - current_seq - 1)
+                    current_seq = first_seq - 1
+
+                while current_seq + 1 in waiting and self.remote_gaps.get(session_id) is waiting:
+                    current_seq += 1
+                    await self._apply_remote(session_id, current_seq, waiting.pop(current_seq))
+                deadline = loop.time() + WS_REMOTE_GAP_TIMEOUT
+                delay = 0.05
+        finally:
+            if self.gap_fillers.get(session_id) is asyncio.current_task():
+                del self.gap_fillers[session_id]
+            if self.remote_gaps.get(session_id) is waiting and not waiting:
+                del self.remote_gaps[session_id]
+
+    async def _apply_remote(self, session_id: str, seq: int, payload: bytes):
+        """Save and deliver a message another worker saved under ``seq``."""
+        data = decode_message(payload)
+        data.pop("seq", None)
+        self.replay_store.append(session_id, seq, data.get("type"), payload, data)
+        self.session_seqs[session_id] = seq
+        await self._deliver(session_id, data, payload, WS_SEND_TIMEOUT)
+
+    def _discard_remote(self, session_id: str):
+        """Drop relayed messages not delivered yet, and stop the tasks delivering them."""
+        self.remote_inboxes.pop(session_id, None)
+        self.remote_gaps.pop(session_id, None)
+        for task in (self.remote_relays.pop(session_id, None), self.gap_fillers.pop(session_id, None)):
+            if task and task is not asyncio.current_task():
+                task.cancel()
+
+    async def hydrate(self, session_id: str) -> int:
+        """
+        Load a session's replay log from the shared state backend.
+
+        Used when a session is reached on a worker that does not hold its replay
+        state, because another worker created it or it was evicted here.
+
+        Returns:
+            int: The number of messages loaded
+        """
+        if not self.state_backend.shared or session_id in self.replay_store:
+            return 0
+        messages = await self.state_backend.load_messages(session_id)
+        # Another coroutine may have saved or loaded state meanwhile
+        if session_id in self.replay_store:
+            return 0
+        for seq, payload in messages:
+            data = decode_message(payload)
+            data.pop("seq", None)
+            self.replay_store.append(session_id, seq, data.get("type"), payload, data)
+        if messages:
+            self.session_seqs[session_id] = messages[-1][0]
+            print(f"Hydrated {len(messages)} saved messages for {session_id} from the state backend")
+        return len(messages)
+
+    def _on_replay_evicted(self, session_id: str):
+        """Drop the rest of an evicted session's bookkeeping so nothing leaks."""
+        metrics.increment("replay.evictions")
+        self._discard_batch(session_id)
+        self._discard_remote(session_id)
+        self.progress_serializers.pop(session_id, None)
+        self.session_seqs.pop(session_id, None)
+
+    def clear_session_state(self, session_id: str, local_only: bool = False):
+        """
+        Clear saved state for a session.
+
+        Args:
+            session_id: The session to clear
+            local_only: Only drop this worker's copy, leaving the shared state alone
+        """
+        if self.replay_store.remove(session_id):
             print(f"Cleared session state for {session_id}")
-            
-        # Also cleanup connection lock
-        self.cleanup_connection_lock(session_id)
+        if not local_only:
+            self.state_backend.write("delete_messages", session_id)
+
+        # Also cleanup pending batch, relayed messages and delta encoder
+        self._discard_batch(session_id)
+        self._discard_remote(session_id)
+        self.progress_serializers.pop(session_id, None)
+        self.session_seqs.pop(session_id, None)
 
     def get_session_state_count(self, session_id: str) -> int:
         """Get the number of saved state messages for a session."""
-        return len(self.session_states.get(session_id, []))
+        buffer = self.replay_store.get(session_id)
+        return buffer.memory_usage()["messages"] if buffer else 0
 
     def get_session_state(self, session_id: str) -> list:
         """Get all saved state messages for a session."""
-        return [entry["data"] for entry in self.session_states.get(session_id, [])]
+        buffer = self.replay_store.get(session_id)
+        return [decode_message(payload) for payload in buffer.snapshot()] if buffer else []
+
+    def get_session_state_payloads(self, session_id: str) -> list:
+        """Get all saved state messages for a session as encoded JSON."""
+        buffer = self.replay_store.get(session_id)
+        return buffer.snapshot() if buffer else []
 
-    def cleanup_connection_lock(self, session_id: str):
-        """Clean up connection lock for a session."""
-        if session_id in self.connection_locks:
-            del self.connection_locks[session_id]
+    def get_session_state_usage(self, session_id: str) -> dict:
+        """Get how many messages and bytes of replay state a session holds."""
+        buffer = self.replay_store.get(session_id)
+        if buffer is None:
+            return {"messages": 0, "payload_bytes": 0, "estimated_bytes": 0}
+        return buffer.memory_usage()
 
 
 class WebSocketManagerFactory:
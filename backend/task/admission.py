@@ -0,0 +1,220 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from service.metrics import MetricsFactory
+from task.scheduler import ANONYMOUS_TENANT, FairQueue
+
+# Concurrent runs per handler type: a default, overridable per handler, e.g.
+# ADMISSION_LIMITS="agent=8,team=2"
+ADMISSION_MAX_RUNNING = int(os.getenv("ADMISSION_MAX_RUNNING", "8"))
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "")
+# Requests that may wait for a run slot per handler type, across tenants; more get a 429
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "32"))
+# Retry-After when there is no run duration to estimate from yet
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+
+metrics = MetricsFactory.get_instance()
+
+
+def parse_limits(spec: str) -> dict:
+    limits = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            limits[name.strip()] = int(value)
+    return limits
+
+
+class AdmissionTicket:
+    """A request's place in a handler's queue, and then its run slot."""
+    __slots__ = ("queue", "session_id", "tenant", "finish", "ready", "admitted", "released", "enqueued_at", "started_at", "position", "future")
+
+    def __init__(self, queue, session_id: str = None, tenant: str = ANONYMOUS_TENANT):
+        self.queue = queue
+        self.session_id = session_id
+        self.tenant = tenant
+        self.finish = 0.0  # Virtual finish tag in the fair queue
+        self.ready = False  # Set by ``AdmissionQueue.attach`` once the run could start
+        self.admitted = False
+        self.released = False
+        self.enqueued_at = time.perf_counter()
+        self.started_at = None
+        self.position = None  # Last position reported to the client
+        self.future = asyncio.get_running_loop().create_future()
+
+    async def wait(self, cancel_event=None) -> bool:
+        """
+        Wait for a run slot.
+
+        Args:
+            cancel_event: Stop waiting once this is set
+
+        Returns:
+            bool: True once admitted, False if cancelled first
+        """
+        if self.admitted:
+            return True
+        if cancel_event is None:
+            await self.future
+            return True
+        cancelled = asyncio.ensure_future(cancel_event.wait())
+        try:
+            await asyncio.wait({self.future, cancelled}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            cancelled.cancel()
+        return self.admitted
+
+    def release(self):
+        """Give up the queue place or the run slot. Safe to call more than once."""
+        self.queue.release(self)
+
+
+class AdmissionQueue:
+    """
+    Bounded concurrency for one handler type.
+
+    At most ``max_running`` runs at a time; up to ``max_queued`` more wait,
+    and anything beyond that is rejected. A request only competes for a run
+    slot once ``attach`` says it could start, i.e. its client has connected,
+    so no slot is held while a client is still connecting; until then it
+    counts against ``max_queued`` like any other waiting request. Waiting
+    requests are admitted in weighted fair order across tenants (see
+    ``FairQueue``), each tenant within its own concurrency and queue caps.
+    Waiting requests get their queue position through ``on_position``
+    whenever it changes.
+    """
+    def __init__(self, name: str, max_running: int, max_queued: int, on_position=None, fair_queue: FairQueue = None):
+        self.name = name
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.on_position = on_position  # Called with (ticket, position, queue_length); 0 means admitted
+        self.running = 0
+        self.waiting = FairQueue() if fair_queue is None else fair_queue
+        metrics.register_gauge(f"admission.{name}.running", lambda: self.running)
+        metrics.register_gauge(f"admission.{name}.queued", lambda: len(self.waiting))
+
+    def reserve(self, session_id: str = None, tenant: str = ANONYMOUS_TENANT):
+        """
+        Take a place in the queue.
+
+        Args:
+            session_id: The session the run belongs to, if already known
+            tenant: Who the request is scheduled as
+
+        Returns:
+            AdmissionTicket: The place, or None if the queue or the tenant's share of it is full
+        """
+        if len(self.waiting) >= self.max_queued:
+            metrics.increment(f"admission.{self.name}.rejected")
+            return None
+        if self.waiting.is_full(tenant):
+            metrics.increment(f"admission.{self.name}.tenant_rejected")
+            return None
+        ticket = AdmissionTicket(self, session_id, tenant)
+        self.waiting.push(ticket)
+        return ticket
+
+    def attach(self, ticket: AdmissionTicket):
+        """Let a waiting request compete for a run slot, e.g. once its client connected."""
+        if ticket.ready or ticket.released:
+            return
+        ticket.ready = True
+        self._promote()
+
+    def release(self, ticket: AdmissionTicket):
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.admitted:
+            self.running -= 1
+            self.waiting.done(ticket)
+            metrics.observe(f"admission.{self.name}.run", time.perf_counter() - ticket.started_at)
+        else:
+            self.waiting.remove(ticket)
+            if not ticket.future.done():
+                ticket.future.cancel()
+        self._promote()
+
+    def announce(self, ticket: AdmissionTicket):
+        """Tell a waiting request its position even if it has not changed, e.g. once its client connects."""
+        if not ticket.admitted and not ticket.released:
+            ticket.position = None
+            self._report(ticket, list(self.waiting).index(ticket) + 1)
+
+    def retry_after(self) -> int:
+        """Estimate in seconds when a rejected request could get in."""
+        stats = metrics.timings.get(f"admission.{self.name}.run")
+        if not stats or not stats.count:
+            return ADMISSION_RETRY_AFTER
+        average = stats.total / stats.count
+        # Roughly how long until the queue ahead of it has drained by one place
+        return max(1, math.ceil(average * (len(self.waiting) + 1) / self.max_running))
+
+    def _promote(self):
+        """Admit waiting requests while there are free slots, then report positions."""
+        while self.waiting and self.running < self.max_running:
+            ticket = self.waiting.pop()
+            if ticket is None:
+                # Everyone waiting is at their tenant's cap
+                break
+            ticket.admitted = True
+            ticket.started_at = time.perf_counter()
+            self.running += 1
+            metrics.observe(f"admission.{self.name}.wait", ticket.started_at - ticket.enqueued_at)
+            if not ticket.future.done():
+                ticket.future.set_result(True)
+            self._report(ticket, 0)
+        for index, ticket in enumerate(self.waiting):
+            self._report(ticket, index + 1)
+
+    def _report(self, ticket: AdmissionTicket, position: int):
+        if ticket.position == position or ticket.session_id is None:
+            return
+        if ticket.position is None and position == 0:
+            # Admitted straight away; nothing to tell
+            ticket.position = 0
+            return
+        ticket.position = position
+        if self.on_position:
+            try:
+                self.on_position(ticket, position, len(self.waiting))
+            except Exception as e:
+                print(f"Error reporting queue position for {ticket.session_id}: {e}")
+
+
+class AdmissionController:
+    """One ``AdmissionQueue`` per handler type, created on first use."""
+    def __init__(self, max_running: int = ADMISSION_MAX_RUNNING, max_queued: int = ADMISSION_MAX_QUEUED,
+                 limits: dict = None, on_position=None):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.limits = parse_limits(ADMISSION_LIMITS) if limits is None else limits
+        self.on_position = on_position
+        self.queues = {}
+
+    def queue(self, handler_name: str) -> AdmissionQueue:
+        queue = self.queues.get(handler_name)
+        if queue is None:
+            queue = self.queues[handler_name] = AdmissionQueue(
+                handler_name,
+                self.limits.get(handler_name, self.max_running),
+                self.max_queued,
+                lambda ticket, position, length: self.on_position and self.on_position(ticket, position, length),
+            )
+        return queue
+
+
+class AdmissionControllerFactory:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                # Double-checked locking pattern
+                if cls._instance is None:
+                    cls._instance = AdmissionController()
+        return cls._instance
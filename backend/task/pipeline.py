@@ -0,0 +1,295 @@
+import asyncio
+import os
+import time
+from service.metrics import MetricsFactory
+from service.websocket_manager import WebSocketManagerFactory
+from task.stream_bridge import StreamBridgeFactory
+from task.task_manager import request_confirmations
+
+# Merge consecutive content deltas that arrive within this many seconds into
+# one task_progress message; 0 sends every delta as it comes
+PIPELINE_COALESCE_WINDOW = float(os.getenv("PIPELINE_COALESCE_WINDOW", "0"))
+# Stop merging once the merged content is this long
+PIPELINE_COALESCE_MAX_CHARS = int(os.getenv("PIPELINE_COALESCE_MAX_CHARS", "2048"))
+
+metrics = MetricsFactory.get_instance()
+ws_manager = WebSocketManagerFactory.get_instance()
+stream_bridge = StreamBridgeFactory.get_instance()
+
+
+class RunCancelled(Exception):
+    """Raised inside a pipeline once its session is cancelled."""
+
+
+class PipelineContext:
+    """What the stages of one run share."""
+    __slots__ = ("session_id", "task", "source", "stage_seconds", "attributed")
+
+    def __init__(self, session_id: str, task, source):
+        self.session_id = session_id
+        self.task = task
+        self.source = source
+        self.stage_seconds = {}  # Stage name -> seconds spent in it this run
+        self.attributed = 0.0  # Seconds already counted against some stage
+
+    def check_cancelled(self, where: str):
+        if self.task.cancel_event.is_set():
+            print(f"Task {self.session_id} cancelled during {where}")
+            raise RunCancelled()
+
+
+class RunnerSource:
+    """
+    Run events of an agno ``Agent`` or ``Team``.
+
+    Synchronous runs go through the stream bridge, so the model stream never
+    blocks the event loop; ``use_async`` uses ``arun`` instead, e.g. for
+    async MCP tools. ``resume`` continues a paused run the same way, with
+    ``continue_run`` or ``acontinue_run`` called with ``continue_kwargs``.
+    """
+    name = "source"
+
+    def __init__(self, runner, user_query: str, use_async: bool = False, continue_kwargs: dict = None):
+        self.runner = runner
+        self.user_query = user_query
+        self.use_async = use_async
+        self.run_kwargs = {"stream": True, "stream_intermediate_steps": True}
+        self.continue_kwargs = continue_kwargs or {"stream": True}
+
+    async def events(self):
+        if self.use_async:
+            stream = await self.runner.arun(self.user_query, **self.run_kwargs)
+        else:
+            stream = stream_bridge.stream(self.runner.run, self.user_query, **self.run_kwargs)
+        async for event in stream:
+            yield event
+
+    def paused_tools(self) -> list:
+        return self.runner.run_response.tools_requiring_confirmation
+
+    async def resume(self):
+        """Continue the run after its paused tools were confirmed or rejected."""
+        if self.use_async:
+            result = await self.runner.acontinue_run(**self.continue_kwargs)
+        else:
+            result = await stream_bridge.run(self.runner.continue_run, **self.continue_kwargs)
+        if hasattr(result, "to_dict"):
+            # A single event rather than a stream
+            yield result
+            return
+        stream = result if self.use_async else stream_bridge.iterate(result)
+        async for event in stream:
+            yield event
+
+
+class PauseStage:
+    """
+    Asks the user to confirm all of a paused run's tools in one round trip,
+    then streams the continued run in its place.
+    """
+    name = "pause"
+
+    def __init__(self, notify: bool = False):
+        self.notify = notify  # Tell the client the run is paused before asking
+
+    async def process(self, ctx: PipelineContext, events):
+        async for event in events:
+            if not getattr(event, "is_paused", False):
+                yield event
+                continue
+            print(f"Task {ctx.session_id} is paused. Waiting for user input or confirmation...")
+            if self.notify:
+                await ws_manager.send_json(ctx.session_id, {"type": "task_paused", "content": "Task is paused, waiting for user input."}, save_state=True)
+
+            # One round trip for every tool the run wants to call
+            tools = list(ctx.source.paused_tools())
+            ctx.check_cancelled("confirmation request")
+            for tool in tools:
+                print(f"Tool name [bold blue]{tool.tool_name}({tool.tool_args})[/] requires confirmation.")
+            decisions = await request_confirmations(ctx.session_id, [
+                {
+                    "name": tool.tool_name,
+                    "args": tool.tool_args,
+                    "message": f"Agent is trying to access {tool.tool_name} with query {tool.tool_args}. Do you want to proceed?",
+                }
+                for tool in tools
+            ])
+            ctx.check_cancelled("confirmation wait")
+            for tool, confirmed in zip(tools, decisions):
+                tool.confirmed = confirmed
+
+            # The continued run may pause again
+            async for resumed in self.process(ctx, ctx.source.resume()):
+                yield resumed
+
+
+class CancelGate:
+    """Stops the run before the next event once the session is cancelled."""
+    name = "cancel"
+
+    async def process(self, ctx: PipelineContext, events):
+        async for event in events:
+            ctx.check_cancelled("streaming")
+            yield event
+
+
+class ContentFilter:
+    """Drops events without content; the client has nothing to show for them."""
+    name = "filter"
+
+    async def process(self, ctx: PipelineContext, events):
+        async for event in events:
+            if getattr(event, "content", None) is not None:
+                yield event
+
+
+class Serializer:
+    name = "serialize"
+
+    async def process(self, ctx: PipelineContext, events):
+        async for event in events:
+            yield event.to_dict()
+
+
+class Coalescer:
+    """
+    Merges consecutive content deltas that arrive within ``window`` seconds.
+
+    Only deltas that differ in nothing but their content and timestamp are
+    merged, so the client sees the same text in fewer messages. Each merged
+    message saves a delta encode, a replay entry and a send. The first delta
+    waits at most ``window``.
+    """
+    name = "coalesce"
+
+    def __init__(self, window: float = PIPELINE_COALESCE_WINDOW, max_chars: int = PIPELINE_COALESCE_MAX_CHARS):
+        self.window = window
+        self.max_chars = max_chars
+
+    @staticmethod
+    def _key(event: dict):
+        if event.get("event") != "RunResponseContent" or not isinstance(event.get("content"), str):
+            return None
+        return {name: value for name, value in event.items() if name not in ("content", "created_at")}
+
+    async def process(self, ctx: PipelineContext, events):
+        if self.window <= 0:
+            async for event in events:
+                yield event
+            return
+
+        loop = asyncio.get_running_loop()
+        iterator = events.__aiter__()
+        pending = None  # The upstream step in flight
+        merged = merged_key = None
+        deadline = 0.0
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                timeout = None if merged is None else max(0.0, deadline - loop.time())
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    # Window elapsed; the step stays in flight for the next round
+                    yield merged
+                    merged = merged_key = None
+                    continue
+                step, pending = pending, None
+                try:
+                    event = step.result()
+                except StopAsyncIteration:
+                    if merged is not None:
+                        yield merged
+                    return
+
+                key = self._key(event)
+                if merged is not None and key is not None and key == merged_key:
+                    merged["content"] += event["content"]
+                    if len(merged["content"]) >= self.max_chars:
+                        yield merged
+                        merged = merged_key = None
+                    continue
+                if merged is not None:
+                    yield merged
+                    merged = merged_key = None
+                if key is not None:
+                    merged, merged_key = dict(event), key
+                    deadline = loop.time() + self.window
+                else:
+                    yield event
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+
+class WebSocketSink:
+    """Sends each event to the session's clients as a task_progress message."""
+    name = "sink"
+
+    async def consume(self, ctx: PipelineContext, data: dict):
+        await ws_manager.send_progress(ctx.session_id, data)
+
+
+def default_stages(notify_pause: bool = False) -> list:
+    return [PauseStage(notify=notify_pause), CancelGate(), ContentFilter(), Serializer(), Coalescer()]
+
+
+class StreamingPipeline:
+    """
+    Streams a run's events to its session through a chain of stages.
+
+    The source's events pass through each stage's ``process`` in turn and end
+    in the sink. The time spent in each stage, not counting time spent waiting
+    on the stages before it, is reported per run as ``pipeline.<stage>``; the
+    source's time is mostly the model producing tokens.
+    """
+    def __init__(self, source, stages: list = None, sink=None):
+        self.source = source
+        self.stages = default_stages() if stages is None else stages
+        self.sink = sink or WebSocketSink()
+
+    async def run(self, session_id: str, task) -> bool:
+        """
+        Stream the run to completion.
+
+        Returns:
+            bool: True if the run finished, False if it was cancelled (the
+            client has been told)
+        """
+        ctx = PipelineContext(session_id, task, self.source)
+        events = self._timed(ctx, self.source.name, self.source.events())
+        for stage in self.stages:
+            events = self._timed(ctx, stage.name, stage.process(ctx, events))
+        try:
+            async for data in events:
+                started = time.perf_counter()
+                await self.sink.consume(ctx, data)
+                ctx.stage_seconds[self.sink.name] = ctx.stage_seconds.get(self.sink.name, 0.0) + time.perf_counter() - started
+                metrics.increment("pipeline.events")
+            return True
+        except RunCancelled:
+            await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
+            return False
+        finally:
+            for name, seconds in ctx.stage_seconds.items():
+                metrics.observe(f"pipeline.{name}", seconds)
+
+    @staticmethod
+    async def _timed(ctx: PipelineContext, name: str, events):
+        """Pass ``events`` through, adding the time spent producing them to the stage ``name``."""
+        iterator = events.__aiter__()
+        while True:
+            started = time.perf_counter()
+            before = ctx.attributed
+            try:
+                event = await iterator.__anext__()
+                stop = False
+            except StopAsyncIteration:
+                stop = True
+            # Whatever the stages upstream took is theirs
+            own = time.perf_counter() - started - (ctx.attributed - before)
+            ctx.attributed += own
+            ctx.stage_seconds[name] = ctx.stage_seconds.get(name, 0.0) + own
+            if stop:
+                return
+            yield event
@@ -0,0 +1,351 @@
+import asyncio
+import importlib
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing.reduction import ForkingPickler
+from models.types import SessionTask
+from service.background import spawn
+from service.metrics import MetricsFactory
+
+# "inline" runs handlers on the web process's event loop; "process" runs them
+# in the worker processes below
+EXECUTION_BACKEND = os.getenv("EXECUTION_BACKEND", "inline").lower()
+PROCESS_POOL_SIZE = int(os.getenv("PROCESS_POOL_SIZE", str(os.cpu_count() or 2)))
+# Runs in flight per worker process; they are mostly waiting on the model
+PROCESS_WORKER_CONCURRENCY = int(os.getenv("PROCESS_WORKER_CONCURRENCY", "4"))
+# Runs a worker process starts before it is replaced, to bound leaks in tools
+PROCESS_MAX_RUNS = int(os.getenv("PROCESS_MAX_RUNS", "50"))
+# Where worker processes find the handlers, as "module:attribute"
+PROCESS_HANDLER_MAP = "routers.chat:HANDLER_MAP"
+
+metrics = MetricsFactory.get_instance()
+
+_CLOSE = object()
+
+
+class PipeChannel:
+    """
+    One end of a worker pipe, with its blocking I/O kept off the event loop.
+
+    ``send`` pickles the message right away, so later changes to it are not
+    sent, and queues the bytes for a writer thread; a full pipe or a large
+    payload only holds up that thread. A reader thread receives and unpickles
+    messages and hands each one to ``on_message`` on the event loop, in order.
+    ``on_message`` gets None once the other end is gone.
+    """
+    def __init__(self, conn, on_message, name: str = "pipe"):
+        self.conn = conn
+        self.loop = asyncio.get_running_loop()
+        self.on_message = on_message
+        self.outbox = queue.SimpleQueue()
+        self.closed = False
+        self.writer = threading.Thread(target=self._write, name=f"{name}-writer", daemon=True)
+        self.reader = threading.Thread(target=self._read, name=f"{name}-reader", daemon=True)
+        self.writer.start()
+        self.reader.start()
+
+    def send(self, message):
+        if self.closed:
+            return
+        self.outbox.put(ForkingPickler.dumps(message))
+
+    def close(self):
+        """Stop the writer once everything queued so far is sent."""
+        if not self.closed:
+            self.closed = True
+            self.outbox.put(_CLOSE)
+
+    def _write(self):
+        while True:
+            data = self.outbox.get()
+            if data is _CLOSE:
+                return
+            try:
+                self.conn.send_bytes(data)
+            except (OSError, ValueError) as e:
+                print(f"Error writing to pipe: {e}")
+                return
+
+    def _read(self):
+        while True:
+            try:
+                message = ForkingPickler.loads(self.conn.recv_bytes())
+            except (EOFError, OSError):
+                message = None
+            try:
+                self.loop.call_soon_threadsafe(self.on_message, message)
+            except RuntimeError:
+                return  # The event loop is closed
+            if message is None:
+                return
+
+
+class RelayWebSocketManager:
+    """
+    The part of ``WebSocketManager`` a handler uses, inside a worker process.
+
+    Messages go over the pipe to the web process, which sends and saves them
+    with its own manager; replay state lives there too.
+    """
+    def __init__(self, channel: PipeChannel):
+        self.channel = channel
+
+    async def send_json(self, session_id: str, data, save_state: bool = True, timeout: float = 5.0):
+        self.channel.send(("send", session_id, data, save_state))
+
+    async def send_progress(self, session_id: str, event: dict, save_state: bool = True):
+        self.channel.send(("progress", session_id, event, save_state))
+
+    def is_connected(self, session_id: str) -> bool:
+        return False
+
+    def clear_session_state(self, session_id: str, local_only: bool = False):
+        pass
+
+
+def worker_main(conn, handler_map: str = PROCESS_HANDLER_MAP):
+    """Entry point of a worker process: run handlers for the web process until told to stop."""
+    # Shared state and the sockets belong to the web process
+    os.environ["STATE_BACKEND"] = "memory"
+    os.environ["EVENT_BUS"] = "memory"
+    asyncio.run(_serve(conn, handler_map))
+
+
+async def _serve(conn, handler_map: str):
+    from service.state_backend import InMemoryStateBackend
+    from service.websocket_manager import WebSocketManagerFactory
+    from task.task_manager import handle_client_message, run_registry, session_manager
+    module_name, _, attribute = handler_map.partition(":")
+    handlers = getattr(importlib.import_module(module_name), attribute)
+
+    stopped = asyncio.Event()
+
+    async def run(session_id: str, handler_name: str, user_query: str):
+        error = None
+        try:
+            await handlers[handler_name](session_id, user_query)
+        except Exception as e:
+            error = str(e)
+        finally:
+            if session_manager.get_task(session_id):
+                session_manager.cleanup_session(session_id, local_only=True)
+            channel.send(("done", session_id, error))
+
+    def on_message(message):
+        if message is None:
+            # The web process is gone
+            stopped.set()
+            return
+        kind, session_id = message[0], message[1] if len(message) > 1 else None
+        if kind == "run":
+            _, session_id, handler_name, user_query, flags, connection_count = message
+            # The session as the web process has it when the run starts
+            task = SessionTask(user_query)
+            task.flags = flags
+            task.connection_count = connection_count
+            session_manager.sessions[session_id] = task
+            run_registry.start(session_id, run(session_id, handler_name, user_query))
+        elif kind == "client":
+            spawn(handle_client_message(session_id, message[2]))
+        elif kind == "cancel":
+            task = session_manager.get_task(session_id)
+            if task:
+                task.cancel_event.set()
+            # Interrupt the handler, as the web process does for inline runs
+            run_registry.cancel(session_id)
+        elif kind == "stop":
+            stopped.set()
+
+    channel = PipeChannel(conn, on_message, name="worker-pipe")
+
+    # The routers and the task manager already hold the manager; point the
+    # methods handlers use at the pipe rather than swapping the object
+    relay = RelayWebSocketManager(channel)
+    ws_manager = WebSocketManagerFactory.get_instance()
+    for name in ("send_json", "send_progress", "is_connected", "clear_session_state"):
+        setattr(ws_manager, name, getattr(relay, name))
+    session_manager.state_backend = InMemoryStateBackend()
+
+    await stopped.wait()
+    running = [handle.task for handle in run_registry.runs.values()]
+    if running:
+        await asyncio.gather(*running, return_exceptions=True)
+    # Let the writer send the last "done" messages before the process exits
+    channel.close()
+    await asyncio.to_thread(channel.writer.join, 5)
+
+
+class WorkerProcess:
+    """A worker process and the web-process side of its pipe."""
+    def __init__(self, executor):
+        self.executor = executor
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child_conn, executor.handler_map), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.runs = {}  # session_id -> future of the run's error, None if it succeeded
+        self.started = 0
+        self.retiring = False  # Takes no new runs; stops once the current ones are done
+        self.inbox = asyncio.Queue()
+        self.channel = PipeChannel(self.conn, self.inbox.put_nowait, name=f"worker-{self.process.pid}-pipe")
+        self.dispatcher = asyncio.create_task(self._dispatch())
+
+    def send(self, message):
+        self.channel.send(message)
+
+    async def _dispatch(self):
+        """Apply the worker's messages in the order it sent them."""
+        ws_manager = self.executor.ws_manager
+        while True:
+            message = await self.inbox.get()
+            if message is None:
+                break
+            kind, session_id = message[0], message[1]
+            try:
+                if kind == "send":
+                    await ws_manager.send_json(session_id, message[2], save_state=message[3])
+                elif kind == "progress":
+                    await ws_manager.send_progress(session_id, message[2], save_state=message[3])
+                elif kind == "done":
+                    future = self.runs.pop(session_id, None)
+                    if future and not future.done():
+                        future.set_result(message[2])
+                    self.executor._on_run_done(self)
+            except Exception as e:
+                print(f"Error handling {kind} from worker process for session {session_id}: {e}")
+
+        # The process exited; whatever it was running is lost
+        if self.runs:
+            metrics.increment("process_pool.crashed")
+        for session_id, future in list(self.runs.items()):
+            await ws_manager.send_json(session_id, {"type": "task_failed", "error": "Worker process exited"}, save_state=True)
+            if not future.done():
+                future.set_result("Worker process exited")
+        self.runs.clear()
+        self.executor._remove(self)
+        self.channel.close()
+        await asyncio.to_thread(self.channel.writer.join, 5)
+        self.conn.close()
+        await asyncio.to_thread(self.process.join, 5)
+
+
+class ProcessExecutor:
+    """
+    Runs handlers from ``HANDLER_MAP`` in a pool of worker processes.
+
+    The web process keeps the sockets, sessions and replay state. A run's
+    messages come back over the worker's pipe and are sent from here, and
+    client messages for a session running in a worker (confirmations, input,
+    cancel, connection changes) are forwarded to it. Each worker runs up to
+    ``concurrency`` runs and is replaced after starting ``max_runs``.
+    """
+    def __init__(self, size: int = PROCESS_POOL_SIZE, concurrency: int = PROCESS_WORKER_CONCURRENCY,
+                 max_runs: int = PROCESS_MAX_RUNS, enabled: bool = EXECUTION_BACKEND == "process",
+                 handler_map: str = PROCESS_HANDLER_MAP):
+        from service.session_manager import SessionManagerFactory
+        from service.websocket_manager import WebSocketManagerFactory
+        self.size = size
+        self.concurrency = concurrency
+        self.max_runs = max_runs
+        self.enabled = enabled
+        self.handler_map = handler_map
+        self.ws_manager = WebSocketManagerFactory.get_instance()
+        self.session_manager = SessionManagerFactory.get_instance()
+        self.workers = []
+        self.sessions = {}  # session_id -> WorkerProcess running it
+        self.available = None  # Set when a run slot frees up
+        metrics.register_gauge("process_pool.workers", lambda: len(self.workers))
+        metrics.register_gauge("process_pool.runs", lambda: len(self.sessions))
+
+    async def run(self, handler_name: str, session_id: str, user_query: str):
+        """Run a handler in a worker process and wait for it to finish."""
+        task = self.session_manager.get_task(session_id)
+        if not task:
+            print(f"No task found for session {session_id}")
+            return
+        worker = await self._acquire()
+        future = asyncio.get_running_loop().create_future()
+        worker.runs[session_id] = future
+        worker.started += 1
+        if worker.started >= self.max_runs:
+            worker.retiring = True
+        self.sessions[session_id] = worker
+        worker.send(("run", session_id, handler_name, user_query, task.flags, task.connection_count))
+        try:
+            error = await future
+        except asyncio.CancelledError:
+            worker.send(("cancel", session_id))
+            raise
+        finally:
+            self.sessions.pop(session_id, None)
+        if error:
+            print(f"Error during {handler_name} run in worker process for {session_id}: {error}")
+        # The handler cleaned up the worker's copy of the session; do the same here
+        if self.session_manager.get_task(session_id) and task.websocket_ready.is_set():
+            self.session_manager.cleanup_session(session_id)
+
+    def forward(self, session_id: str, data: dict):
+        """Pass a client message on to the worker process running the session, if any."""
+        worker = self.sessions.get(session_id)
+        if worker is None:
+            return
+        if data.get("type") == "cancel":
+            # The web process already told the client
+            worker.send(("cancel", session_id))
+        else:
+            worker.send(("client", session_id, data))
+
+    async def _acquire(self) -> WorkerProcess:
+        while True:
+            worker = self._pick()
+            if worker:
+                return worker
+            if self.available is None:
+                self.available = asyncio.Event()
+            self.available.clear()
+            await self.available.wait()
+
+    def _pick(self):
+        ready = [worker for worker in self.workers if not worker.retiring and len(worker.runs) < self.concurrency]
+        if ready:
+            return min(ready, key=lambda worker: len(worker.runs))
+        if sum(1 for worker in self.workers if not worker.retiring) < self.size:
+            worker = WorkerProcess(self)
+            self.workers.append(worker)
+            return worker
+        return None
+
+    def _on_run_done(self, worker: WorkerProcess):
+        if worker.retiring and not worker.runs:
+            metrics.increment("process_pool.recycled")
+            worker.send(("stop",))
+        if self.available:
+            self.available.set()
+
+    def _remove(self, worker: WorkerProcess):
+        if worker in self.workers:
+            self.workers.remove(worker)
+        if self.available:
+            self.available.set()
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.retiring = True
+            worker.send(("stop",))
+
+
+class ProcessExecutorFactory:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                # Double-checked locking pattern
+                if cls._instance is None:
+                    cls._instance = ProcessExecutor()
+        return cls._instance
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+from service.metrics import MetricsFactory
+
+metrics = MetricsFactory.get_instance()
+
+
+class RunHandle:
+    """The asyncio task running a session's handler."""
+    __slots__ = ("session_id", "task", "cancel_requested_at")
+
+    def __init__(self, session_id: str, task: asyncio.Task):
+        self.session_id = session_id
+        self.task = task
+        self.cancel_requested_at = None  # perf_counter time of the first cancel
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_requested_at is not None
+
+
+class RunRegistry:
+    """
+    The running handler task of each session, so cancelling a session can
+    interrupt it instead of waiting for the handler to look at ``cancel_event``.
+
+    Cancelling the task raises ``CancelledError`` at whatever the handler is
+    awaiting: a model stream step, a tool call, a confirmation. Async HTTP
+    streams are closed as that unwinds; a synchronous stream running in the
+    stream bridge is closed as soon as its current step returns. The time from
+    the cancel request until the task has finished is ``runs.time_to_cancel``.
+    """
+    def __init__(self):
+        self.runs = {}  # session_id -> RunHandle
+        metrics.register_gauge("runs.active", lambda: len(self.runs))
+
+    def start(self, session_id: str, coro) -> RunHandle:
+        """Run a handler coroutine as the session's task."""
+        handle = RunHandle(session_id, asyncio.create_task(coro))
+        self.runs[session_id] = handle
+        handle.task.add_done_callback(lambda _: self._finished(handle))
+        return handle
+
+    def get(self, session_id: str):
+        return self.runs.get(session_id)
+
+    def cancel(self, session_id: str) -> bool:
+        """
+        Interrupt a session's run.
+
+        Returns:
+            bool: Whether a run was cancelled
+        """
+        handle = self.runs.get(session_id)
+        if handle is None or handle.task.done():
+            return False
+        if handle.cancel_requested_at is None:
+            handle.cancel_requested_at = time.perf_counter()
+            metrics.increment("runs.cancelled")
+            print(f"Cancelling run for session {session_id}")
+        handle.task.cancel()
+        return True
+
+    def _finished(self, handle: RunHandle):
+        if self.runs.get(handle.session_id) is handle:
+            del self.runs[handle.session_id]
+        if handle.cancel_requested_at is not None:
+            metrics.observe("runs.time_to_cancel", time.perf_counter() - handle.cancel_requested_at)
+
+
+class RunRegistryFactory:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                # Double-checked locking pattern
+                if cls._instance is None:
+                    cls._instance = RunRegistry()
+        return cls._instance
@@ -0,0 +1,212 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import time
+from collections import deque
+
+# Who a request is scheduled as: this header if a trusted proxy set it, else
+# this claim of a bearer token signed with TENANT_JWT_SECRET (HS256), else
+# one shared tenant. Nothing the caller can choose freely is trusted.
+TENANT_HEADER = os.getenv("TENANT_HEADER", "X-Tenant-ID")
+TENANT_CLAIM = os.getenv("TENANT_CLAIM", "tenant")
+# Addresses of the proxies allowed to set TENANT_HEADER, comma-separated
+TENANT_TRUSTED_PROXIES = {host.strip() for host in os.getenv("TENANT_TRUSTED_PROXIES", "").split(",") if host.strip()}
+TENANT_JWT_SECRET = os.getenv("TENANT_JWT_SECRET", "")
+# Share of run slots per tenant, e.g. SCHEDULER_TENANT_WEIGHTS="interactive=4,batch=1"
+SCHEDULER_DEFAULT_WEIGHT = float(os.getenv("SCHEDULER_DEFAULT_WEIGHT", "1"))
+SCHEDULER_TENANT_WEIGHTS = os.getenv("SCHEDULER_TENANT_WEIGHTS", "")
+# Concurrent runs per tenant and handler type, overridable per tenant
+SCHEDULER_TENANT_MAX_RUNNING = int(os.getenv("SCHEDULER_TENANT_MAX_RUNNING", "4"))
+SCHEDULER_TENANT_LIMITS = os.getenv("SCHEDULER_TENANT_LIMITS", "")
+# Queued requests per tenant and handler type, so one tenant cannot fill the queue
+SCHEDULER_TENANT_MAX_QUEUED = int(os.getenv("SCHEDULER_TENANT_MAX_QUEUED", "8"))
+
+ANONYMOUS_TENANT = "anonymous"
+
+
+def parse_weights(spec: str) -> dict:
+    weights = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            weights[name.strip()] = float(value)
+    return weights
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _token_claim(authorization: str, claim: str, secret: str):
+    """
+    Read a claim from a bearer JWT signed with ``secret`` (HS256).
+
+    Returns None unless the signature checks out and the token has not expired.
+    """
+    scheme, _, token = authorization.partition(" ")
+    if not secret or scheme.lower() != "bearer" or token.count(".") != 2:
+        return None
+    header, payload, signature = token.split(".")
+    try:
+        if json.loads(_b64decode(header)).get("alg") != "HS256":
+            return None
+        expected = hmac.new(secret.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (binascii.Error, ValueError, AttributeError):
+        return None
+    if not isinstance(claims, dict):
+        return None
+    expires = claims.get("exp")
+    if isinstance(expires, (int, float)) and expires < time.time():
+        return None
+    value = claims.get(claim) or claims.get("sub")
+    return str(value) if value else None
+
+
+def tenant_of(headers, client_host: str = None) -> str:
+    """
+    Get the identity a request is scheduled under.
+
+    Tenants get their own weight and caps, so the identity only comes from a
+    trusted proxy's header or a verified token; any other request is
+    scheduled as ``ANONYMOUS_TENANT``.
+
+    Args:
+        headers: The request headers
+        client_host: The address of the immediate peer, checked against TENANT_TRUSTED_PROXIES
+    """
+    tenant = None
+    if client_host in TENANT_TRUSTED_PROXIES:
+        tenant = headers.get(TENANT_HEADER)
+    if not tenant and headers.get("Authorization"):
+        tenant = _token_claim(headers["Authorization"], TENANT_CLAIM, TENANT_JWT_SECRET)
+    return (tenant or "").strip()[:128] or ANONYMOUS_TENANT
+
+
+class TenantState:
+    __slots__ = ("weight", "max_running", "running", "queue", "last_finish")
+
+    def __init__(self, weight: float, max_running: int):
+        self.weight = weight
+        self.max_running = max_running
+        self.running = 0
+        self.queue = deque()  # Waiting tickets in arrival order
+        self.last_finish = 0.0  # Virtual finish tag of the newest queued ticket
+
+
+class FairQueue:
+    """
+    Weighted fair queueing of waiting tickets across tenants.
+
+    Each ticket gets a virtual finish tag when queued: it starts where its
+    tenant's previous ticket finished (or at the current virtual time, if the
+    tenant was idle) and costs ``1 / weight``. ``pop`` admits the ticket with
+    the smallest tag among tenants below their concurrency cap, so a tenant
+    with weight 4 gets four runs for each run of a weight 1 tenant while both
+    have work queued, and a tenant that just arrived does not wait behind a
+    backlog another tenant built up.
+
+    Tickets need ``tenant`` and ``finish`` attributes. A ticket whose
+    ``ready`` attribute is False keeps its place but is skipped by ``pop``.
+
+    ``ANONYMOUS_TENANT`` is shared by every caller that could not be
+    identified, so it has no caps of its own unless ``limits`` names it; the
+    admission queue's global caps still apply.
+    """
+    def __init__(self, weights: dict = None, limits: dict = None,
+                 default_weight: float = SCHEDULER_DEFAULT_WEIGHT,
+                 default_max_running: int = SCHEDULER_TENANT_MAX_RUNNING,
+                 max_queued: int = SCHEDULER_TENANT_MAX_QUEUED):
+        self.weights = parse_weights(SCHEDULER_TENANT_WEIGHTS) if weights is None else weights
+        self.limits = parse_weights(SCHEDULER_TENANT_LIMITS) if limits is None else limits
+        self.default_weight = default_weight
+        self.default_max_running = default_max_running
+        self.max_queued = max_queued
+        self.tenants = {}
+        self.virtual_time = 0.0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        """Waiting tickets in the order they would be admitted, caps aside."""
+        return iter(sorted((ticket for state in self.tenants.values() for ticket in state.queue),
+                           key=lambda ticket: ticket.finish))
+
+    def _tenant(self, tenant: str) -> TenantState:
+        state = self.tenants.get(tenant)
+        if state is None:
+            if tenant in self.limits:
+                max_running = int(self.limits[tenant])
+            elif tenant == ANONYMOUS_TENANT:
+                max_running = float("inf")
+            else:
+                max_running = self.default_max_running
+            state = self.tenants[tenant] = TenantState(
+                max(self.weights.get(tenant, self.default_weight), 0.01),
+                max_running,
+            )
+        return state
+
+    def is_full(self, tenant: str) -> bool:
+        state = self.tenants.get(tenant)
+        if state is None or (tenant == ANONYMOUS_TENANT and tenant not in self.limits):
+            return False
+        return len(state.queue) >= self.max_queued
+
+    def push(self, ticket):
+        state = self._tenant(ticket.tenant)
+        start = max(self.virtual_time, state.last_finish)
+        ticket.finish = state.last_finish = start + 1 / state.weight
+        state.queue.append(ticket)
+        self.size += 1
+
+    def pop(self):
+        """
+        Take the next ticket to admit and count it as running.
+
+        Returns:
+            The ticket, or None if every tenant with a ready ticket queued is at its cap
+        """
+        best = ticket = None
+        for state in self.tenants.values():
+            if state.running >= state.max_running:
+                continue
+            # The tenant's first ticket that can start; the others keep their place
+            candidate = next((queued for queued in state.queue if getattr(queued, "ready", True)), None)
+            if candidate is not None and (ticket is None or candidate.finish < ticket.finish):
+                best, ticket = state, candidate
+        if best is None:
+            return None
+        best.queue.remove(ticket)
+        best.running += 1
+        self.size -= 1
+        self.virtual_time = max(self.virtual_time, ticket.finish - 1 / best.weight)
+        return ticket
+
+    def remove(self, ticket):
+        """Drop a waiting ticket, e.g. when its session is cancelled."""
+        state = self.tenants[ticket.tenant]
+        state.queue.remove(ticket)
+        self.size -= 1
+        if ticket.finish == state.last_finish:
+            # Later tickets of this tenant should not pay for the one given up
+            state.last_finish = state.queue[-1].finish if state.queue else self.virtual_time
+        self._forget(ticket.tenant)
+
+    def done(self, ticket):
+        """A ticket returned by ``pop`` finished running."""
+        self.tenants[ticket.tenant].running -= 1
+        self._forget(ticket.tenant)
+
+    def _forget(self, tenant: str):
+        # An idle tenant starts over at the virtual time when it comes back
+        state = self.tenants[tenant]
+        if not state.queue and not state.running:
+            del self.tenants[tenant]
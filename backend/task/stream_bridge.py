@@ -0,0 +1,97 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from service.metrics import MetricsFactory
+
+# "thread" runs synchronous agno streams in the pool below; "inline" iterates
+# them on the event loop, as the handlers used to
+STREAM_EXECUTION = os.getenv("STREAM_EXECUTION", "thread").lower()
+# Threads shared by every synchronous stream; more streams than this take turns
+STREAM_BRIDGE_WORKERS = int(os.getenv("STREAM_BRIDGE_WORKERS", "32"))
+
+metrics = MetricsFactory.get_instance()
+
+_DONE = object()
+
+
+class StreamBridge:
+    """
+    Consumes synchronous streams from async code without blocking the event loop.
+
+    Each step of the stream (``next``) runs in a bounded thread pool and the
+    event loop awaits its result. Nothing is read ahead: the stream only
+    advances when the consumer asks for the next event, so a slow WebSocket
+    holds the model stream back as it did when it was iterated inline, and
+    the consumer can still inspect the agent (e.g. a paused run's tools)
+    between events. No thread is held between events, so a run that nests
+    a ``continue_run`` stream inside its first one cannot starve the pool.
+    """
+    def __init__(self, max_workers: int = STREAM_BRIDGE_WORKERS, mode: str = STREAM_EXECUTION):
+        if mode not in ("thread", "inline"):
+            raise ValueError(f"Unknown STREAM_EXECUTION: {mode}")
+        self.mode = mode
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stream-bridge")
+        self.active = 0
+        metrics.register_gauge("stream_bridge.active", lambda: self.active)
+
+    async def run(self, fn, *args, **kwargs):
+        """Call a blocking function, e.g. ``agent.continue_run``, off the event loop."""
+        if self.mode == "inline":
+            return fn(*args, **kwargs)
+        return await asyncio.wrap_future(self.executor.submit(fn, *args, **kwargs))
+
+    async def stream(self, fn, *args, **kwargs):
+        """Call a function returning a synchronous stream, e.g. ``agent.run``, and iterate it."""
+        async for item in self.iterate(await self.run(fn, *args, **kwargs)):
+            yield item
+
+    async def iterate(self, iterable):
+        """Iterate a synchronous iterable, one ``next`` at a time in the pool."""
+        if self.mode == "inline":
+            for item in iterable:
+                yield item
+            return
+
+        iterator = iter(iterable)
+        step = None
+        self.active += 1
+        try:
+            while True:
+                step = self.executor.submit(next, iterator, _DONE)
+                item = await asyncio.wrap_future(step)
+                if item is _DONE:
+                    return
+                metrics.increment("stream_bridge.events")
+                yield item
+        finally:
+            self.active -= 1
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                # Close the generator once the step in flight, if any, is done;
+                # closing it while it runs would raise
+                if step is None or step.done():
+                    self._close(close)
+                else:
+                    step.add_done_callback(lambda _: self._close(close))
+
+    def _close(self, close):
+        try:
+            self.executor.submit(close)
+        except RuntimeError:
+            # The pool is shut down; the interpreter is exiting
+            pass
+
+
+class StreamBridgeFactory:
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._lock:
+                # Double-checked locking pattern
+                if cls._instance is None:
+                    cls._instance = StreamBridge()
+        return cls._instance
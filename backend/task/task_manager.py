@@ -1,44 +1,303 @@
 import asyncio
+import functools
+import os
+import time
 
 from fastapi import BackgroundTasks
 from models.types import UserInputRequest
+from service.background import spawn
+from service.event_bus import EventBusFactory, inbound_channel
+from service.metrics import MetricsFactory
+from service.serialization import decode_message, encode_message
 from service.session_manager import SessionManagerFactory
+from service.timer_wheel import TimerWheelFactory
 from service.websocket_manager import WebSocketManagerFactory
+from task.admission import AdmissionControllerFactory
+from task.process_executor import ProcessExecutorFactory
+from task.run_registry import RunRegistryFactory
+
+# Session deadlines, in seconds; all of them run on the shared timer wheel
+CONNECT_TIMEOUT = float(os.getenv("CONNECT_TIMEOUT", "30"))
+INPUT_TIMEOUT = float(os.getenv("INPUT_TIMEOUT", "60"))
+CONFIRM_TIMEOUT = float(os.getenv("CONFIRM_TIMEOUT", "30"))
+RETRY_TIMEOUT = float(os.getenv("RETRY_TIMEOUT", "300"))
+# How long a run waits for the client's connection_acknowledged before starting anyway
+ACK_GRACE_TIMEOUT = float(os.getenv("ACK_GRACE_TIMEOUT", "2"))
+# How long a session outlives its last WebSocket, so a dropped client can
+# reconnect with last_seq and resume
+SESSION_DISCONNECT_GRACE = float(os.getenv("SESSION_DISCONNECT_GRACE", "30"))
+# Start runs before their client connects, unless the request says otherwise
+SPECULATIVE_START = os.getenv("SPECULATIVE_START", "false").lower() in ("1", "true", "yes")
 
 session_manager = SessionManagerFactory.get_instance()
 ws_manager = WebSocketManagerFactory.get_instance()
+timer_wheel = TimerWheelFactory.get_instance()
+event_bus = EventBusFactory.get_instance()
+admission = AdmissionControllerFactory.get_instance()
+metrics = MetricsFactory.get_instance()
+process_executor = ProcessExecutorFactory.get_instance()
+run_registry = RunRegistryFactory.get_instance()
+
+# Inbound channel handlers of the sessions whose task runs on this worker
+inbound_handlers = {}
+
+def _stop_inbound(session_id: str):
+    handler = inbound_handlers.pop(session_id, None)
+    if handler:
+        event_bus.unsubscribe(inbound_channel(session_id), handler)
+
+def _report_queue_position(ticket, position: int, queue_length: int):
+    # Position 0 means the run got its slot and is starting
+    spawn(ws_manager.send_json(ticket.session_id, {
+        "type": "queue_position",
+        "position": position,
+        "queue_length": queue_length,
+    }, save_state=False))
+
+admission.on_position = _report_queue_position
+
+def _observe_start(task, stage: str):
+    """Record how long after the POST a session reached a start stage."""
+    metrics.observe(f"session_start.{stage}", time.perf_counter() - task.created_at)
+
+def _on_first_progress(session_id: str):
+    task = session_manager.get_task(session_id)
+    if task and task.owner is None:
+        _observe_start(task, "first_token")
+
+ws_manager.add_first_progress_listener(_on_first_progress)
+
+async def _wait_for_socket(session_id: str, task) -> bool:
+    """
+    Pause a speculative run until its client connects.
+
+    Returns:
+        bool: Whether a client connected within ``CONNECT_TIMEOUT`` of the request
+    """
+    if task.websocket_ready.is_set():
+        return True
+    remaining = CONNECT_TIMEOUT - (time.perf_counter() - task.created_at)
+    if remaining <= 0:
+        return False
+    print(f"Session {session_id} waiting for its client to connect")
+    try:
+        async with timer_wheel.timeout(remaining):
+            await task.websocket_ready.wait()
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+def _abandon_speculative_run(session_id: str):
+    """Cancel a speculative run whose client never connected."""
+    task = session_manager.get_task(session_id)
+    if not task or task.websocket_ready.is_set():
+        return
+    print(f"No WebSocket connection for speculative session {session_id}, cancelling")
+    metrics.increment("session_start.speculative_abandoned")
+    task.cancel_event.set()
+    run_registry.cancel(session_id)
+    if not task.task_started.is_set():
+        # Still queued; the run will not clean up after itself
+        session_manager.cleanup_session(session_id)
+        ws_manager.clear_session_state(session_id)
+
+def _expire_disconnected(session_id: str):
+    """Cancel and clean up a session whose clients did not come back within the grace period."""
+    task = session_manager.get_task(session_id)
+    if not task:
+        return
+    task.disconnect_timer = None
+    if task.connection_count > 0:
+        return
+    print(f"No client reconnected to session {session_id}, cleaning up")
+    metrics.increment("sessions.disconnect_expired")
+    # Only set cancel event if not already cancelled
+    if not task.cancel_event.is_set():
+        task.cancel_event.set()
+        print(f"Setting cancel event for session {session_id}")
+    run_registry.cancel(session_id)
+
+    # Clean up state and session
+    ws_manager.clear_session_state(session_id)
+    session_manager.cleanup_session(session_id)
+
+def _cancel_expired_run(session_id: str, local_only: bool = False):
+    """Interrupt an idle session's run, as a cancel message would, before the session is cleaned up."""
+    run_registry.cancel(session_id)
+
+# Expired sessions stop their run and take their replay state with them
+session_manager.add_expiry_listener(_cancel_expired_run)
+session_manager.add_expiry_listener(ws_manager.clear_session_state)
+session_manager.add_cleanup_listener(_stop_inbound)
+
+async def handle_client_message(session_id: str, data: dict, task=None):
+    """
+    Apply a client message to a session whose task runs on this worker.
+
+    Besides the client's own messages (confirm, cancel, user_input, ...) this
+    handles ``connection_opened`` and ``connection_closed``, which the worker
+    holding the socket sends, so the connection count covers every worker.
+
+    Args:
+        session_id: The session the message is for
+        data: The client message
+        task: The session, if the caller holds it; it may already be cleaned up
+    """
+    task = task or session_manager.get_task(session_id)
+    msg_type = data.get("type")
+    if not task:
+        if msg_type == "connection_closed" and not ws_manager.is_connected(session_id):
+            # The task finished meanwhile; its replay state is no longer needed
+            ws_manager.clear_session_state(session_id)
+        return
+    # A run in a worker process keeps its own copy of the session
+    process_executor.forward(session_id, data)
+    if msg_type == "connection_opened":
+        task.connection_count += 1
+        if task.disconnect_timer:
+            # Reconnected within the grace period
+            task.disconnect_timer.cancel()
+            task.disconnect_timer = None
+        if not task.websocket_ready.is_set():
+            _observe_start(task, "connect")
+        task.websocket_ready.set()
+        print(f"WebSocket connected for session {session_id}, signaling ready")
+    elif msg_type == "connection_closed":
+        task.connection_count -= 1
+        # Only cancel task and cleanup if no other connections and task hasn't been cancelled by API
+        if task.connection_count <= 0:
+            # The run keeps going and its messages keep being saved; a client
+            # that comes back in time resumes from its last_seq
+            print(f"No more connections for session {session_id}, cleaning up in {SESSION_DISCONNECT_GRACE:g}s unless it reconnects")
+            if task.disconnect_timer:
+                task.disconnect_timer.cancel()
+            task.disconnect_timer = timer_wheel.call_later(SESSION_DISCONNECT_GRACE, _expire_disconnected, session_id)
+        else:
+            # The remaining subscribers keep receiving the session's messages
+            print(f"Still have {task.connection_count} connections for session {session_id}")
+    elif msg_type == "confirm":
+        # "values" answers a batched request tool by tool; "value" answers all of it
+        task.confirmed = data["values"] if data.get("values") is not None else data.get("value")
+        task.confirm_event.set()
+    elif msg_type == "cancel":
+        print(f"Received cancel message for session {session_id}")
+        task.cancel_event.set()
+        run_registry.cancel(session_id)
+        # Save to state for replay
+        await ws_manager.send_json(session_id, {"type": "task_cancelled", "content": "Task cancelled by user."}, save_state=True)
+    elif msg_type == "user_input":
+        if task.input_request:
+            task.input_request.values = data.get("values")
+            task.input_request.event.set()
+    elif msg_type == "connection_acknowledged":
+        # Client has replayed the session state; the run can start
+        print(f"Client acknowledged connection for session {session_id}")
+        if not task.client_acknowledged.is_set():
+            _observe_start(task, "ack")
+        task.client_acknowledged.set()
+
+async def route_client_message(session_id: str, data: dict, task=None):
+    """Hand a client message to whichever worker runs the session's task."""
+    task = task or session_manager.get_task(session_id)
+    if not task:
+        return
+    if task.owner is None:
+        await handle_client_message(session_id, data, task)
+    else:
+        event_bus.publish(inbound_channel(session_id), encode_message(data))
+
+def _on_inbound_message(session_id: str, payload: bytes):
+    return handle_client_message(session_id, decode_message(payload))
 
 async def wait_for_connection_and_start_task(task_info: dict):
-    """Wait for WebSocket connection to be established before starting the actual task."""
+    """
+    Wait for WebSocket connection to be established before starting the actual task.
+
+    A speculative run starts without waiting: its output goes to the replay
+    store, and the client gets it as replay once it connects. It is cancelled
+    if no client connects within ``CONNECT_TIMEOUT``.
+    """
     session_id = task_info.get("session_id")
     callback_fn = task_info.get("callback_fn")
     callback_args = task_info.get("callback_args")
+    ticket = task_info.get("ticket")
+    speculative = task_info.get("speculative")
+    if speculative is None:
+        speculative = SPECULATIVE_START
 
     task = session_manager.get_task(session_id)
     if not task:
         print(f"No task found for session {session_id}")
+        if ticket:
+            ticket.release()
         return
     
-    print(f"Waiting for WebSocket connection for session {session_id}")
-    
-    # Wait for WebSocket connection (with timeout)
     try:
-        await asyncio.wait_for(task.websocket_ready.wait(), timeout=30.0)
-        print(f"WebSocket ready for session {session_id}, starting task")
+        if speculative:
+            print(f"Starting session {session_id} before its WebSocket connects")
+            timer_wheel.call_later(CONNECT_TIMEOUT, _abandon_speculative_run, session_id)
+        else:
+            print(f"Waiting for WebSocket connection for session {session_id}")
+            # Wait for WebSocket connection (with timeout)
+            async with timer_wheel.timeout(CONNECT_TIMEOUT):
+                await task.websocket_ready.wait()
+            print(f"WebSocket ready for session {session_id}, starting task")
         
         # Check if task was cancelled while waiting
         if task.cancel_event.is_set():
             print(f"Task {session_id} was cancelled while waiting for WebSocket")
             return
+
+        # Wait for a run slot of this handler type; only now that the run could
+        # start, so no slot is held while the client connects
+        if ticket:
+            ticket.queue.attach(ticket)
+        if ticket and not ticket.admitted:
+            print(f"Session {session_id} queued for a run slot")
+            ticket.queue.announce(ticket)
+            if not await ticket.wait(task.cancel_event):
+                print(f"Task {session_id} was cancelled while queued")
+                return
         
-        # Additional small delay to ensure client is fully ready
-        await asyncio.sleep(0.5)
-        
+        # Start as soon as the client acknowledges; older clients never do, so
+        # only wait a grace period for it
+        if not speculative and not task.client_acknowledged.is_set():
+            try:
+                async with timer_wheel.timeout(ACK_GRACE_TIMEOUT):
+                    await task.client_acknowledged.wait()
+            except asyncio.TimeoutError:
+                print(f"No acknowledgement from client for session {session_id}, starting anyway")
+                metrics.increment("session_start.ack_timeouts")
+
+        if task.cancel_event.is_set():
+            print(f"Task {session_id} was cancelled while waiting for acknowledgement")
+            return
+
         # Mark task as started
+        _observe_start(task, "run")
         task.task_started.set()
         
-        # return the callback to be executed
-        await callback_fn(*callback_args)
+        # Run the callback as its own task, so a cancel can interrupt it
+        run = run_registry.start(session_id, callback_fn(*callback_args))
+        try:
+            await run.task
+        except asyncio.CancelledError:
+            if not run.cancelled:
+                raise
+            print(f"Run for session {session_id} was interrupted by cancel")
+        finally:
+            # The run slot is free as soon as the run is over
+            if ticket:
+                ticket.release()
+
+        if not task.websocket_ready.is_set():
+            # A speculative run ended before its client connected; keep the
+            # session and its output until the client has replayed them,
+            # unless it was cancelled
+            connected = not task.cancel_event.is_set() and await _wait_for_socket(session_id, task)
+            session_manager.cleanup_session(session_id)
+            if not connected:
+                ws_manager.clear_session_state(session_id)
 
     except asyncio.TimeoutError:
         print(f"Timeout waiting for WebSocket connection for session {session_id}")
@@ -55,6 +314,10 @@ async def wait_for_connection_and_start_task(task_info: dict):
         print(f"Error waiting for connection or starting task for session {session_id}: {e}")
         # Clean up session
         session_manager.cleanup_session(session_id)
+    finally:
+        # Free the queue place or run slot for the next request
+        if ticket:
+            ticket.release()
 
 async def request_user_input(session_id: str, fields):
     task = session_manager.get_task(session_id)
@@ -62,8 +325,13 @@ async def request_user_input(session_id: str, fields):
         print(f"No task found for session {session_id}")
         return False
         
-    # Check if WebSocket is connected
-    if not ws_manager.is_connected(session_id):
+    # A speculative run asks once its client is there
+    if not await _wait_for_socket(session_id, task):
+        print(f"No WebSocket connection for session {session_id}, cannot request user input")
+        return False
+
+    # Check if WebSocket is connected (on any worker)
+    if task.connection_count <= 0:
         print(f"No WebSocket connection for session {session_id}, cannot request user input")
         return False
         
@@ -79,7 +347,8 @@ async def request_user_input(session_id: str, fields):
     
     try:
         # Wait for user input with timeout
-        await asyncio.wait_for(task.input_request.event.wait(), timeout=60.0)
+        async with timer_wheel.timeout(INPUT_TIMEOUT):
+            await task.input_request.event.wait()
         print(f"User input received for session {session_id}: {task.input_request.values}")
         return True
     except asyncio.TimeoutError:
@@ -100,8 +369,13 @@ async def request_confirmation(session_id: str, message: str = "Do you want to p
     task.confirm_event.clear()
     task.confirmed = None
     
-    # Check if WebSocket is connected before sending
-    if not ws_manager.is_connected(session_id):
+    # A speculative run asks once its client is there
+    if not await _wait_for_socket(session_id, task):
+        print(f"No WebSocket connection for session {session_id}, cannot request confirmation")
+        return False
+
+    # Check if WebSocket is connected (on any worker) before sending
+    if task.connection_count <= 0:
         print(f"No WebSocket connection for session {session_id}, cannot request confirmation")
         return False
     
@@ -112,7 +386,8 @@ async def request_confirmation(session_id: str, message: str = "Do you want to p
     
     try:
         # Wait for confirmation with timeout
-        await asyncio.wait_for(task.confirm_event.wait(), timeout=30.0)
+        async with timer_wheel.timeout(CONFIRM_TIMEOUT):
+            await task.confirm_event.wait()
         return task.confirmed is True
     except asyncio.TimeoutError:
         print(f"Confirmation timeout for session {session_id}")
@@ -122,20 +397,99 @@ async def request_confirmation(session_id: str, message: str = "Do you want to p
         }, save_state=True)
         return False
 
+async def request_confirmations(session_id: str, tools: list, message: str = None) -> list:
+    """
+    Ask the user to confirm several tool calls in one round trip.
+
+    The client gets a single ``request_confirmations`` message listing every
+    tool and answers with one ``confirm`` message whose ``values`` maps each
+    tool's id to a decision; a plain ``value`` decides for all of them.
+
+    Args:
+        session_id: The session to ask
+        tools: One dict per tool call: {name, args, message}
+        message: Shown above the list of tools
+
+    Returns:
+        list: Whether each tool was confirmed, in the order given; all False if
+        the user could not be asked or did not answer in time
+    """
+    rejected = [False] * len(tools)
+    task = session_manager.get_task(session_id)
+    if not task:
+        print(f"No task found for session {session_id}")
+        return rejected
+    if not tools:
+        return []
+
+    # Reset confirmation state
+    task.confirm_event.clear()
+    task.confirmed = None
+
+    # A speculative run asks once its client is there
+    if not await _wait_for_socket(session_id, task) or task.connection_count <= 0:
+        print(f"No WebSocket connection for session {session_id}, cannot request confirmation")
+        return rejected
+
+    requests = [{"id": str(index), **tool} for index, tool in enumerate(tools)]
+    metrics.increment("confirmations.requests")
+    metrics.increment("confirmations.tools", len(requests))
+    await ws_manager.send_json(session_id, {
+        "type": "request_confirmations",
+        "message": message or f"Agent wants to use {len(requests)} tool(s). Do you want to proceed?",
+        "tools": requests,
+    }, save_state=True)
+
+    try:
+        async with timer_wheel.timeout(CONFIRM_TIMEOUT):
+            await task.confirm_event.wait()
+    except asyncio.TimeoutError:
+        print(f"Confirmation timeout for session {session_id}")
+        await ws_manager.send_json(session_id, {
+            "type": "stream", 
+            "content": "Confirmation timeout - task cancelled."
+        }, save_state=True)
+        return rejected
+
+    reply = task.confirmed
+    if isinstance(reply, dict):
+        return [reply.get(request["id"]) is True for request in requests]
+    if isinstance(reply, list):
+        return [index < len(reply) and reply[index] is True for index in range(len(requests))]
+    return [reply is True] * len(requests)
+
 async def wait_for_retry(session_id: str):
     task = session_manager.get_task(session_id)
     task.confirm_event.clear()
     task.confirmed = None
     await ws_manager.send_json(session_id, {"type": "request_retry", "message": "Do you want to retry the task?"}, save_state=True)
-    await task.confirm_event.wait()
-    return bool(task.confirmed)
+    try:
+        async with timer_wheel.timeout(RETRY_TIMEOUT):
+            await task.confirm_event.wait()
+        return bool(task.confirmed)
+    except asyncio.TimeoutError:
+        print(f"Retry timeout for session {session_id}")
+        await ws_manager.send_json(session_id, {
+            "type": "stream", 
+            "content": "Retry timeout - task cancelled."
+        }, save_state=True)
+        return False
 
-def start_background_task(background_tasks: BackgroundTasks, task_info: dict):
+async def start_background_task(background_tasks: BackgroundTasks, task_info: dict):
     """Start the background task to wait for WebSocket connection and then execute the task."""
+    session_id = task_info.get("session_id")
+    if event_bus.shared:
+        # The socket may land on another worker; listen for its messages before
+        # the client can connect
+        handler = inbound_handlers[session_id] = functools.partial(_on_inbound_message, session_id)
+        await event_bus.subscribe(inbound_channel(session_id), handler)
+
     # Don't start the background task immediately
     # Instead, wait for WebSocket connection to be established
     background_tasks.add_task(wait_for_connection_and_start_task, {
         "session_id": task_info.get("session_id"),
         "callback_fn": task_info.get("callback_fn"),
         "callback_args": task_info.get("callback_args"),
+        "ticket": task_info.get("ticket"),
+        "speculative": task_info.get("speculative"),
     })
@@ -0,0 +1,18 @@
+"""
+Shared pytest setup: the tests import the backend's packages the way the app
+does, from inside ``backend/``. Run them with ``python -m pytest`` from here.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+# Scripts that drive a running server on localhost:8000, and the backend's
+# manual checks against external services; run them by hand
+collect_ignore = [
+    "backend",
+    "test_agent_response.py",
+    "test_cancel_functionality.py",
+    "test_race_conditions.py",
+    "test_websocket_cancel.py",
+]
@@ -0,0 +1,154 @@
+"""
+A small in-memory stand-in for the ``redis.asyncio`` client, for the tests.
+
+It covers only the commands the state backend and the event bus use, with
+Redis's reply types (bytes keys and values, float scores). Clients created
+from the same ``FakeRedisServer`` share their data and their pub/sub
+channels, like workers connected to one Redis.
+"""
+import asyncio
+
+
+def _bytes(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class FakeRedisServer:
+    def __init__(self):
+        self.data = {}  # key -> dict (hash) or dict member -> score (sorted set)
+        self.ttls = {}  # key -> seconds, as last set by EXPIRE
+        self.subscribers = {}  # channel -> set of FakePubSub
+
+    def client(self):
+        return FakeRedis(self)
+
+
+class FakeRedis:
+    def __init__(self, server: FakeRedisServer = None):
+        self.server = server or FakeRedisServer()
+        self.commands = []  # Names of the commands run, in order
+
+    def pipeline(self, transaction: bool = True):
+        return FakePipeline(self)
+
+    def pubsub(self):
+        return FakePubSub(self.server)
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        self.commands.append("hset")
+        fields = self.server.data.setdefault(key, {})
+        if field is not None:
+            fields[_bytes(field)] = _bytes(value)
+        for name, item in (mapping or {}).items():
+            fields[_bytes(name)] = _bytes(item)
+
+    async def hgetall(self, key) -> dict:
+        self.commands.append("hgetall")
+        return dict(self.server.data.get(key, {}))
+
+    async def expire(self, key, seconds: int):
+        self.commands.append("expire")
+        if key in self.server.data:
+            self.server.ttls[key] = seconds
+
+    async def delete(self, *keys):
+        self.commands.append("delete")
+        for key in keys:
+            self.server.data.pop(key, None)
+            self.server.ttls.pop(key, None)
+
+    async def zadd(self, key, mapping: dict):
+        self.commands.append("zadd")
+        members = self.server.data.setdefault(key, {})
+        for member, score in mapping.items():
+            members[_bytes(member)] = float(score)
+
+    def _zsorted(self, key) -> list:
+        members = self.server.data.get(key, {})
+        return sorted(members.items(), key=lambda item: (item[1], item[0]))
+
+    async def zremrangebyrank(self, key, start: int, stop: int):
+        self.commands.append("zremrangebyrank")
+        items = self._zsorted(key)
+        count = len(items)
+        start = start + count if start < 0 else start
+        stop = stop + count if stop < 0 else stop
+        if stop < 0:
+            return
+        for member, _ in items[max(start, 0):stop + 1]:
+            del self.server.data[key][member]
+
+    async def zrangebyscore(self, key, low, high, withscores: bool = False) -> list:
+        self.commands.append("zrangebyscore")
+
+        def bound(value):
+            value = str(value)
+            exclusive = value.startswith("(")
+            return float(value.lstrip("(")), exclusive
+
+        low, low_exclusive = bound(low)
+        high, high_exclusive = bound(high)
+        items = [
+            (member, score) for member, score in self._zsorted(key)
+            if (score > low if low_exclusive else score >= low) and (score < high if high_exclusive else score <= high)
+        ]
+        return items if withscores else [member for member, _ in items]
+
+    async def publish(self, channel, payload) -> int:
+        self.commands.append("publish")
+        subscribers = self.server.subscribers.get(_bytes(channel), set())
+        for pubsub in subscribers:
+            pubsub.messages.put_nowait({"type": "message", "channel": _bytes(channel), "data": _bytes(payload)})
+        return len(subscribers)
+
+
+class FakePipeline:
+    """Queues commands and runs them in order on ``execute``."""
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self) -> list:
+        calls, self.calls = self.calls, []
+        return [await method(*args, **kwargs) for method, args, kwargs in calls]
+
+
+class FakePubSub:
+    def __init__(self, server: FakeRedisServer):
+        self.server = server
+        self.channels = set()
+        self.messages = asyncio.Queue()
+
+    async def subscribe(self, *channels):
+        for channel in channels:
+            self.channels.add(_bytes(channel))
+            self.server.subscribers.setdefault(_bytes(channel), set()).add(self)
+            self.messages.put_nowait({"type": "subscribe", "channel": _bytes(channel), "data": len(self.channels)})
+
+    async def unsubscribe(self, *channels):
+        for channel in channels:
+            self.channels.discard(_bytes(channel))
+            self.server.subscribers.get(_bytes(channel), set()).discard(self)
+            self.messages.put_nowait({"type": "unsubscribe", "channel": _bytes(channel), "data": len(self.channels)})
+
+    async def get_message(self, ignore_subscribe_messages: bool = False, timeout: float = 0.0):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                message = await asyncio.wait_for(self.messages.get(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                return None
+            if ignore_subscribe_messages and message["type"] != "message":
+                continue
+            return message
@@ -0,0 +1,48 @@
+"""
+A stand-in for a client's WebSocket, for the tests, and a helper to wait for
+what it receives.
+
+The server's managers only call ``accept``, ``send_text`` and ``close``;
+everything sent is kept decoded so tests can check it.
+"""
+import asyncio
+import json
+
+
+class FakeWebSocket:
+    """Records what the server sends."""
+    def __init__(self):
+        self.sent = []  # Decoded frames, in send order
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+    async def close(self):
+        self.closed = True
+
+    def messages(self) -> list:
+        """Every message received, with replay pages and batches unpacked."""
+        messages = []
+        for frame in self.sent:
+            messages.extend(frame.get("state_messages") or frame.get("messages") or [frame])
+        return messages
+
+    def seqs(self) -> list:
+        """Seqs of the saved messages received, live or replayed."""
+        return [message["seq"] for message in self.messages() if "seq" in message]
+
+    def of_type(self, msg_type: str) -> list:
+        return [message for message in self.messages() if message["type"] == msg_type]
+
+
+async def until(condition, timeout: float = 2.0):
+    """Wait for ``condition()`` to hold, failing the test after ``timeout`` seconds."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
@@ -12,17 +12,75 @@ export const TaskConfirmationRequest = ({
   handleConfirm,
 }: {
   chatRoomId: string;
-  handleConfirm: (value: boolean) => void;
+  handleConfirm: (value: boolean, decisions?: { [id: string]: boolean }) => void;
 }) => {
   const chatRooms = useChatStore((state) => state.chatRooms);
   const confirmationRequests = chatRooms?.find(
     (room) => room.id === chatRoomId
   )?.confirmationRequests;
 
+  // tools the user unticked in a batched request
+  const [rejected, setRejected] = React.useState<{ [id: string]: boolean }>(
+    {}
+  );
+
   if (!confirmationRequests || confirmationRequests.length === 0) {
     return "No confirmation requests";
   }
 
+  if (confirmationRequests[0].batched) {
+    const confirmSelected = () => {
+      handleConfirm(
+        true,
+        confirmationRequests.reduce((acc: { [id: string]: boolean }, request) => {
+          acc[request.id] = !rejected[request.id];
+          return acc;
+        }, {})
+      );
+      setRejected({});
+    };
+
+    return (
+      <div className="mx-auto w-full max-w-2xl mb-4 p-3 bg-white border border-gray-200 rounded-md">
+        {confirmationRequests.map((request) => (
+          <label
+            key={request.id}
+            className="flex items-start gap-2 text-sm text-secondary mb-2"
+          >
+            <input
+              type="checkbox"
+              className="mt-1"
+              checked={!rejected[request.id]}
+              onChange={(e) =>
+                setRejected({ ...rejected, [request.id]: !e.target.checked })
+              }
+            />
+            {request.message}
+          </label>
+        ))}
+        <div className="flex gap-2 mt-3">
+          <Button
+            onClick={confirmSelected}
+            size="sm"
+            className="bg-green-600 hover:bg-green-700 text-white"
+          >
+            Allow Selected
+          </Button>
+          <Button
+            onClick={() => {
+              handleConfirm(false);
+              setRejected({});
+            }}
+            size="sm"
+            variant="outline"
+          >
+            No, Cancel
+          </Button>
+        </div>
+      </div>
+    );
+  }
+
   return (
     <div className="mx-auto w-full max-w-2xl mb-4 p-3 bg-white border border-gray-200 rounded-md">
       <p className="text-sm text-secondary mb-3">
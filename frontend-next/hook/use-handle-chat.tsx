@@ -2,19 +2,28 @@ import { ReasoningSteps, ToolCall, useChatStore } from "@/store/chat-store";
 import { useEffect, useRef, useState } from "react";
 
 export type MessageTypes =
-  | "initial_state"
+  | "state_page"
+  | "state_end"
   | "connection_ready"
   | "connection_acknowledged"
+  | "queue_position"
   | "task_started"
   | "task_progress"
+  | "task_progress_header"
+  | "task_progress_batch"
   | "task_completed"
   | "task_failed"
   | "task_cancelled"
   | "request_user_input"
-  | "request_confirmation";
+  | "request_confirmation"
+  | "request_confirmations"
+  | "ping";
 
 export type ResponseMode = "agent" | "team" | "workflow" | "agent_with_mcp";
 
+// attempts to reopen a session's socket after it drops
+const RECONNECT_ATTEMPTS = 5;
+
 export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
   const abortController = useRef<AbortController | null>(null);
   const chatRoomExists = useChatStore((state) =>
@@ -55,6 +64,27 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
   const streamingMessageContent = useRef<string>("");
   const toolCallRef = useRef<ToolCall[]>([]);
   const reasoningStepsRef = useRef<ReasoningSteps[]>([]);
+  // highest message seq received, sent as last_seq when reconnecting
+  const lastSeqRef = useRef<number>(0);
+  // reopens the current session's socket, resuming after lastSeqRef
+  const reconnectRef = useRef<((retries: number) => void) | null>(null);
+  // set when we close the socket ourselves, so it is not reopened
+  const closingRef = useRef<boolean>(false);
+  // fields shared by the current run's events, from task_progress_header
+  const progressHeaderRef = useRef<Record<string, any>>({});
+
+  // Merge a task_progress delta into the run header (null removes a field)
+  const applyProgressDelta = (delta: Record<string, any>) => {
+    const merged: Record<string, any> = { ...progressHeaderRef.current };
+    Object.entries(delta || {}).forEach(([key, value]) => {
+      if (value === null) {
+        delete merged[key];
+      } else {
+        merged[key] = value;
+      }
+    });
+    return merged;
+  };
 
   // Helper function to parse reasoning data from backend
   const parseExtraData = (rawData: any) => {
@@ -107,23 +137,59 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
 
   // parse messages from the WebSocket
   const parseMessage = (message: string) => {
-    const msg = JSON.parse(message);
+    handleMessage(JSON.parse(message));
+  };
+
+  const handleMessage = (msg: any) => {
+    if (typeof msg.seq === "number" && msg.seq > lastSeqRef.current) {
+      lastSeqRef.current = msg.seq;
+    }
 
     switch (msg.type) {
-      case "initial_state":
-        // Handle initial state
+      case "state_page": {
+        // Replay what we missed; a full snapshot may overlap what we already have
+        const seen = lastSeqRef.current;
+        msg.state_messages?.forEach((stateMessage: any) => {
+          if (typeof stateMessage.seq !== "number" || stateMessage.seq > seen) {
+            handleMessage(stateMessage);
+          }
+        });
+        break;
+      }
+      case "state_end":
+        // Replay done; connection_ready and live messages follow
         break;
       case "connection_ready":
-        // Handle connection ready
+        // Replay is done; tell the server the run can start
+        socket?.send(JSON.stringify({ type: "connection_acknowledged" }));
         break;
       case "connection_acknowledged":
         // Handle connection acknowledged
         break;
+      case "queue_position":
+        // Waiting for a run slot; position 0 means the run is starting
+        if (msg.position > 0) {
+          updateStreamingMessage?.(chatRoomId, {
+            id: sessionId!,
+            created_at: Date.now(),
+            role: "agent",
+            content: `Waiting in queue (position ${msg.position} of ${msg.queue_length})...`,
+          });
+        } else {
+          updateStreamingMessage?.(chatRoomId, null);
+        }
+        break;
       case "task_started":
         // Handle task started
         setStatus?.(chatRoomId, "loading");
         break;
+      case "task_progress_header":
+        // Start of a run: fields shared by the deltas that follow
+        progressHeaderRef.current = { ...msg.data };
+        break;
       case "task_progress":
+        // Rebuild the full event from the delta
+        msg.data = applyProgressDelta(msg.data);
         // Handle task progress - this includes agent responses
         if (msg.data?.content && msg.data?.event === "RunCompleted") {
           const processedExtraData = parseExtraData(msg.data.extra_data);
@@ -194,16 +260,22 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
           reasoningStepsRef.current.push(msg.data.content);
         }
         break;
+      case "task_progress_batch":
+        // Coalesced task_progress messages, in order
+        msg.messages?.forEach((batched: any) => handleMessage(batched));
+        break;
       case "task_completed":
         // Handle task completed
         setStatus?.(chatRoomId, "idle");
         updateStreamingMessage?.(chatRoomId, null);
 
+        closingRef.current = true;
         socket?.close();
         break;
       case "task_failed":
         // Handle task failed
         setStatus?.(chatRoomId, "error");
+        closingRef.current = true;
         socket?.close();
         break;
       case "task_cancelled":
@@ -220,6 +292,7 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
           },
           chatRoomId
         );
+        closingRef.current = true;
         socket?.close();
         break;
       case "request_user_input":
@@ -236,6 +309,21 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
           message: msg.message,
         });
         break;
+      case "request_confirmations":
+        // Several tools to confirm at once; answered with one reply
+        clearConfirmationRequests?.(chatRoomId);
+        for (const tool of msg.tools || []) {
+          setConfirmationRequest?.(chatRoomId, {
+            id: tool.id,
+            message: tool.message,
+            batched: true,
+          });
+        }
+        break;
+      case "ping":
+        // Server heartbeat; answer so the connection is not reaped
+        socket?.send(JSON.stringify({ type: "pong", ts: msg.ts }));
+        break;
       default:
         console.warn(`Unknown message type: ${msg.type}`);
         break;
@@ -251,6 +339,10 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
       socket.onclose = () => {
         console.log("WebSocket closed");
         setSocket(null);
+        // Dropped mid-task: reconnect and resume from the last seq we have
+        if (!closingRef.current) {
+          reconnectRef.current?.(RECONNECT_ATTEMPTS);
+        }
       };
 
       socket.onopen = () => {
@@ -290,6 +382,7 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
     }
 
     // Clean up existing WebSocket connection if any
+    closingRef.current = true;
     if (socket) {
       console.log("Closing existing WebSocket before starting new task");
       if (
@@ -339,6 +432,14 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
         }
       );
 
+      if (res.status === 429) {
+        // Server is at capacity; it says when to try again
+        const retryAfter = res.headers.get("Retry-After");
+        console.warn(`Server busy, retry after ${retryAfter}s`);
+        setStatus?.(chatRoomId, "error");
+        return;
+      }
+
       if (!res.ok) {
         // setTaskStatus("error");
         setStatus?.(chatRoomId, "error");
@@ -347,6 +448,9 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
 
       const data = await res.json();
       setSessionId(data.session_id);
+      lastSeqRef.current = 0;
+      progressHeaderRef.current = {};
+      closingRef.current = false;
 
       setStatus?.(chatRoomId, "loading");
       inputRef?.current?.focus();
@@ -356,8 +460,10 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
 
       // build socket connection with retry
       const connectSocket = (retries: number) => {
+        const resume =
+          lastSeqRef.current > 0 ? `?last_seq=${lastSeqRef.current}` : "";
         const socket = new WebSocket(
-          `ws://localhost:8000/api/ws/session/${data.session_id}`
+          `ws://localhost:8000/api/ws/session/${data.session_id}${resume}`
         );
 
         socket.onopen = () => {
@@ -368,7 +474,7 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
         socket.onclose = (event) => {
           console.log("WebSocket closed:", event);
           setSocket(null);
-          if (retries > 0) {
+          if (retries > 0 && !closingRef.current) {
             console.log(
               `Retrying WebSocket connection... (${retries} attempts left)`
             );
@@ -381,7 +487,8 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
         };
       };
 
-      connectSocket(5);
+      reconnectRef.current = connectSocket;
+      connectSocket(RECONNECT_ATTEMPTS);
     } catch (error: unknown) {
       if (error instanceof Error && error.name !== "AbortError") {
         console.error("Error starting task:", error);
@@ -417,14 +524,20 @@ export const useHandleChat = (chatRoomId: string, mode: ResponseMode) => {
     updateStreamingMessage?.(chatRoomId, null);
 
     // Close WebSocket connection
+    closingRef.current = true;
     if (socket) {
       socket.close();
       setSocket(null);
     }
   };
 
-  const handleConfirm = (value: boolean) => {
-    if (socket) socket.send(JSON.stringify({ type: "confirm", value }));
+  // decisions answers a batched request per tool id; value alone answers all of it
+  const handleConfirm = (
+    value: boolean,
+    decisions?: { [id: string]: boolean }
+  ) => {
+    if (socket)
+      socket.send(JSON.stringify({ type: "confirm", value, values: decisions }));
     // Clear confirmation requests after handling
     clearConfirmationRequests?.(chatRoomId);
     // setShowConfirm(false);
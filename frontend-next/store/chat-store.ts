@@ -118,6 +118,8 @@ export interface ChatMessage {
 export type ConfirmationRequest = {
   id: string;
   message: string;
+  // set when the request is one tool of a batched request_confirmations
+  batched?: boolean;
 };
 
 export type UserInputRequest = {
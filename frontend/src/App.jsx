@@ -54,7 +54,7 @@ function App() {
     abortController.current = controller;
     
     try {
-      const res = await fetch("http://localhost:8000/api/chat/completion", {
+      const res = await fetch("http://localhost:8000/api/chat/completion/agent", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -138,11 +138,12 @@ function App() {
   // Listen for task completion and retry/failure
   useEffect(() => {
     if (ws) {
-      ws.onmessage = (event) => {
-        console.log("WebSocket message received:", event.data);
-        const msg = JSON.parse(event.data);
+      // Fields shared by the current run's events, from task_progress_header
+      let progressHeader = {};
+
+      const handleMessage = (msg) => {
         if (msg.type === "request_confirmation") {
-          setShowConfirm(true);``
+          setShowConfirm(true);
           setConfirmationMessage(msg.message || "Do you want to proceed with this action?");
         } else if (msg.type === "request_user_input") {
           setInputFields(msg.fields);
@@ -152,27 +153,33 @@ function App() {
           setSubmitted(msg.values);
           setIsGenerating(false);
           // close WebSocket after task completion
-          console.log("Task completed from state replay, closing WebSocket");
+          console.log("Task completed, closing WebSocket");
           setTimeout(() => {
             if (ws && ws.readyState === WebSocket.OPEN) {
               ws.close();
             }
           }, 100);
-          console.log("Task completed, closing WebSocket");
         } else if (msg.type === "task_started") {
           setTaskStatus("running");
           setIsGenerating(true);
           if (msg.content) {
             setStreamContent((prev) => [...prev, msg.content]);
           }
-        } else if (msg.type === "generating") {
+        } else if (msg.type === "task_progress_header") {
+          progressHeader = msg.data || {};
+        } else if (msg.type === "task_progress") {
+          // Rebuild the full event from the header and the delta (null removes a field)
+          const event = { ...progressHeader, ...msg.data };
+          Object.keys(event).forEach((key) => event[key] === null && delete event[key]);
           setIsGenerating(true);
           // Handle agent response streaming
-          if (msg.data && msg.data.content && msg.data.event === "RunResponseContent") {
-            setAgentResponse((prev) => prev + msg.data.content);
-          }else if (msg.data && msg.data.content && msg.data.event === "RunCompleted") {
-            setAgentResponse((prev) => msg.data.content);
+          if (event.content && event.event === "RunResponseContent") {
+            setAgentResponse((prev) => prev + event.content);
+          } else if (event.content && event.event === "RunCompleted") {
+            setAgentResponse(event.content);
           }
+        } else if (msg.type === "task_progress_batch") {
+          msg.messages?.forEach(handleMessage);
         } else if (msg.type === "task_cancelled") {
           setTaskStatus("cancelled");
           setIsGenerating(false);
@@ -198,96 +205,44 @@ function App() {
             setRetryError(msg.error || msg.message || "Unknown error");
           }
         } else if (msg.type === "stream") {
-          console.log("Received stream message:", msg);
           // Handle both old format (content) and new format (data)
           if (msg.content) {
             setStreamContent((prev) => [...prev, msg.content]);
           } else if (msg.data && msg.data.content) {
             setStreamContent((prev) => [...prev, msg.data.content]);
           }
-        } else if (msg.type === "initial_state") {
-          console.log("Received initial state:", msg.message, `(${msg.state_count} messages)`);
-          setIsStateReplaying(msg.state_count > 0);
-          
-          // Clear current content before applying state
-          setStreamContent([]);
-          setAgentResponse("");
-          setIsGenerating(false);
-          setInputFields(null);
-          setShowConfirm(false);
-          setShowRetry(false);
-          setSubmitted(null);
-          
-          // Apply all state messages at once
-          if (msg.state_messages && msg.state_messages.length > 0) {
-            msg.state_messages.forEach((stateMsg) => {
-              // Process each saved state message
-              if (stateMsg.type === "stream") {
-                // Handle both old format (content) and new format (data)
-                if (stateMsg.content) {
-                  setStreamContent((prev) => [...prev, stateMsg.content]);
-                } else if (stateMsg.data && stateMsg.data.content) {
-                  setStreamContent((prev) => [...prev, stateMsg.data.content]);
-                }
-              } else if (stateMsg.type === "request_user_input") {
-                setInputFields(stateMsg.fields);
-                setInputValues({});
-              } else if (stateMsg.type === "request_confirmation") {
-                setShowConfirm(true);
-              } else if (stateMsg.type === "task_completed") {
-                setTaskStatus("completed");
-                setSubmitted(stateMsg.values);
-                setIsGenerating(false);
-                // close WebSocket after task completion
-                console.log("Task completed, closing WebSocket");
-                console.log("Task completed from state replay, closing WebSocket");
-                setTimeout(() => {
-                  if (ws && ws.readyState === WebSocket.OPEN) {
-                    ws.close();
-                  }
-                }, 100);
-              } else if (stateMsg.type === "task_started") {
-                setTaskStatus("running");
-                setIsGenerating(true);
-                if (stateMsg.content) {
-                  setStreamContent((prev) => [...prev, stateMsg.content]);
-                }
-              } else if (stateMsg.type === "generating") {
-                setIsGenerating(true);
-                if (stateMsg.data && stateMsg.data.content) {
-                  setAgentResponse((prev) => prev + stateMsg.data.content);
-                }
-              } else if (stateMsg.type === "task_cancelled") {
-                setTaskStatus("cancelled");
-                setIsGenerating(false);
-                if (stateMsg.content) {
-                  setStreamContent((prev) => [...prev, stateMsg.content]);
-                }
-              } else if (stateMsg.type === "task_not_confirmed") {
-                setTaskStatus("not_confirmed");
-                setIsGenerating(false);
-                if (stateMsg.content) {
-                  setStreamContent((prev) => [...prev, stateMsg.content]);
-                }
-              } else if (stateMsg.type === "task_failed" || stateMsg.type === "request_retry") {
-                setTaskStatus("failed");
-                if (stateMsg.can_retry !== false) {
-                  setShowRetry(true);
-                  setRetryAttempt(stateMsg.attempt || 1);
-                  setRetryError(stateMsg.error || stateMsg.message || "Unknown error");
-                }
-              }
-            });
+        } else if (msg.type === "state_page") {
+          // Saved messages replayed in pages; the first one replaces what we show
+          if (msg.page === 1) {
+            console.log(`Replaying saved state (${msg.mode})`);
+            setIsStateReplaying(true);
+            setStreamContent([]);
+            setAgentResponse("");
+            setIsGenerating(false);
+            setInputFields(null);
+            setShowConfirm(false);
+            setShowRetry(false);
+            setSubmitted(null);
           }
-          
+          msg.state_messages?.forEach(handleMessage);
+        } else if (msg.type === "state_end") {
+          console.log("Replay done:", msg.message, `(${msg.state_count} messages)`);
           // Clear replay indicator after a brief moment
           setTimeout(() => setIsStateReplaying(false), 1000);
         } else if (msg.type === "connection_ready") {
           console.log("Connection ready received for session:", msg.session_id);
           // Send acknowledgment that client is ready
           ws.send(JSON.stringify({ type: "connection_acknowledged" }));
+        } else if (msg.type === "ping") {
+          // Server heartbeat; answer so the connection is not reaped
+          ws.send(JSON.stringify({ type: "pong", ts: msg.ts }));
         }
       };
+
+      ws.onmessage = (event) => {
+        console.log("WebSocket message received:", event.data);
+        handleMessage(JSON.parse(event.data));
+      };
       ws.onclose = () => {
         console.log("WebSocket closed");
         setTaskStatus("closed");
@@ -0,0 +1,74 @@
+"""
+Test admission control: the queue bound and run slots taken only once a client attaches.
+"""
+import asyncio
+
+from task.admission import AdmissionQueue
+from task.scheduler import FairQueue
+
+
+def admission_queue(max_running: int = 1, max_queued: int = 2, tenant_max_running: int = 4) -> AdmissionQueue:
+    fair_queue = FairQueue(weights={}, limits={}, default_max_running=tenant_max_running, max_queued=8)
+    return AdmissionQueue("test", max_running, max_queued, fair_queue=fair_queue)
+
+
+def test_slot_is_taken_only_once_the_client_attaches():
+    async def run():
+        queue = admission_queue(max_running=1)
+        first = queue.reserve("s1")
+        second = queue.reserve("s2")
+        # Nobody runs until their client is there
+        assert queue.running == 0 and not first.admitted
+
+        queue.attach(second)
+        assert second.admitted and queue.running == 1
+        queue.attach(first)
+        assert not first.admitted
+
+        second.release()
+        assert first.admitted and queue.running == 1
+        assert await first.wait()
+        first.release()
+        assert queue.running == 0 and len(queue.waiting) == 0
+
+    asyncio.run(run())
+
+
+def test_queue_bound_holds_whatever_blocks_the_queue():
+    async def run():
+        # The tenant cap, not the global one, is what blocks these
+        queue = admission_queue(max_running=8, max_queued=2, tenant_max_running=1)
+        running = queue.reserve("s1", tenant="a")
+        queue.attach(running)
+        assert running.admitted
+        waiting = [queue.reserve(f"s{number}", tenant="a") for number in (2, 3)]
+        for ticket in waiting:
+            queue.attach(ticket)
+        assert not any(ticket.admitted for ticket in waiting)
+        assert queue.running < queue.max_running
+        assert queue.reserve("s4", tenant="a") is None
+        assert queue.reserve("s5", tenant="b") is None
+
+        # Tickets still waiting for their client count too
+        queue = admission_queue(max_running=8, max_queued=2)
+        queue.reserve("s1")
+        queue.reserve("s2")
+        assert queue.reserve("s3") is None
+
+    asyncio.run(run())
+
+
+def test_released_ticket_frees_its_place():
+    async def run():
+        queue = admission_queue(max_running=1, max_queued=1)
+        ticket = queue.reserve("s1")
+        assert queue.reserve("s2") is None
+        ticket.release()
+        ticket.release()  # Safe to repeat
+        assert ticket.future.cancelled()
+        queue.attach(ticket)  # Too late; nothing happens
+        assert queue.running == 0
+        assert queue.reserve("s3") is not None
+
+    asyncio.run(run())
+
@@ -0,0 +1,173 @@
+"""
+Test the Redis event bus, and a worker relaying another worker's session,
+against an in-memory stand-in for Redis.
+"""
+import asyncio
+
+import service.websocket_manager as websocket_manager
+from fake_redis import FakeRedisServer
+from fake_websocket import FakeWebSocket, until
+from service.event_bus import RedisEventBus, outbound_channel, pack_envelope
+from service.metrics import MetricsFactory
+from service.serialization import encode_message
+from service.state_backend import RedisStateBackend
+from service.websocket_manager import WebSocketManager
+
+OWNER = "owner-host:1"
+
+
+def saved(seq: int) -> bytes:
+    return encode_message({"type": "stream", "content": f"message {seq}", "seq": seq})
+
+
+def test_messages_fan_out_to_every_subscriber():
+    async def run():
+        server = FakeRedisServer()
+        # Two workers on one Redis
+        first, second = RedisEventBus(client=server.client()), RedisEventBus(client=server.client())
+        received = {"first": [], "second": [], "other": []}
+        await first.subscribe("chan", received["first"].append)
+        await second.subscribe("chan", received["second"].append)
+        await second.subscribe("other", received["other"].append)
+
+        for number in range(5):
+            first.publish("chan", b"m%d" % number)
+        await until(lambda: len(received["first"]) == 5 and len(received["second"]) == 5)
+        assert received["first"] == received["second"] == [b"m%d" % number for number in range(5)]
+        assert received["other"] == []
+
+        # An async handler is awaited before the next message
+        order = []
+
+        async def slow(payload):
+            await asyncio.sleep(0.02)
+            order.append(payload)
+
+        await first.subscribe("slow", slow)
+        second.publish("slow", b"a")
+        second.publish("slow", b"b")
+        await until(lambda: len(order) == 2)
+        assert order == [b"a", b"b"]
+
+        # The last handler of a channel unsubscribes the worker from it
+        second.unsubscribe("chan", received["second"].append)
+        await until(lambda: b"chan" not in second.pubsub.channels)
+        first.publish("chan", b"late")
+        await until(lambda: received["first"][-1] == b"late")
+        await asyncio.sleep(0.05)
+        assert received["second"][-1] == b"m4"
+
+        for bus in (first, second):
+            bus.reader_task.cancel()
+
+    asyncio.run(run())
+
+
+def relay_worker(server: FakeRedisServer) -> tuple:
+    """A worker whose client is connected to a session another worker runs."""
+    state_backend = RedisStateBackend(client=server.client(), prefix="test:")
+    manager = WebSocketManager(coalesce=False, state_backend=state_backend, event_bus=RedisEventBus(client=server.client()))
+    return manager, state_backend
+
+
+def test_relayed_messages_wait_for_the_state_backend_to_fill_a_gap():
+    async def run():
+        server = FakeRedisServer()
+        owner_bus = RedisEventBus(client=server.client())
+        owner_state = RedisStateBackend(client=server.client(), prefix="test:")
+        manager, _ = relay_worker(server)
+        websocket = FakeWebSocket()
+        await manager.connect("s1", websocket)
+        channel = outbound_channel("s1")
+
+        # Seq 3 arrives while the owner's write-behind has not saved 1 and 2 yet
+        owner_bus.publish(channel, pack_envelope(OWNER, 3, saved(3)))
+        await asyncio.sleep(0.2)
+        assert websocket.seqs() == []
+        # Later messages are held back behind the gap too
+        owner_bus.publish(channel, pack_envelope(OWNER, 4, saved(4)))
+        await asyncio.sleep(0.05)
+        assert websocket.seqs() == []
+
+        for seq in (1, 2, 3):
+            await owner_state.append_message("s1", seq, "stream", saved(seq))
+        await until(lambda: websocket.seqs() == [1, 2, 3, 4])
+        assert manager.session_seqs["s1"] == 4
+        assert not manager.remote_gaps and not manager.gap_fillers
+
+        # No gap: delivered straight away
+        owner_bus.publish(channel, pack_envelope(OWNER, 5, saved(5)))
+        await until(lambda: websocket.seqs() == [1, 2, 3, 4, 5])
+        assert not manager.gap_fillers
+
+        manager.disconnect("s1")
+
+    asyncio.run(run())
+
+
+def test_slow_client_does_not_hold_up_other_sessions():
+    async def run():
+        server = FakeRedisServer()
+        owner_bus = RedisEventBus(client=server.client())
+        state_backend = RedisStateBackend(client=server.client(), prefix="test:")
+        manager = WebSocketManager(coalesce=False, queue_size=1, backpressure_policy="block",
+                                   state_backend=state_backend, event_bus=RedisEventBus(client=server.client()))
+
+        class StuckWebSocket(FakeWebSocket):
+            async def send_text(self, text: str):
+                await asyncio.Event().wait()
+
+        stuck, websocket = StuckWebSocket(), FakeWebSocket()
+        await manager.connect("slow", stuck)
+        await manager.connect("fast", websocket)
+
+        # The slow session's queue fills up and its relay waits for space
+        for seq in range(1, 6):
+            owner_bus.publish(outbound_channel("slow"), pack_envelope(OWNER, seq, saved(seq)))
+        owner_bus.publish(outbound_channel("fast"), pack_envelope(OWNER, 1, saved(1)))
+        await until(lambda: websocket.seqs() == [1], timeout=1.0)
+        assert "slow" in manager.remote_relays
+
+        manager.clear_session_state("slow", local_only=True)
+        assert "slow" not in manager.remote_relays and "slow" not in manager.remote_inboxes
+        await until(lambda: "fast" not in manager.remote_relays)
+        manager.disconnect("slow")
+        manager.disconnect("fast")
+
+    asyncio.run(run())
+
+
+def test_messages_that_never_arrive_are_skipped_after_the_timeout():
+    async def run():
+        metrics = MetricsFactory.get_instance()
+        skipped = metrics.counters.get("event_bus.skipped", 0)
+        server = FakeRedisServer()
+        owner_bus = RedisEventBus(client=server.client())
+        manager, _ = relay_worker(server)
+        websocket = FakeWebSocket()
+        await manager.connect("s1", websocket)
+
+        owner_bus.publish(outbound_channel("s1"), pack_envelope(OWNER, 3, saved(3)))
+        await asyncio.sleep(0.1)
+        assert websocket.seqs() == []
+        await until(lambda: websocket.seqs() == [3])
+        assert metrics.counters["event_bus.skipped"] == skipped + 2
+        assert not manager.remote_gaps and not manager.gap_fillers
+
+        # Clearing the session drops whatever is still held back
+        owner_bus.publish(outbound_channel("s1"), pack_envelope(OWNER, 6, saved(6)))
+        await until(lambda: "s1" in manager.gap_fillers)
+        filler = manager.gap_fillers["s1"]
+        manager.clear_session_state("s1", local_only=True)
+        await asyncio.sleep(0.05)
+        assert filler.cancelled() and not manager.remote_gaps
+        assert websocket.seqs() == [3]
+        manager.disconnect("s1")
+
+    timeout = websocket_manager.WS_REMOTE_GAP_TIMEOUT
+    websocket_manager.WS_REMOTE_GAP_TIMEOUT = 0.2
+    try:
+        asyncio.run(run())
+    finally:
+        websocket_manager.WS_REMOTE_GAP_TIMEOUT = timeout
+
@@ -0,0 +1,132 @@
+"""
+Test the event log state backend: reopening, segment rotation, and recovering
+from a damaged index file.
+"""
+import asyncio
+import os
+import tempfile
+
+from service.event_log import EventLogStateBackend
+
+
+def payload(seq: int) -> bytes:
+    return b'{"type":"stream","content":"%s","seq":%d}' % (b"x" * 200, seq)
+
+
+async def fill(log: EventLogStateBackend):
+    """Two sessions' worth of records, spread over several segments."""
+    await log.save_session("s1", {"user_query": "first"})
+    await log.save_session("s2", {"user_query": "second"})
+    for seq in range(1, 11):
+        await log.append_message("s1", seq, "task_progress_header" if seq == 1 else "stream", payload(seq))
+        await log.append_message("s2", seq, "stream", payload(seq))
+    await log.sync()
+
+
+async def snapshot(log: EventLogStateBackend) -> dict:
+    return {
+        session_id: (await log.load_session(session_id), await log.load_messages(session_id))
+        for session_id in sorted(log.sessions)
+    }
+
+
+def reopen(log: EventLogStateBackend) -> EventLogStateBackend:
+    log.file.close()
+    return EventLogStateBackend(directory=log.directory, segment_bytes=log.segment_bytes)
+
+
+def segment_files(directory: str, suffix: str) -> list:
+    return sorted(name for name in os.listdir(directory) if name.endswith(suffix))
+
+
+def test_rotation_seals_segments_with_an_index():
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            log = EventLogStateBackend(directory=directory, segment_bytes=2048)
+            await fill(log)
+            assert len(segment_files(directory, ".log")) > 2
+            # Every sealed segment has an index; the active one does not
+            assert len(segment_files(directory, ".idx")) == len(segment_files(directory, ".log")) - 1
+            assert not segment_files(directory, ".tmp")
+            assert not log.sealing
+
+            before = await snapshot(log)
+            assert [seq for seq, _ in before["s1"][1]] == list(range(1, 11))
+            assert before["s1"][0] == {"user_query": "first"}
+
+            log = reopen(log)
+            assert await snapshot(log) == before
+            log.file.close()
+
+    asyncio.run(run())
+
+
+def test_damaged_index_is_rebuilt_from_its_segment():
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            log = EventLogStateBackend(directory=directory, segment_bytes=2048)
+            await fill(log)
+            before = await snapshot(log)
+            refs = dict(log.segment_refs)
+            indexes = segment_files(directory, ".idx")
+
+            # Cut one index short and flip a byte in another
+            with open(os.path.join(directory, indexes[0]), "r+b") as f:
+                f.truncate(os.path.getsize(f.name) - 3)
+            with open(os.path.join(directory, indexes[1]), "r+b") as f:
+                data = bytearray(f.read())
+                data[len(data) // 2] ^= 0xFF
+                f.seek(0)
+                f.write(data)
+
+            log = reopen(log)
+            # No phantom sessions, no lost messages, and nothing left pinned in a segment
+            assert await snapshot(log) == before
+            assert log.segment_refs == refs
+
+            # The rebuilt indexes are good for the next reopen
+            log = reopen(log)
+            assert await snapshot(log) == before
+            log.file.close()
+
+    asyncio.run(run())
+
+
+def test_index_of_a_changed_segment_is_not_trusted():
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            log = EventLogStateBackend(directory=directory, segment_bytes=2048)
+            await fill(log)
+            before = await snapshot(log)
+            first = os.path.join(directory, segment_files(directory, ".log")[0])
+            log.file.close()
+
+            # A segment longer than its index says, e.g. restored from another copy
+            with open(first, "ab") as f:
+                f.write(b"\0" * 16)
+            log = EventLogStateBackend(directory=directory, segment_bytes=2048)
+            assert await snapshot(log) == before
+            log.file.close()
+
+    asyncio.run(run())
+
+
+def test_deleted_sessions_free_their_segments():
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            log = EventLogStateBackend(directory=directory, segment_bytes=2048)
+            await fill(log)
+            for session_id in ("s1", "s2"):
+                await log.delete_messages(session_id)
+                await log.delete_session(session_id)
+            assert log.sessions == {}
+            # Only the active segment is left
+            assert segment_files(directory, ".log") == [f"segment-{log.segment:06d}.log"]
+            assert segment_files(directory, ".idx") == []
+
+            log = reopen(log)
+            assert log.sessions == {}
+            log.file.close()
+
+    asyncio.run(run())
+
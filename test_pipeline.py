@@ -0,0 +1,238 @@
+"""
+Test the streaming pipeline: filtering, pausing for confirmation and
+resuming, cancelling, and coalescing content deltas.
+"""
+import asyncio
+import time
+
+from fake_websocket import FakeWebSocket
+from service.background import spawn
+from service.metrics import MetricsFactory
+from task.pipeline import Coalescer, PipelineContext, RunnerSource, StreamingPipeline
+from task.task_manager import handle_client_message, session_manager, ws_manager
+
+
+class Event:
+    def __init__(self, content=None, event: str = "RunResponseContent", paused: bool = False):
+        self.content = content
+        self.event = event
+        self.is_paused = paused
+
+    def to_dict(self) -> dict:
+        return {"event": self.event, "content": self.content, "created_at": time.time()}
+
+
+class Tool:
+    def __init__(self, name: str):
+        self.tool_name = name
+        self.tool_args = {"query": name}
+        self.confirmed = None
+
+
+class RunResponse:
+    def __init__(self):
+        self.tools_requiring_confirmation = []
+
+
+class Runner:
+    """Plays back scripted runs: the first from ``run``, the rest from ``continue_run``."""
+    def __init__(self, *runs):
+        self.runs = list(runs)
+        self.run_response = RunResponse()
+        self.continued = []  # continue_run's arguments
+
+    def _play(self):
+        events, tools = self.runs.pop(0)
+        self.run_response.tools_requiring_confirmation = tools
+        return iter(events)
+
+    def run(self, user_query: str, **kwargs):
+        return self._play()
+
+    def continue_run(self, **kwargs):
+        self.continued.append(kwargs)
+        return self._play()
+
+
+class AsyncRunner(Runner):
+    """Like ``Runner``, but only offers the async API, as MCP runs use."""
+    run = continue_run = None
+
+    async def _aplay(self):
+        for event in self._play():
+            yield event
+
+    async def arun(self, user_query: str, **kwargs):
+        return self._aplay()
+
+    async def acontinue_run(self, **kwargs):
+        self.continued.append(kwargs)
+        return self._aplay()
+
+
+class RecordingSink:
+    name = "sink"
+
+    def __init__(self):
+        self.events = []
+
+    async def consume(self, ctx, data: dict):
+        self.events.append(data)
+
+    def contents(self) -> list:
+        return [event["content"] for event in self.events]
+
+
+class ConfirmingWebSocket(FakeWebSocket):
+    """Answers confirmation requests with ``replies``, in order."""
+    def __init__(self, session_id: str, replies: list):
+        super().__init__()
+        self.session_id = session_id
+        self.replies = replies
+
+    async def send_text(self, text: str):
+        await super().send_text(text)
+        if self.sent[-1]["type"] == "request_confirmations":
+            spawn(handle_client_message(self.session_id, {"type": "confirm", "values": self.replies.pop(0)}))
+
+
+async def session(replies: list = ()):
+    session_id, task = session_manager.create_session("pipeline")
+    websocket = ConfirmingWebSocket(session_id, list(replies))
+    await ws_manager.connect(session_id, websocket)
+    await handle_client_message(session_id, {"type": "connection_opened"})
+    return session_id, task, websocket
+
+
+async def close(session_id: str):
+    ws_manager.disconnect(session_id)
+    session_manager.cleanup_session(session_id)
+    ws_manager.clear_session_state(session_id)
+
+
+def test_paused_run_asks_once_for_all_tools_then_resumes():
+    async def run():
+        session_id, task, websocket = await session(replies=[{"0": True, "1": False}])
+        search, email = Tool("search"), Tool("send_email")
+        runner = Runner(
+            ([Event("Hel"), Event(None, "ToolCallStarted"), Event("lo"), Event(paused=True)], [search, email]),
+            ([Event(" wor"), Event("ld")], []),
+        )
+        sink = RecordingSink()
+        finished = await StreamingPipeline(RunnerSource(runner, "hi"), sink=sink).run(session_id, task)
+
+        assert finished
+        # Events without content are filtered out
+        assert sink.contents() == ["Hel", "lo", " wor", "ld"]
+        # One round trip for both tools
+        requests = websocket.of_type("request_confirmations")
+        assert len(requests) == 1
+        assert [tool["name"] for tool in requests[0]["tools"]] == ["search", "send_email"]
+        assert (search.confirmed, email.confirmed) == (True, False)
+        assert runner.continued == [{"stream": True}]
+        await close(session_id)
+
+    asyncio.run(run())
+
+
+def test_continued_run_may_pause_again():
+    async def run():
+        session_id, task, websocket = await session(replies=[{"0": True}, {"0": True}])
+        first, second = Tool("first"), Tool("second")
+        runner = Runner(
+            ([Event("a"), Event(paused=True)], [first]),
+            ([Event("b"), Event(paused=True)], [second]),
+            ([Event("c")], []),
+        )
+        sink = RecordingSink()
+        assert await StreamingPipeline(RunnerSource(runner, "hi"), sink=sink).run(session_id, task)
+        assert sink.contents() == ["a", "b", "c"]
+        assert len(websocket.of_type("request_confirmations")) == 2
+        assert first.confirmed and second.confirmed
+        await close(session_id)
+
+    asyncio.run(run())
+
+
+def test_async_run_resumes_asynchronously():
+    async def run():
+        session_id, task, websocket = await session(replies=[{"0": True}])
+        tool = Tool("mcp_tool")
+        runner = AsyncRunner(
+            ([Event("a"), Event(paused=True)], [tool]),
+            ([Event("b")], []),
+        )
+        sink = RecordingSink()
+        source = RunnerSource(runner, "hi", use_async=True, continue_kwargs={"stream": True, "stream_intermediate_steps": True})
+        assert await StreamingPipeline(source, sink=sink).run(session_id, task)
+        assert sink.contents() == ["a", "b"]
+        assert tool.confirmed
+        assert runner.continued == [{"stream": True, "stream_intermediate_steps": True}]
+        await close(session_id)
+
+    asyncio.run(run())
+
+
+def test_cancelled_run_stops_and_tells_the_client():
+    async def run():
+        session_id, task, websocket = await session()
+
+        class CancellingSink(RecordingSink):
+            async def consume(self, ctx, data: dict):
+                await super().consume(ctx, data)
+                task.cancel_event.set()
+
+        sink = CancellingSink()
+        runner = Runner(([Event("one"), Event("two"), Event("three")], []))
+        finished = await StreamingPipeline(RunnerSource(runner, "hi"), sink=sink).run(session_id, task)
+        assert not finished
+        assert sink.contents() == ["one"]
+        await asyncio.sleep(0.05)
+        assert len(websocket.of_type("task_cancelled")) == 1
+        await close(session_id)
+
+    asyncio.run(run())
+
+
+def test_stage_timings_are_reported():
+    async def run():
+        session_id, task, _ = await session()
+        metrics = MetricsFactory.get_instance()
+        before = {name: stats.count for name, stats in metrics.timings.items()}
+        runner = Runner(([Event("x")], []))
+        await StreamingPipeline(RunnerSource(runner, "hi"), sink=RecordingSink()).run(session_id, task)
+        for stage in ("source", "pause", "cancel", "filter", "serialize", "coalesce", "sink"):
+            name = f"pipeline.{stage}"
+            assert metrics.timings[name].count == before.get(name, 0) + 1, name
+        await close(session_id)
+
+    asyncio.run(run())
+
+
+def test_coalescer_merges_content_deltas_within_its_window():
+    async def run():
+        async def events():
+            for content in ("a", "b", "c"):
+                yield {"event": "RunResponseContent", "content": content, "created_at": 1}
+            # Anything else ends the merge and passes through
+            yield {"event": "ToolCallStarted", "content": "tool", "created_at": 2}
+            yield {"event": "RunResponseContent", "content": "d", "created_at": 3}
+            await asyncio.sleep(0.1)
+            yield {"event": "RunResponseContent", "content": "e", "created_at": 4}
+
+        coalescer = Coalescer(window=0.05, max_chars=100)
+        ctx = PipelineContext("s", None, None)
+        merged = [event["content"] async for event in coalescer.process(ctx, events())]
+        # "d" is sent once the window passes, before "e" arrives
+        assert merged == ["abc", "tool", "d", "e"], merged
+
+        async def long_events():
+            for _ in range(5):
+                yield {"event": "RunResponseContent", "content": "xx", "created_at": 1}
+
+        short = Coalescer(window=1.0, max_chars=4)
+        merged = [event["content"] async for event in short.process(ctx, long_events())]
+        assert merged == ["xxxx", "xxxx", "xx"], merged
+
+    asyncio.run(run())
+
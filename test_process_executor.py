@@ -0,0 +1,128 @@
+"""
+Test running handlers in worker processes: messages relayed back over the
+pipe, cancellation, and workers replaced after their run budget.
+"""
+import asyncio
+import os
+
+from fake_websocket import FakeWebSocket, until
+from service.metrics import MetricsFactory
+from service.websocket_manager import WebSocketManagerFactory
+from task.process_executor import ProcessExecutor
+from task.task_manager import handle_client_message, session_manager, ws_manager
+
+# Bigger than a pipe buffer, so sending it cannot complete in one write
+LARGE_CONTENT = "x" * (1 << 20)
+
+
+async def echo(session_id: str, user_query: str):
+    manager = WebSocketManagerFactory.get_instance()
+    await manager.send_json(session_id, {"type": "task_started", "pid": os.getpid()})
+    await manager.send_progress(session_id, {"event": "RunResponseContent", "content": user_query})
+    await manager.send_json(session_id, {"type": "task_completed"})
+
+
+async def wait_for_cancel(session_id: str, user_query: str):
+    manager = WebSocketManagerFactory.get_instance()
+    await manager.send_json(session_id, {"type": "task_started", "pid": os.getpid()})
+    try:
+        await asyncio.Event().wait()
+    except asyncio.CancelledError:
+        await manager.send_json(session_id, {"type": "task_cancelled"})
+        raise
+
+
+async def fail(session_id: str, user_query: str):
+    raise RuntimeError("handler failed")
+
+
+# Looked up by the worker processes, as "test_process_executor:HANDLERS"
+HANDLERS = {"echo": echo, "wait": wait_for_cancel, "fail": fail}
+
+
+# Worker processes take a while to start and to exit
+WORKER_TIMEOUT = 30.0
+
+
+def executor(**kwargs) -> ProcessExecutor:
+    return ProcessExecutor(enabled=True, handler_map="test_process_executor:HANDLERS", **kwargs)
+
+
+async def session(user_query: str = "hi"):
+    session_id, _ = session_manager.create_session(user_query)
+    websocket = FakeWebSocket()
+    await ws_manager.connect(session_id, websocket)
+    await handle_client_message(session_id, {"type": "connection_opened"})
+    return session_id, websocket
+
+
+async def stop(pool: ProcessExecutor):
+    pool.shutdown()
+    await until(lambda: not pool.workers, timeout=WORKER_TIMEOUT)
+
+
+def test_run_is_relayed_back_in_order():
+    async def run():
+        pool = executor(size=1)
+        session_id, websocket = await session()
+        await pool.run("echo", session_id, LARGE_CONTENT)
+        await until(lambda: websocket.of_type("task_completed"), timeout=WORKER_TIMEOUT)
+
+        types = [message["type"] for message in websocket.messages() if message["type"] != "state_end"]
+        assert types == ["connection_ready", "task_started", "task_progress_header", "task_progress", "task_completed"], types
+        assert websocket.of_type("task_started")[0]["pid"] != os.getpid()
+        assert websocket.of_type("task_progress")[0]["data"]["content"] == LARGE_CONTENT
+        # The web process cleaned up its copy of the session too
+        assert session_manager.get_task(session_id) is None
+
+        # A failing handler is reported, and the worker keeps serving
+        session_id, _ = await session()
+        await pool.run("fail", session_id, "hi")
+        assert len(pool.workers) == 1 and not pool.sessions
+        await stop(pool)
+
+    asyncio.run(run())
+
+
+def test_cancel_reaches_the_worker():
+    async def run():
+        pool = executor(size=1)
+        session_id, websocket = await session()
+        running = asyncio.create_task(pool.run("wait", session_id, "hi"))
+        await until(lambda: websocket.of_type("task_started"), timeout=WORKER_TIMEOUT)
+        worker = pool.sessions[session_id]
+
+        running.cancel()
+        try:
+            await running
+        except asyncio.CancelledError:
+            pass
+        # The handler was interrupted in the worker, and said so before finishing
+        await until(lambda: not worker.runs, timeout=WORKER_TIMEOUT)
+        await until(lambda: websocket.of_type("task_cancelled"), timeout=WORKER_TIMEOUT)
+        assert pool.workers == [worker] and not pool.sessions
+        await stop(pool)
+
+    asyncio.run(run())
+
+
+def test_worker_is_replaced_after_its_run_budget():
+    async def run():
+        metrics = MetricsFactory.get_instance()
+        recycled = metrics.counters.get("process_pool.recycled", 0)
+        pool = executor(size=1, max_runs=2)
+        pids = []
+        for _ in range(3):
+            session_id, websocket = await session()
+            await pool.run("echo", session_id, "hi")
+            await until(lambda: websocket.of_type("task_started"), timeout=WORKER_TIMEOUT)
+            pids.append(websocket.of_type("task_started")[0]["pid"])
+
+        # The first worker retired after two runs and exited
+        assert pids[0] == pids[1] != pids[2]
+        assert metrics.counters["process_pool.recycled"] == recycled + 1
+        assert len(pool.workers) == 1 and pool.workers[0].started == 1
+        await stop(pool)
+
+    asyncio.run(run())
+
@@ -0,0 +1,173 @@
+"""
+Test the replay ring buffer (eviction by count and bytes, pinned headers,
+compacted content) and the process-wide LRU budget across sessions.
+"""
+import json
+
+from service.progress_serializer import ProgressSerializer
+from service.replay_store import ReplayBuffer, ReplayStore
+from service.serialization import encode_message
+
+
+def message(seq: int, msg_type: str = "stream", **fields) -> tuple:
+    data = {"type": msg_type, "seq": seq, **fields}
+    return seq, msg_type, encode_message(data), data
+
+
+def content(seq: int, text: str) -> tuple:
+    return message(seq, "task_progress", data={"event": "RunResponseContent", "content": text})
+
+
+def seqs(payloads: list) -> list:
+    return [json.loads(payload)["seq"] for payload in payloads]
+
+
+def test_evicts_oldest_past_message_limit():
+    buffer = ReplayBuffer(max_messages=3, max_bytes=1 << 20)
+    for seq in range(1, 6):
+        buffer.append(*message(seq))
+    assert seqs(buffer.snapshot()) == [3, 4, 5]
+    assert buffer.oldest_seq == 3
+    assert buffer.can_resume(2) and not buffer.can_resume(1)
+    assert buffer.nbytes == sum(len(payload) for payload in buffer.snapshot())
+
+
+def test_evicts_oldest_past_byte_budget_but_keeps_newest():
+    one = len(message(1, content="x" * 100)[2])
+    buffer = ReplayBuffer(max_messages=100, max_bytes=one * 2)
+    for seq in range(1, 4):
+        buffer.append(*message(seq, content="x" * 100))
+    assert seqs(buffer.snapshot()) == [2, 3]
+
+    # A single message over the whole budget still stays
+    buffer.append(*message(4, content="x" * one * 3))
+    assert seqs(buffer.snapshot()) == [4]
+
+
+def test_evicted_header_stays_pinned_until_superseded():
+    buffer = ReplayBuffer(max_messages=2, max_bytes=1 << 20)
+    buffer.append(*message(1, "task_progress_header", data={"run_id": "a"}))
+    buffer.append(*message(2))
+    buffer.append(*message(3))
+    buffer.append(*message(4))
+    # The header fell out of the window but deltas still need it, so it comes first
+    assert seqs(buffer.snapshot()) == [1, 3, 4]
+    assert buffer.memory_usage()["messages"] == 3
+    payloads, after = buffer.page(0, 4, 1 << 20)
+    assert seqs(payloads) == [1, 3, 4] and after == 4
+
+    # A newer header replaces the pinned one and its bytes are given back
+    buffer.append(*message(5, "task_progress_header", data={"run_id": "b"}))
+    assert seqs(buffer.snapshot()) == [4, 5]
+    assert buffer.nbytes == sum(len(payload) for payload in buffer.snapshot())
+
+
+def test_content_chunks_compact_into_one_entry():
+    buffer = ReplayBuffer(max_messages=2, max_bytes=1 << 20)
+    buffer.append(*message(1, "task_started"))
+    for seq, text in ((2, "Hel"), (3, "lo, "), (4, "world")):
+        buffer.append(*content(seq, text))
+    assert len(buffer) == 2
+    merged = json.loads(buffer.snapshot()[1])
+    assert merged["seq"] == 4 and merged["data"]["content"] == "Hello, world"
+
+    # A client that has the first chunk is sent only the rest
+    payloads, after = buffer.page(2, 4, 1 << 20)
+    assert after == 4
+    assert json.loads(payloads[0])["data"]["content"] == "lo, world"
+    payloads, _ = buffer.page(0, 3, 1 << 20)
+    assert [json.loads(payload)["seq"] for payload in payloads] == [1, 3]
+    assert json.loads(payloads[1])["data"]["content"] == "Hello, "
+
+
+def rebuild(payloads: list) -> list:
+    """Rebuild full run events from replayed messages, as the client does."""
+    header, events = {}, []
+    for payload in payloads:
+        data = json.loads(payload)
+        if data["type"] == "task_progress_header":
+            header = data["data"]
+        elif data["type"] == "task_progress":
+            event = {**header, **data["data"]}
+            events.append({key: value for key, value in event.items() if value is not None})
+    return events
+
+
+def test_run_events_rebuild_after_deltas_are_evicted():
+    base = {"run_id": "r1", "agent_id": "a", "model": "m"}
+    events = [
+        {**base, "event": "RunStarted", "content": "start", "created_at": 1},
+        {**base, "event": "ToolCallStarted", "content": "call", "created_at": 2, "tool": {"tool_name": "search"}},
+        {**base, "event": "ReasoningStep", "content": "step 1", "created_at": 3, "tool": {"tool_name": "search"}},
+        # The model field goes away here and comes back later
+        {"run_id": "r1", "agent_id": "a", "event": "ReasoningStep", "content": "step 2", "created_at": 4,
+         "tool": {"tool_name": "search"}},
+        {**base, "event": "ReasoningStep", "content": "step 3", "created_at": 5, "tool": {"tool_name": "search"}},
+        {**base, "event": "ToolCallCompleted", "content": "done", "created_at": 6},
+    ]
+    serializer = ProgressSerializer()
+    buffer = ReplayBuffer(max_messages=3, max_bytes=1 << 20)
+    seq = 0
+    for event in events:
+        for data in serializer.serialize(event):
+            seq += 1
+            data = {**data, "seq": seq}
+            buffer.append(seq, data["type"], encode_message(data), data)
+
+    # The header is pinned, the ToolCallStarted delta and the one dropping model are gone
+    assert seqs(buffer.snapshot()) == [1, 5, 6, 7]
+    assert rebuild(buffer.snapshot()) == events[-3:]
+    # Paging through the same window gives the same events
+    pages, after = [], 0
+    while after < seq:
+        payloads, after = buffer.page(after, seq, 1)
+        pages.extend(payloads)
+    assert rebuild(pages) == events[-3:]
+
+
+def test_pages_hold_at_least_one_message():
+    buffer = ReplayBuffer(max_messages=10, max_bytes=1 << 20)
+    for seq in range(1, 5):
+        buffer.append(*message(seq, content="x" * 50))
+    pages = []
+    after = 0
+    while after < 4:
+        payloads, after = buffer.page(after, 4, 1)
+        pages.append(seqs(payloads))
+    assert pages == [[1], [2], [3], [4]]
+
+
+def test_store_evicts_least_recently_touched_sessions():
+    one = len(message(1, content="x" * 100)[2])
+    evicted = []
+    store = ReplayStore(max_bytes=one * 3, on_evict=evicted.append)
+    for session_id in ("a", "b", "c"):
+        store.append(session_id, *message(1, content="x" * 100))
+    store.touch("a")
+    store.append("d", *message(1, content="x" * 100))
+    # b was touched least recently
+    assert evicted == ["b"] and list(store.buffers) == ["c", "a", "d"]
+    assert store.total_bytes == one * 3 and store.eviction_count == 1
+
+    # Appending counts as a touch too
+    store.append("c", *message(2, content="x" * 100))
+    assert evicted == ["b", "a"]
+    assert store.total_bytes == sum(buffer.nbytes for buffer in store.buffers.values())
+
+
+def test_store_skips_sessions_that_are_not_evictable():
+    one = len(message(1, content="x" * 100)[2])
+    store = ReplayStore(max_bytes=one * 2, is_evictable=lambda session_id: session_id != "live")
+    store.append("live", *message(1, content="x" * 100))
+    store.append("idle", *message(1, content="x" * 100))
+    store.append("new", *message(1, content="x" * 100))
+    assert "live" in store and "idle" not in store and "new" in store
+
+    # The session being appended to is never evicted, even if that leaves the store over budget
+    store.append("new", *message(2, content="x" * 300))
+    assert "live" in store and "new" in store
+    assert store.total_bytes > store.max_bytes
+
+    assert store.remove("new") and not store.remove("new")
+    assert store.total_bytes == store.get("live").nbytes
+
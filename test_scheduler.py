@@ -0,0 +1,161 @@
+"""
+Test weighted fair queueing of waiting runs across tenants.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import task.scheduler as scheduler
+from task.scheduler import ANONYMOUS_TENANT, FairQueue, tenant_of
+
+
+class Ticket:
+    def __init__(self, tenant: str, name: str = None):
+        self.tenant = tenant
+        self.name = name or tenant
+        self.finish = 0.0
+
+    def __repr__(self):
+        return self.name
+
+
+def fair_queue(weights: dict = None, limits: dict = None, max_running: int = 100) -> FairQueue:
+    return FairQueue(weights=weights or {}, limits=limits or {}, default_max_running=max_running, max_queued=100)
+
+
+def drain(queue: FairQueue, count: int) -> list:
+    """Admit ``count`` tickets, finishing each one right away."""
+    order = []
+    for _ in range(count):
+        ticket = queue.pop()
+        order.append(ticket.tenant)
+        queue.done(ticket)
+    return order
+
+
+def test_tenants_share_slots_by_weight():
+    queue = fair_queue(weights={"interactive": 4, "batch": 1})
+    for number in range(10):
+        queue.push(Ticket("batch", f"batch{number}"))
+        queue.push(Ticket("interactive", f"interactive{number}"))
+    order = drain(queue, 10)
+    assert order.count("interactive") == 8 and order.count("batch") == 2, order
+
+
+def test_equal_weights_alternate_in_arrival_order():
+    queue = fair_queue()
+    tickets = [Ticket("a", "a1"), Ticket("a", "a2"), Ticket("b", "b1"), Ticket("b", "b2")]
+    for ticket in tickets:
+        queue.push(ticket)
+    assert list(queue) == [tickets[0], tickets[2], tickets[1], tickets[3]]
+    assert [queue.pop().name for _ in range(4)] == ["a1", "b1", "a2", "b2"]
+    assert queue.pop() is None and len(queue) == 0
+
+
+def test_newcomer_does_not_wait_behind_a_backlog():
+    queue = fair_queue()
+    for number in range(20):
+        queue.push(Ticket("busy", f"busy{number}"))
+    drain(queue, 5)
+    queue.push(Ticket("new"))
+    # Admitted within a couple of turns, not after the remaining 15
+    assert "new" in drain(queue, 2)
+
+
+def test_tenant_at_its_cap_is_skipped():
+    queue = fair_queue(limits={"capped": 1})
+    first = Ticket("capped", "capped1")
+    queue.push(first)
+    queue.push(Ticket("capped", "capped2"))
+    queue.push(Ticket("other"))
+    assert queue.pop() is first
+    # capped2 comes first in fair order, but its tenant is at its cap
+    assert queue.pop().tenant == "other"
+    assert queue.pop() is None
+    queue.done(first)
+    assert queue.pop().name == "capped2"
+
+
+def test_tickets_that_are_not_ready_keep_their_place():
+    queue = fair_queue()
+    waiting, ready = Ticket("a", "a1"), Ticket("a", "a2")
+    waiting.ready = False
+    queue.push(waiting)
+    queue.push(ready)
+    assert queue.pop() is ready
+    assert queue.pop() is None and len(queue) == 1
+    waiting.ready = True
+    assert queue.pop() is waiting
+
+
+def test_removed_ticket_gives_back_its_share():
+    queue = fair_queue()
+    queue.push(Ticket("a", "a1"))
+    dropped = Ticket("a", "a2")
+    queue.push(dropped)
+    queue.remove(dropped)
+    later = Ticket("a", "a3")
+    queue.push(later)
+    # a3 takes a2's place instead of queueing behind it
+    assert later.finish == 2.0
+    queue.push(Ticket("b", "b1"))
+    assert [queue.pop().name for _ in range(3)] == ["a1", "b1", "a3"]
+
+
+def test_idle_tenants_are_forgotten():
+    queue = fair_queue()
+    ticket = Ticket("a")
+    queue.push(ticket)
+    queue.pop()
+    assert "a" in queue.tenants
+    queue.done(ticket)
+    assert queue.tenants == {}
+
+
+def token(claims: dict, secret: str = "secret", alg: str = "HS256") -> str:
+    def b64(data: bytes) -> str:
+        return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+    signing_input = f"{b64(json.dumps({'alg': alg}).encode())}.{b64(json.dumps(claims).encode())}"
+    signature = hmac.new(secret.encode(), signing_input.encode(), hashlib.sha256).digest()
+    return f"Bearer {signing_input}.{b64(signature)}"
+
+
+def test_tenant_identity_comes_only_from_trusted_sources():
+    scheduler.TENANT_TRUSTED_PROXIES = {"10.0.0.1"}
+    scheduler.TENANT_JWT_SECRET = "secret"
+    try:
+        # The header counts only from a trusted proxy
+        assert tenant_of({"X-Tenant-ID": " acme "}, "10.0.0.1") == "acme"
+        assert tenant_of({"X-Tenant-ID": "acme"}, "10.0.0.2") == ANONYMOUS_TENANT
+
+        # Tokens count only with a good signature that has not expired
+        assert tenant_of({"Authorization": token({"tenant": "signed"})}, "10.0.0.2") == "signed"
+        assert tenant_of({"Authorization": token({"tenant": "forged"}, secret="guess")}) == ANONYMOUS_TENANT
+        assert tenant_of({"Authorization": token({"tenant": "none"}, alg="none")}) == ANONYMOUS_TENANT
+        assert tenant_of({"Authorization": token({"tenant": "old", "exp": time.time() - 1})}) == ANONYMOUS_TENANT
+        assert tenant_of({"Authorization": "Bearer not-a-jwt"}, "10.0.0.1") == ANONYMOUS_TENANT
+
+        # Without a secret no token is trusted
+        scheduler.TENANT_JWT_SECRET = ""
+        assert tenant_of({"Authorization": token({"tenant": "signed"})}) == ANONYMOUS_TENANT
+    finally:
+        scheduler.TENANT_TRUSTED_PROXIES = set()
+        scheduler.TENANT_JWT_SECRET = ""
+
+
+def test_unidentified_callers_share_only_the_global_caps():
+    queue = fair_queue(max_running=1)
+    queue.max_queued = 1
+    for number in range(3):
+        queue.push(Ticket(ANONYMOUS_TENANT, f"anonymous{number}"))
+    assert not queue.is_full(ANONYMOUS_TENANT)
+    assert [queue.pop().name for _ in range(3)] == ["anonymous0", "anonymous1", "anonymous2"]
+
+    # Unless a limit is configured for it
+    queue = fair_queue(limits={ANONYMOUS_TENANT: 1})
+    queue.push(Ticket(ANONYMOUS_TENANT))
+    queue.push(Ticket(ANONYMOUS_TENANT))
+    assert queue.pop() is not None and queue.pop() is None
+
@@ -0,0 +1,107 @@
+"""
+Test that a client that drops mid-run can reconnect with last_seq and get only the messages it missed.
+"""
+import asyncio
+
+import task.task_manager as task_manager
+from fake_websocket import FakeWebSocket
+from task.task_manager import handle_client_message, run_registry, session_manager, ws_manager
+
+
+async def attach(session_id: str, last_seq: int = None) -> FakeWebSocket:
+    websocket = FakeWebSocket()
+    await ws_manager.connect(session_id, websocket, last_seq)
+    await handle_client_message(session_id, {"type": "connection_opened"})
+    return websocket
+
+
+async def detach(session_id: str, websocket: FakeWebSocket):
+    ws_manager.disconnect(session_id, websocket)
+    await handle_client_message(session_id, {"type": "connection_closed"})
+
+
+async def send(session_id: str, *numbers: int):
+    for number in numbers:
+        await ws_manager.send_json(session_id, {"type": "stream", "content": f"message {number}"})
+    # Let the writers drain their queues
+    await asyncio.sleep(0.05)
+
+
+def test_reconnect_gets_only_missed_messages():
+    async def run():
+        task_manager.SESSION_DISCONNECT_GRACE = 0.5
+        session_id, task = session_manager.create_session("resume")
+
+        first = await attach(session_id)
+        await send(session_id, 1, 2, 3)
+        assert first.seqs() == [1, 2, 3], first.seqs()
+
+        # The client drops mid-run; the run keeps producing messages
+        await detach(session_id, first)
+        await send(session_id, 4, 5)
+        assert session_manager.get_task(session_id) is task
+        assert not task.cancel_event.is_set()
+
+        second = await attach(session_id, last_seq=3)
+        await asyncio.sleep(0.05)
+        replay = [message for message in second.sent if message["type"] == "state_page"]
+        assert all(page["mode"] == "resume" for page in replay), replay
+        assert second.seqs() == [4, 5], second.seqs()
+
+        # Reattaching cancelled the teardown
+        await asyncio.sleep(0.8)
+        assert session_manager.get_task(session_id) is task
+        assert not task.cancel_event.is_set()
+        await send(session_id, 6)
+        assert second.seqs() == [4, 5, 6], second.seqs()
+
+        await detach(session_id, second)
+        session_manager.cleanup_session(session_id)
+        ws_manager.clear_session_state(session_id)
+
+    asyncio.run(run())
+
+
+def test_session_is_torn_down_after_grace_period():
+    async def run():
+        task_manager.SESSION_DISCONNECT_GRACE = 0.2
+        session_id, task = session_manager.create_session("abandon")
+        websocket = await attach(session_id)
+        await send(session_id, 1)
+        await detach(session_id, websocket)
+
+        await asyncio.sleep(0.5)
+        assert task.cancel_event.is_set()
+        assert session_manager.get_task(session_id) is None
+        assert ws_manager.get_session_state_count(session_id) == 0
+
+    asyncio.run(run())
+
+
+def test_idle_session_cancels_its_run():
+    async def run():
+        session_id, task = session_manager.create_session("idle")
+        cancelled = asyncio.Event()
+
+        async def handler():
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        handle = run_registry.start(session_id, handler())
+        # Expire it without any client ever connecting
+        idle_ttl, session_manager.idle_ttl = session_manager.idle_ttl, 0.2
+        try:
+            session_manager.touch(session_id)
+            await asyncio.wait_for(cancelled.wait(), 2.0)
+        finally:
+            session_manager.idle_ttl = idle_ttl
+        await asyncio.sleep(0)
+        assert handle.task.cancelled() and run_registry.get(session_id) is None
+        assert task.cancel_event.is_set()
+        assert session_manager.get_task(session_id) is None
+
+    asyncio.run(run())
+
@@ -0,0 +1,82 @@
+"""
+Test the Redis state backend against an in-memory stand-in for Redis.
+"""
+import asyncio
+
+from fake_redis import FakeRedis
+from service.state_backend import RedisStateBackend
+
+
+def backend(**kwargs) -> RedisStateBackend:
+    return RedisStateBackend(client=FakeRedis(), prefix="test:", ttl=60, **kwargs)
+
+
+def test_session_metadata_round_trip():
+    async def run():
+        state = backend()
+        await state.save_session("s1", {"user_query": "hi", "owner": "host:1", "created_at": 1.5})
+        assert await state.load_session("s1") == {"user_query": "hi", "owner": "host:1", "created_at": "1.5"}
+        assert state.client.server.ttls["test:session:s1"] == 60
+        assert await state.load_session("other") is None
+
+        await state.delete_session("s1")
+        assert await state.load_session("s1") is None
+
+    asyncio.run(run())
+
+
+def test_messages_load_after_a_seq():
+    async def run():
+        state = backend()
+        for seq in range(1, 6):
+            await state.append_message("s1", seq, "stream", b'{"seq":%d}' % seq)
+        assert await state.load_messages("s1") == [(seq, b'{"seq":%d}' % seq) for seq in range(1, 6)]
+        assert [seq for seq, _ in await state.load_messages("s1", after_seq=3)] == [4, 5]
+        assert await state.load_messages("s1", after_seq=5) == []
+        assert await state.load_messages("other") == []
+
+        await state.delete_messages("s1")
+        assert await state.load_messages("s1") == []
+
+    asyncio.run(run())
+
+
+def test_trimmed_header_stays_pinned():
+    async def run():
+        state = backend(max_messages=3)
+        await state.append_message("s1", 1, "task_progress_header", b"header-1")
+        for seq in range(2, 6):
+            await state.append_message("s1", seq, "task_progress", b"delta-%d" % seq)
+        server = state.client.server
+        assert len(server.data["test:replay:s1"]) == 3
+        assert server.ttls["test:pinned:s1"] == 60
+
+        # The header fell out of the replay set but comes back in front
+        assert await state.load_messages("s1") == [(1, b"header-1"), (3, b"delta-3"), (4, b"delta-4"), (5, b"delta-5")]
+        assert [seq for seq, _ in await state.load_messages("s1", after_seq=4)] == [5]
+
+        # A newer header replaces it, and is not sent twice while still in the set
+        await state.append_message("s1", 6, "task_progress_header", b"header-6")
+        assert await state.load_messages("s1") == [(4, b"delta-4"), (5, b"delta-5"), (6, b"header-6")]
+
+        await state.delete_messages("s1")
+        assert "test:pinned:s1" not in server.data
+
+    asyncio.run(run())
+
+
+def test_writes_are_applied_in_order_behind_the_caller():
+    async def run():
+        state = backend()
+        state.write("save_session", "s1", {"user_query": "hi"})
+        state.write("append_message", "s1", 1, "stream", b"one")
+        state.write("delete_session", "s1")
+        # Nothing has been sent yet; the caller never waits on Redis
+        assert state.client.commands == []
+        await state.flush()
+        assert await state.load_session("s1") is None
+        assert await state.load_messages("s1") == [(1, b"one")]
+        assert state.client.commands.index("zadd") < state.client.commands.index("delete")
+
+    asyncio.run(run())
+
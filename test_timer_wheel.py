@@ -0,0 +1,122 @@
+"""
+Test the timer wheel: firing order across cascading levels, cancelling and timeouts.
+"""
+import asyncio
+
+from service.timer_wheel import TimerWheel
+
+
+def small_wheel() -> TimerWheel:
+    # 4 slots per level, so timers a few ticks out already start on levels 1 and 2
+    return TimerWheel(tick=0.01, slots=4, levels=3)
+
+
+def test_timers_fire_in_deadline_order_across_levels():
+    async def run():
+        wheel = small_wheel()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        fired = []
+        # Level 0, level 1 (4+ ticks) and level 2 (16+ ticks), scheduled out of order
+        for delay in (0.25, 0.02, 0.07, 0.5, 0.12):
+            wheel.call_later(delay, lambda delay=delay: fired.append((delay, loop.time() - started)))
+        assert len(wheel) == 5
+        await asyncio.sleep(0.7)
+
+        assert [delay for delay, _ in fired] == [0.02, 0.07, 0.12, 0.25, 0.5], fired
+        for delay, elapsed in fired:
+            # Never early, and within a few ticks of the deadline
+            assert delay - 0.001 <= elapsed < delay + 0.05, (delay, elapsed)
+        assert len(wheel) == 0
+        # The driver stops once nothing is pending
+        assert wheel.task is None
+
+    asyncio.run(run())
+
+
+def test_timers_beyond_the_top_level_still_fire():
+    async def run():
+        # 4**3 ticks of 0.01s is 0.64s; this one has to be re-placed from the top level
+        wheel = small_wheel()
+        fired = []
+        wheel.call_later(0.9, fired.append, "late")
+        await asyncio.sleep(0.8)
+        assert fired == []
+        await asyncio.sleep(0.2)
+        assert fired == ["late"]
+
+    asyncio.run(run())
+
+
+def test_cancelled_timers_do_not_fire():
+    async def run():
+        wheel = small_wheel()
+        fired = []
+        keep = wheel.call_later(0.05, fired.append, "keep")
+        drop = wheel.call_later(0.2, fired.append, "drop")
+        drop.cancel()
+        drop.cancel()  # Safe to repeat
+        assert len(wheel) == 1
+        await asyncio.sleep(0.3)
+        assert fired == ["keep"]
+        keep.cancel()  # Safe after it fired
+        assert len(wheel) == 0
+
+    asyncio.run(run())
+
+
+def test_coroutine_callbacks_run_as_tasks():
+    async def run():
+        wheel = small_wheel()
+        done = asyncio.Event()
+
+        async def callback():
+            done.set()
+
+        wheel.call_later(0.02, callback)
+        await asyncio.wait_for(done.wait(), timeout=1)
+
+    asyncio.run(run())
+
+
+def test_timeout_raises_timeout_error():
+    async def run():
+        wheel = small_wheel()
+        try:
+            async with wheel.timeout(0.05):
+                await asyncio.sleep(1)
+        except asyncio.TimeoutError:
+            pass
+        else:
+            raise AssertionError("expected a timeout")
+
+        # A block that finishes in time is left alone and its timer is cancelled
+        async with wheel.timeout(0.5):
+            await asyncio.sleep(0.01)
+        assert len(wheel) == 0
+        if hasattr(asyncio.Task, "cancelling"):
+            # The wheel took back its cancel request
+            assert asyncio.current_task().cancelling() == 0
+
+    asyncio.run(run())
+
+
+def test_outside_cancel_in_the_same_tick_is_not_swallowed():
+    async def run():
+        wheel = small_wheel()
+        task = asyncio.current_task()
+        try:
+            async with wheel.timeout(0.05):
+                # Lands in the same tick as the deadline
+                wheel.call_later(0.05, task.cancel)
+                await asyncio.sleep(1)
+        except asyncio.TimeoutError:
+            raise AssertionError("the outside cancel was turned into a timeout")
+        except asyncio.CancelledError:
+            return "cancelled"
+
+    if hasattr(asyncio.Task, "uncancel"):
+        assert asyncio.run(run()) == "cancelled"
+    else:
+        print("  skipped: tasks do not count cancel requests before Python 3.11")
+